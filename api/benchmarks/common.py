@@ -0,0 +1,70 @@
+"""Helpers shared by the benchmark scripts."""
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+BENCHMARK_DIR = Path(__file__).parent
+API_DIR = BENCHMARK_DIR.parent
+RESULTS_DIR = BENCHMARK_DIR / 'results'
+
+
+def git_revision() -> dict:
+    def git(*arguments: str) -> str:
+        return subprocess.run(['git', *arguments], cwd=API_DIR, capture_output=True, text=True).stdout.strip()
+    return {'commit': git('rev-parse', 'HEAD') or None, 'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+def write_result(benchmark: str, label: str, output: Path, config: dict, result: dict) -> Path:
+    """Write the result with the metadata needed to compare runs of different commits."""
+    revision = git_revision()
+    output = output or RESULTS_DIR / f'{benchmark}-{time.strftime("%Y%m%d-%H%M%S")}-{(revision["commit"] or "unknown")[:8]}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        'benchmark': benchmark,
+        'label': label,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git': revision,
+        'python': platform.python_version(),
+        'config': {key: str(value) if isinstance(value, Path) else value for key, value in config.items()},
+        **result,
+    }, indent=2))
+    return output
+
+
+def start_server(base_url: str, workers: int, response_cache: bool) -> subprocess.Popen:
+    """Start uvicorn with the API, environment variables are passed through."""
+    env = dict(os.environ)
+    env.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='odapi_metrics_'))
+    if not response_cache:
+        # Otherwise most requests are answered from the cache of the workers, not the database.
+        env['ODAPI_RESPONSE_CACHE_MAX_BYTES'] = '0'
+    port = int(base_url.rsplit(':', 1)[1].split('/')[0])
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'odapi:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=API_DIR,
+        env=env,
+    )
+
+
+async def wait_for_server(base_url: str, timeout: float = 60) -> None:
+    deadline = time.perf_counter() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f'{base_url}/status/pool') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.perf_counter() > deadline:
+                raise SystemExit(f'API at {base_url} did not start within {timeout}s.')
+            await asyncio.sleep(0.5)
@@ -0,0 +1,82 @@
+"""Compare results of benchmarks/load.py or benchmarks/serializers.py, e.g. of two commits.
+
+    python benchmarks/compare.py results/main.json results/my-branch.json
+
+Prints the metrics of every run with the change relative to the first run (the baseline).
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Optional
+
+MIB = 1024**2
+
+LOAD_METRICS = (
+    ('req/s', lambda summary: summary['throughput_rps']),
+    ('p50 ms', lambda summary: summary['latency_ms']['p50']),
+    ('p95 ms', lambda summary: summary['latency_ms']['p95']),
+    ('p99 ms', lambda summary: summary['latency_ms']['p99']),
+    ('errors', lambda summary: summary['errors']),
+)
+
+SERIALIZER_METRICS = (
+    ('median ms', lambda case: case['milliseconds']['median']),
+    ('min ms', lambda case: case['milliseconds']['min']),
+    ('peak Python MiB', lambda case: round(case['peak_python_bytes'] / MIB, 1)),
+    ('peak Arrow MiB', lambda case: round(case['peak_arrow_bytes'] / MIB, 1)),
+    ('output MiB', lambda case: round(case['output_bytes'] / MIB, 1)),
+)
+
+
+def change(value: Optional[float], baseline: Optional[float]) -> str:
+    if value is None:
+        return '-'
+    if not baseline or value == baseline:
+        return f'{value:g}'
+    return f'{value:g} ({(value - baseline) / baseline:+.0%})'
+
+
+def print_table(title: str, runs: list[dict], metrics: tuple, summaries: list[Optional[dict]], extra: tuple = ()) -> None:
+    print(f'\n{title}')
+    rows = [['', *[run['name'] for run in runs]]]
+    for name, metric in metrics:
+        values = [metric(summary) if summary else None for summary in summaries]
+        rows.append([name, *[change(value, values[0]) for value in values]])
+    for name, values in extra:
+        rows.append([name, *[change(value, values[0]) for value in values]])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+def compare_load(runs: list[dict]) -> None:
+    rss = [round(run['server']['peak_rss_bytes'] / MIB) if run['server']['peak_rss_bytes'] else None for run in runs]
+    print_table('all requests', runs, LOAD_METRICS, [run['summary'] for run in runs], extra=(('peak RSS MiB', rss),))
+    for scenario in sorted({name for run in runs for name in run['scenarios']}):
+        print_table(scenario, runs, LOAD_METRICS, [run['scenarios'].get(scenario) for run in runs])
+
+
+def compare_serializers(runs: list[dict]) -> None:
+    for case in sorted({name for run in runs for name in run['cases']}):
+        print_table(case, runs, SERIALIZER_METRICS, [run['cases'].get(case) for run in runs])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('results', type=Path, nargs='+', help='Result files of the same benchmark, the first one is the baseline.')
+    args = parser.parse_args()
+    runs = []
+    for path in args.results:
+        result = json.loads(path.read_text())
+        name = result.get('label') or (result['git']['commit'] or path.stem)[:8]
+        runs.append({'name': name, **result})
+    if len({run['benchmark'] for run in runs}) > 1:
+        parser.error('Results of different benchmarks can not be compared.')
+    if runs[0]['benchmark'] == 'serializers':
+        compare_serializers(runs)
+    else:
+        compare_load(runs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""Concurrent load test against the API, seeded by benchmarks/seed.py.
+
+Sends a weighted mix of requests (formats, geo_codes and geometry modes) from
+`--concurrency` clients for `--duration` seconds and writes the latency percentiles,
+the throughput and the peak memory of the server to a JSON file. Compare two runs,
+e.g. before and after a commit, with benchmarks/compare.py.
+
+Either start the API yourself and pass its process id with `--server-pid`, or let this
+script start uvicorn with `--start-server` (environment variables are passed through):
+
+    python benchmarks/load.py --start-server --workers 4 --duration 60 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+from typing import Optional
+
+import aiohttp
+
+from common import RESULTS_DIR
+from common import start_server
+from common import wait_for_server
+from common import write_result
+
+DEFAULT_MANIFEST = RESULTS_DIR / 'seed.json'
+GEO_CODE_WEIGHTS = {'polg': 6, 'bezk': 3, 'kant': 1}
+_SERVER_TIMING = re.compile(r'([\w-]+);dur=([\d.]+)')
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    weight: int
+    path: Callable[[random.Random, dict], str]
+
+
+def pick_geo(rnd: random.Random, manifest: dict) -> tuple[str, int]:
+    geo_code = rnd.choices(list(GEO_CODE_WEIGHTS), weights=list(GEO_CODE_WEIGHTS.values()))[0]
+    return geo_code, rnd.randint(1, manifest['geo_values'][geo_code])
+
+
+def pick_indicator(rnd: random.Random, manifest: dict) -> int:
+    return rnd.choice(manifest['indicator_ids'])
+
+
+def indicator(suffix: str = '', query: str = '') -> Callable[[random.Random, dict], str]:
+    def path(rnd: random.Random, manifest: dict) -> str:
+        geo_code, _ = pick_geo(rnd, manifest)
+        return f'/indicator/{geo_code}/{pick_indicator(rnd, manifest)}{suffix}{query}'
+    return path
+
+
+def portrait(suffix: str = '', query: str = '') -> Callable[[random.Random, dict], str]:
+    def path(rnd: random.Random, manifest: dict) -> str:
+        geo_code, geo_value = pick_geo(rnd, manifest)
+        return f'/portrait/{geo_code}/{geo_value}{suffix}{query}'
+    return path
+
+
+def batch(rnd: random.Random, manifest: dict) -> str:
+    ids = rnd.sample(manifest['indicator_ids'], k=min(5, len(manifest['indicator_ids'])))
+    kanton = rnd.randint(1, manifest['geo_values']['kant'])
+    return '/batch/polg?' + '&'.join(f'indicator_id={i}' for i in ids) + f'&kanton_bfs_id={kanton}&measure=zahl'
+
+
+def indicator_geo_value(rnd: random.Random, manifest: dict) -> str:
+    geo_code, geo_value = pick_geo(rnd, manifest)
+    return f'/indicator/{geo_code}/{pick_indicator(rnd, manifest)}?geo_value={geo_value}&join_indicator=true'
+
+
+# Weights roughly follow the access logs: mostly GeoJSON of one indicator, some downloads.
+SCENARIOS = (
+    Scenario('indicator_geojson', 20, indicator()),
+    Scenario('indicator_geojson_point', 10, indicator(query='?geometry_mode=point&join_geo=true')),
+    Scenario('indicator_geojson_border', 5, indicator(query='?geometry_mode=border')),
+    Scenario('indicator_geojson_simple_500m', 10, indicator(query='?geometry_mode=border_simple_500_meter&join_geo=true')),
+    Scenario('indicator_geojson_deduplicated', 3, indicator(query='?geometry_mode=border_simple_100_meter&geometry_layout=deduplicated')),
+    Scenario('indicator_geo_value', 10, indicator_geo_value),
+    Scenario('indicator_csv', 5, indicator('/csv')),
+    Scenario('indicator_parquet', 5, indicator('/parquet', '?geometry_mode=border_simple_500_meter')),
+    Scenario('indicator_ndjson', 3, indicator('/ndjson')),
+    Scenario('indicator_xlsx', 2, indicator('/xlsx', '?measure=zahl')),
+    Scenario('portrait_geojson', 10, portrait(query='?join_indicator=true')),
+    Scenario('portrait_parquet', 3, portrait('/parquet')),
+    Scenario('values', 3, lambda rnd, manifest: f'/values/{pick_geo(rnd, manifest)[0]}?measure=zahl'),
+    Scenario('batch', 5, batch),
+    Scenario('indicators', 2, lambda rnd, manifest: f'/indicators/{pick_geo(rnd, manifest)[0]}'),
+)
+
+
+@dataclass
+class Sample:
+    scenario: str
+    status: int
+    seconds: float
+    size: int
+    server_timing: dict[str, float]
+
+
+def percentile(values: list[float], q: float) -> Optional[float]:
+    """Percentile with linear interpolation between the closest ranks, values must be sorted."""
+    if not values:
+        return None
+    rank = (len(values) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def summarize(samples: list[Sample], seconds: float) -> dict:
+    latencies = sorted(sample.seconds * 1000 for sample in samples)
+    phases = defaultdict(list)
+    for sample in samples:
+        for name, duration in sample.server_timing.items():
+            phases[name].append(duration)
+    return {
+        'requests': len(samples),
+        'errors': sum(sample.status >= 400 for sample in samples),
+        'throughput_rps': round(len(samples) / seconds, 2) if seconds else None,
+        'bytes': sum(sample.size for sample in samples),
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 2) if latencies else None,
+            **{f'p{q}': round(value, 2) if (value := percentile(latencies, q)) is not None else None for q in (50, 95, 99)},
+            'max': round(latencies[-1], 2) if latencies else None,
+        },
+        # Mean duration of the phases from the Server-Timing header (only for requests, which have the phase).
+        'server_timing_ms': {name: round(sum(values) / len(values), 2) for name, values in sorted(phases.items())},
+    }
+
+
+def process_tree(pid: int) -> list[int]:
+    pids = [pid]
+    for parent in pids:
+        for task in Path(f'/proc/{parent}/task').glob('*/children'):
+            try:
+                pids.extend(int(child) for child in task.read_text().split())
+            except FileNotFoundError:
+                continue
+    return pids
+
+
+def rss_bytes(pid: int) -> int:
+    """Resident memory of a process and all its children (e.g. the uvicorn workers), Linux only."""
+    total = 0
+    for child in process_tree(pid):
+        try:
+            status = Path(f'/proc/{child}/status').read_text()
+        except FileNotFoundError:
+            continue
+        if match := re.search(r'^VmRSS:\s+(\d+) kB', status, re.MULTILINE):
+            total += int(match.group(1)) * 1024
+    return total
+
+
+async def sample_memory(pid: int, peak: dict, interval: float = 0.25) -> None:
+    while True:
+        peak['rss_bytes'] = max(peak['rss_bytes'], rss_bytes(pid))
+        await asyncio.sleep(interval)
+
+
+async def client(
+    session: aiohttp.ClientSession,
+    base_url: str,
+    scenarios: tuple[Scenario, ...],
+    manifest: dict,
+    rnd: random.Random,
+    deadline: float,
+    samples: list[Sample],
+) -> None:
+    weights = [scenario.weight for scenario in scenarios]
+    while time.perf_counter() < deadline:
+        scenario = rnd.choices(scenarios, weights=weights)[0]
+        url = base_url + scenario.path(rnd, manifest)
+        started = time.perf_counter()
+        try:
+            async with session.get(url) as response:
+                size = 0
+                async for chunk in response.content.iter_any():
+                    size += len(chunk)
+                status = response.status
+                timing = {name: float(duration) for name, duration in _SERVER_TIMING.findall(response.headers.get('Server-Timing', ''))}
+        except (aiohttp.ClientError, TimeoutError):
+            status, size, timing = 599, 0, {}
+        samples.append(Sample(scenario.name, status, time.perf_counter() - started, size, timing))
+
+
+async def run_load(args: argparse.Namespace, manifest: dict, scenarios: tuple[Scenario, ...], server_pid: Optional[int]) -> dict:
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    peak = {'rss_bytes': 0}
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector, headers={'Accept-Encoding': 'identity'}) as session:
+        if args.warmup > 0:
+            warmup_samples = []
+            deadline = time.perf_counter() + args.warmup
+            await asyncio.gather(*[
+                client(session, args.base_url, scenarios, manifest, random.Random(args.seed - i - 1), deadline, warmup_samples)
+                for i in range(args.concurrency)
+            ])
+        memory = asyncio.create_task(sample_memory(server_pid, peak)) if server_pid else None
+        samples = []
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            client(session, args.base_url, scenarios, manifest, random.Random(args.seed + i), started + args.duration, samples)
+            for i in range(args.concurrency)
+        ])
+        seconds = time.perf_counter() - started
+        if memory:
+            memory.cancel()
+    by_scenario = defaultdict(list)
+    for sample in samples:
+        by_scenario[sample.scenario].append(sample)
+    return {
+        'duration_seconds': round(seconds, 2),
+        'summary': summarize(samples, seconds),
+        'scenarios': {name: summarize(by_scenario[name], seconds) for name in sorted(by_scenario)},
+        'server': {
+            'pid': server_pid,
+            'processes': len(process_tree(server_pid)) if server_pid else None,
+            'peak_rss_bytes': peak['rss_bytes'] or None,
+        },
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8088', help='URL of the API.')
+    parser.add_argument('--manifest', type=Path, default=DEFAULT_MANIFEST, help='Manifest written by benchmarks/seed.py.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of concurrent clients.')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to measure.')
+    parser.add_argument('--warmup', type=float, default=10, help='Seconds of load before the measurement, e.g. to fill the caches.')
+    parser.add_argument('--timeout', type=float, default=120, help='Timeout per request in seconds.')
+    parser.add_argument('--scenario', action='append', choices=[scenario.name for scenario in SCENARIOS], help='Only run these scenarios (repeatable).')
+    parser.add_argument('--seed', type=int, default=42, help='Seed for the choice of the requests.')
+    parser.add_argument('--server-pid', type=int, help='Process id of the API to measure its memory (with its children).')
+    parser.add_argument('--start-server', action='store_true', help='Start uvicorn with the API for the run.')
+    parser.add_argument('--workers', type=int, default=4, help='Number of uvicorn workers with --start-server.')
+    parser.add_argument('--response-cache', action='store_true', help='Keep the response cache enabled with --start-server.')
+    parser.add_argument('--label', help='Free text stored in the result, e.g. the name of the change.')
+    parser.add_argument('--output', type=Path, help='Path of the result (default: benchmarks/results/load-<timestamp>-<commit>.json).')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    manifest = json.loads(args.manifest.read_text())
+    scenarios = tuple(scenario for scenario in SCENARIOS if not args.scenario or scenario.name in args.scenario)
+    server = start_server(args.base_url, args.workers, args.response_cache) if args.start_server else None
+    try:
+        if server:
+            asyncio.run(wait_for_server(args.base_url))
+        result = asyncio.run(run_load(args, manifest, scenarios, server.pid if server else args.server_pid))
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+
+    output = write_result(
+        'load',
+        args.label,
+        args.output,
+        config={key: value for key, value in vars(args).items() if key not in ('output', 'label')},
+        result={'seed': {key: manifest[key] for key in ('config', 'geo_values', 'rows') if key in manifest}, **result},
+    )
+
+    summary = result['summary']
+    print(f'{summary["requests"]} requests, {summary["errors"]} errors, {summary["throughput_rps"]} req/s')
+    print('latency ms: ' + ', '.join(f'{key} {value}' for key, value in summary['latency_ms'].items()))
+    if result['server']['peak_rss_bytes']:
+        print(f'peak RSS: {result["server"]["peak_rss_bytes"] / 1024**2:.0f} MiB')
+    print(f'result: {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Record parquet files, like COPY returns them, as fixtures for benchmarks/serializers.py.
+
+The /parquet endpoints answer with the unchanged output of COPY ... TO STDOUT (FORMAT parquet),
+therefore they are recorded from a running API, e.g. one seeded by benchmarks/seed.py:
+
+    python benchmarks/record_fixtures.py --base-url http://127.0.0.1:8088 --indicator-id 5 --geo-value 230
+
+Without a database, `--synthetic` writes files with the same schema and generated geometries.
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+
+import aiohttp
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+from common import BENCHMARK_DIR
+from common import start_server
+from common import wait_for_server
+
+FIXTURES_DIR = BENCHMARK_DIR / 'fixtures'
+
+# Name of the fixture and the request, which returns it.
+FIXTURES = {
+    'indicator_polg_border': '/indicator/polg/{indicator_id}/parquet?geometry_mode=border&join_geo=true&join_indicator=true',
+    'indicator_polg_simple_100m': '/indicator/polg/{indicator_id}/parquet',
+    'indicator_kant_border': '/indicator/kant/{indicator_id}/parquet?geometry_mode=border',
+    'portrait_polg': '/portrait/polg/{geo_value}/parquet?join_indicator=true&geometry_mode=border',
+    'values_polg': '/values/polg/parquet',
+}
+
+INDICATOR_GROUP_COLUMNS = [name for i in range(1, 5) for name in (f'group_{i}_name', f'group_{i}_value')]
+INDICATOR_COLUMNS = [
+    'indicator_name', 'topic_1', 'topic_2', 'topic_3', 'topic_4', 'indicator_unit', 'indicator_description',
+]
+
+
+async def record(args: argparse.Namespace) -> dict:
+    recorded = {}
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600)) as session:
+        for name, path in FIXTURES.items():
+            path = path.format(indicator_id=args.indicator_id, geo_value=args.geo_value)
+            async with session.get(args.base_url + path) as response:
+                if response.status != 200:
+                    raise SystemExit(f'{path}: HTTP {response.status} {await response.text()}')
+                content = await response.read()
+            (args.fixtures / f'{name}.parquet').write_bytes(content)
+            recorded[name] = {'source': args.base_url + path}
+            print(f'{name}: {len(content) / 1024**2:.1f} MiB', flush=True)
+    return recorded
+
+
+def star_polygons(rng: np.random.Generator, count: int, vertices: int) -> np.ndarray:
+    """Jittered polygons on a grid over Switzerland (EPSG:4326), like benchmarks/seed.py generates them."""
+    xmin, ymin, xmax, ymax = 5.96, 45.82, 10.49, 47.81
+    cols = int(np.ceil(np.sqrt(count * (xmax - xmin) / (ymax - ymin))))
+    cell = (xmax - xmin) / cols
+    index = np.arange(count)
+    centers = np.stack([xmin + cell * (index % cols + 0.5), ymin + cell * (index // cols + 0.5)], axis=1)
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radii = cell / 2 * (0.75 + 0.25 * rng.random((count, vertices)))
+    rings = centers[:, None, :] + radii[:, :, None] * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    rings = np.concatenate([rings, rings[:, :1]], axis=1)
+    polygons = shapely.set_srid(shapely.multipolygons(shapely.polygons(rings)[:, None]), 4326)
+    return shapely.to_wkb(polygons, include_srid=True)
+
+
+def decimals(values: np.ndarray) -> pa.Array:
+    return pa.array([Decimal(f'{value:.9f}') for value in values], type=pa.decimal128(32, 9))
+
+
+def synthetic_indicator(rng: np.random.Generator, geo_values: int, vertices: int, periods: int, join: bool, geo_code: str = 'polg') -> pa.Table:
+    """Rows of one indicator with two measures, the columns of build_indicator_query."""
+    geometries = star_polygons(rng, geo_values, vertices)
+    geo = np.repeat(np.arange(1, geo_values + 1), periods * 2)
+    years = np.tile(np.repeat(np.arange(date.today().year - periods, date.today().year), 2), geo_values)
+    rows = len(geo)
+    data = {
+        'indicator_id': pa.array(np.full(rows, 5), pa.int16()),
+        'geo_code': pa.array([geo_code] * rows),
+        'geo_value': pa.array(geo, pa.int16()),
+        'period_type': pa.array(['duedate'] * rows),
+        'period_code': pa.array(['year'] * rows),
+        'period_ref_from': pa.array([date(year, 1, 1) for year in years], pa.date32()),
+        'period_ref': pa.array([date(year, 12, 31) for year in years], pa.date32()),
+        **{name: pa.nulls(rows, pa.string()) for name in INDICATOR_GROUP_COLUMNS},
+        'measure_code': pa.array(['zahl', 'pro1000'] * (rows // 2)),
+        'indicator_value_numeric': decimals(rng.random(rows) * 100000),
+        'indicator_value_text': pa.nulls(rows, pa.string()),
+        'source_id': pa.array(np.full(rows, 3), pa.int16()),
+        'source': pa.array(['Quelle 3'] * rows),
+    }
+    if join:
+        data.update({name: pa.array([f'{name} 5'] * rows) for name in INDICATOR_COLUMNS})
+        data.update({
+            'geo_name': pa.array([f'Gemeinde {value}' for value in geo]),
+            'bezirk_bfs_id': pa.array(1 + (geo - 1) * 140 // max(geo_values, 1), pa.int16()),
+            'bezirk_name': pa.array([f'Bezirk {1 + (value - 1) * 140 // max(geo_values, 1)}' for value in geo]),
+            'kanton_bfs_id': pa.array(1 + (geo - 1) * 26 // max(geo_values, 1), pa.int16()),
+            'kanton_name': pa.array([f'Kanton {1 + (value - 1) * 26 // max(geo_values, 1)}' for value in geo]),
+        })
+    data['geometry'] = pa.array(geometries[geo - 1], pa.binary())
+    return pa.table(data)
+
+
+def synthetic_portrait(rng: np.random.Generator, indicators: int, vertices: int, periods: int) -> pa.Table:
+    """Rows of all indicators for one geo_value, which all have the same geometry."""
+    table = synthetic_indicator(rng, 1, vertices, periods, join=True)
+    return pa.concat_tables([
+        table.set_column(0, 'indicator_id', pa.array(np.full(table.num_rows, indicator_id), pa.int16()))
+        for indicator_id in range(1, indicators + 1)
+    ])
+
+
+def synthetic_values(rng: np.random.Generator, geo_values: int, indicators: int) -> pa.Table:
+    """Latest value per indicator, geo_value and measure, the columns of /values."""
+    rows = indicators * geo_values * 2
+    return pa.table({
+        'indicator_id': pa.array(np.repeat(np.arange(1, indicators + 1), geo_values * 2), pa.int16()),
+        'geo_value': pa.array(np.tile(np.repeat(np.arange(1, geo_values + 1), 2), indicators), pa.int16()),
+        'measure_code': pa.array(['pro1000', 'zahl'] * (rows // 2)),
+        'indicator_value_numeric': decimals(rng.random(rows) * 100000),
+        'source_id': pa.array(np.full(rows, 3), pa.int16()),
+    })
+
+
+def synthetic(args: argparse.Namespace) -> dict:
+    rng = np.random.default_rng(args.seed)
+    tables = {
+        'indicator_polg_border': synthetic_indicator(rng, args.municipalities, args.vertices, args.periods, join=True),
+        'indicator_polg_simple_100m': synthetic_indicator(rng, args.municipalities, max(args.vertices // 8, 8), args.periods, join=False),
+        'indicator_kant_border': synthetic_indicator(rng, 26, args.vertices * 20, args.periods, join=False, geo_code='kant'),
+        'portrait_polg': synthetic_portrait(rng, args.indicators, args.vertices, args.periods),
+        'values_polg': synthetic_values(rng, args.municipalities, args.indicators),
+    }
+    created = {}
+    for name, table in tables.items():
+        # Same compression as pg_parquet.
+        pq.write_table(table, args.fixtures / f'{name}.parquet', compression='snappy')
+        created[name] = {'source': 'synthetic'}
+        print(f'{name}: {table.num_rows} rows', flush=True)
+    return created
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', type=Path, default=FIXTURES_DIR, help=f'Directory of the fixtures (default: {FIXTURES_DIR}).')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8088', help='URL of the API.')
+    parser.add_argument('--indicator-id', type=int, default=5, help='Indicator of the indicator fixtures, preferably one with groups.')
+    parser.add_argument('--geo-value', type=int, default=230, help='Municipality of the portrait fixture.')
+    parser.add_argument('--start-server', action='store_true', help='Start uvicorn with the API for the recording.')
+    parser.add_argument('--synthetic', action='store_true', help='Generate the fixtures without API and database.')
+    parser.add_argument('--municipalities', type=int, default=2100, help='Municipalities of the synthetic fixtures.')
+    parser.add_argument('--indicators', type=int, default=60, help='Indicators of the synthetic fixtures.')
+    parser.add_argument('--periods', type=int, default=5, help='Periods of the synthetic fixtures.')
+    parser.add_argument('--vertices', type=int, default=400, help='Vertices per municipality border of the synthetic fixtures.')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the synthetic fixtures.')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    args.fixtures.mkdir(parents=True, exist_ok=True)
+    if args.synthetic:
+        fixtures = synthetic(args)
+    else:
+        server = start_server(args.base_url, workers=1, response_cache=False) if args.start_server else None
+        try:
+            if server:
+                asyncio.run(wait_for_server(args.base_url))
+            fixtures = asyncio.run(record(args))
+        finally:
+            if server:
+                server.terminate()
+                server.wait(timeout=30)
+    for name, fixture in fixtures.items():
+        metadata = pq.ParquetFile(args.fixtures / f'{name}.parquet').metadata
+        fixture.update({'rows': metadata.num_rows, 'bytes': (args.fixtures / f'{name}.parquet').stat().st_size})
+    manifest = {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'fixtures': fixtures}
+    (args.fixtures / 'manifest.json').write_text(json.dumps(manifest, indent=2))
+
+
+if __name__ == '__main__':
+    main()
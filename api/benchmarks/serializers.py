@@ -0,0 +1,200 @@
+"""Micro-benchmarks of the serializers of the API, without database.
+
+Runs the conversions of response_decision and buffered_response (GeoJSON, NDJSON, CSV, XLSX,
+the deduplicated layouts and the records of /values) on the parquet fixtures of
+benchmarks/record_fixtures.py. Each combination is timed in isolation, followed by one run
+with tracemalloc and a sampler of the bytes allocated by Arrow for the peak memory:
+
+    python benchmarks/serializers.py --repeat 5 --label my-change
+
+The durations of the phases decode and geometry come from the Timings of the API.
+"""
+import argparse
+import gc
+import io
+import json
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from starlette.requests import Request
+
+from common import API_DIR
+from common import write_result
+from record_fixtures import FIXTURES_DIR
+
+sys.path.insert(0, str(API_DIR))
+import odapi  # noqa: E402
+
+FORMATS = ('json', 'ndjson', 'csv', 'xlsx', 'json_deduplicated', 'parquet_deduplicated')
+
+
+def read_xlsx(buffer: io.BytesIO) -> bytes:
+    with odapi.parquet_to_xlsx(buffer) as file:
+        return file.read()
+
+
+def values_json(buffer: io.BytesIO) -> bytes:
+    request = Request({'type': 'http', 'method': 'GET', 'path': '/values/polg', 'query_string': b'', 'headers': []})
+    return odapi.response_decision('values', request, buffer).body
+
+
+def serializer(first_path_element: str, fmt: str, geometry: bool) -> Optional[Callable[[io.BytesIO], bytes]]:
+    """The conversion of buffered_response for the format, None if the API does not offer it."""
+    if first_path_element == 'values':
+        return {'json': values_json, 'csv': lambda buffer: odapi.parquet_to_csv(buffer).getvalue(), 'xlsx': read_xlsx}.get(fmt)
+    if fmt.endswith('_deduplicated') and not geometry:
+        return None
+    return {
+        'json': lambda buffer: b''.join(odapi.iter_geojson(buffer)),
+        'ndjson': lambda buffer: b''.join(odapi.iter_geojson(buffer, newline_delimited=True)),
+        'csv': lambda buffer: odapi.parquet_to_csv(buffer).getvalue(),
+        'xlsx': read_xlsx,
+        'json_deduplicated': lambda buffer: b''.join(odapi.iter_json_deduplicated(buffer)),
+        'parquet_deduplicated': lambda buffer: odapi.deduplicate_parquet_geometry(buffer).getvalue(),
+    }[fmt]
+
+
+class ArrowPeak:
+    """Peak of pa.total_allocated_bytes() above the start, sampled by a thread.
+
+    The memory pool of Arrow is not replaced, buffers allocated before
+    could otherwise be released to the wrong pool. Short spikes between two
+    samples are missed, the peak is a lower bound.
+    """
+
+    def __init__(self, interval: float = 0.001):
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._start = 0
+        self.peak = 0
+
+    def _sample(self) -> None:
+        while True:
+            self.peak = max(self.peak, pa.total_allocated_bytes() - self._start)
+            if self._stop.wait(self._interval):
+                return
+
+    def __enter__(self) -> 'ArrowPeak':
+        self._start = pa.total_allocated_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def measure(func: Callable[[io.BytesIO], bytes], data: bytes, repeat: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        func(io.BytesIO(data))
+
+    durations = []
+    phases = defaultdict(float)
+    for _ in range(repeat):
+        gc.collect()
+        timings = odapi.Timings()
+        token = odapi._request_timings.set(timings)
+        start = time.perf_counter()
+        output = func(io.BytesIO(data))
+        durations.append(time.perf_counter() - start)
+        odapi._request_timings.reset(token)
+        for name, seconds in timings.phases.items():
+            phases[name] += seconds
+    del output
+
+    # Separate run, tracemalloc slows down the allocations of Python objects.
+    # Arrow allocates outside of the Python heap, its peak is sampled by ArrowPeak.
+    gc.collect()
+    tracemalloc.start()
+    try:
+        with ArrowPeak() as arrow_peak:
+            output_bytes = len(func(io.BytesIO(data)))
+        _, python_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    milliseconds = [duration * 1000 for duration in durations]
+    return {
+        'milliseconds': {
+            'min': round(min(milliseconds), 2),
+            'median': round(statistics.median(milliseconds), 2),
+            'mean': round(statistics.mean(milliseconds), 2),
+            'stdev': round(statistics.stdev(milliseconds), 2) if len(milliseconds) > 1 else 0.0,
+        },
+        'phases_ms': {name: round(seconds * 1000 / repeat, 2) for name, seconds in sorted(phases.items())},
+        'output_bytes': output_bytes,
+        'peak_python_bytes': python_peak,
+        'peak_arrow_bytes': arrow_peak.peak,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', type=Path, default=FIXTURES_DIR, help=f'Directory of the fixtures (default: {FIXTURES_DIR}).')
+    parser.add_argument('--fixture', action='append', help='Only these fixtures (repeatable), e.g. values_polg.')
+    parser.add_argument('--format', action='append', choices=FORMATS, help='Only these formats (repeatable).')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per fixture and format.')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed runs before the timed ones.')
+    parser.add_argument('--label', help='Free text stored in the result, e.g. the name of the change.')
+    parser.add_argument('--output', type=Path, help='Path of the result (default: benchmarks/results/serializers-<timestamp>-<commit>.json).')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    manifest_path = args.fixtures / 'manifest.json'
+    if not manifest_path.exists():
+        raise SystemExit(f'No fixtures in {args.fixtures}, run benchmarks/record_fixtures.py first.')
+    fixtures = json.loads(manifest_path.read_text())['fixtures']
+
+    cases = {}
+    for name in fixtures:
+        if args.fixture and name not in args.fixture:
+            continue
+        data = (args.fixtures / f'{name}.parquet').read_bytes()
+        schema = pq.read_schema(io.BytesIO(data))
+        first_path_element = name.split('_')[0]
+        for fmt in args.format or FORMATS:
+            func = serializer(first_path_element, fmt, geometry='geometry' in schema.names)
+            if func is None:
+                continue
+            try:
+                case = measure(func, data, args.repeat, args.warmup)
+            except odapi.HTTPException as exc:
+                # E.g. too many rows for XLSX, the API answers with an error as well.
+                print(f'{name}/{fmt}: skipped, {exc.detail}')
+                continue
+            cases[f'{name}/{fmt}'] = case
+            print(
+                f'{name}/{fmt}: {case["milliseconds"]["median"]} ms, '
+                f'peak {case["peak_python_bytes"] / 1024**2:.0f} MiB Python, '
+                f'{case["peak_arrow_bytes"] / 1024**2:.0f} MiB Arrow',
+                flush=True,
+            )
+
+    output = write_result(
+        'serializers',
+        args.label,
+        args.output,
+        config={key: value for key, value in vars(args).items() if key not in ('output', 'label')},
+        result={
+            'versions': {module.__name__: module.__version__ for module in (pa, odapi.shapely, odapi.xlsxwriter, odapi.pd)},
+            'fixtures': fixtures,
+            'cases': cases,
+        },
+    )
+    print(f'result: {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,174 @@
+import asyncio
+import base64
+import bisect
 import datetime as dt
+import decimal
+import hashlib
 import io
+import json
+import logging
 import os
+import queue
+import random
 import re
+import secrets
+import tempfile
 import textwrap
+import threading
+import time
 from abc import ABC
+from collections import OrderedDict
+from collections import deque
+from contextlib import asynccontextmanager
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
+from dataclasses import replace
 from enum import Enum
+from typing import IO
+from typing import AsyncIterator
+from typing import Awaitable
+from typing import Callable
+from typing import Hashable
+from typing import Iterable
+from typing import Iterator
 from typing import Optional
 from typing import Union
 
-import geopandas as gpd
+import asyncpg
 import networkx as nx
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 import pyarrow.parquet as pq
+import prometheus_client
+from prometheus_client import multiprocess
+import shapely
+import xlsxwriter
 import pytest
 from dotenv import load_dotenv
 from fastapi import Depends
 from fastapi import FastAPI
+from fastapi import Header
 from fastapi import HTTPException
 from fastapi import Path
 from fastapi import Query
 from fastapi import Request
 from fastapi import Response
 from fastapi import status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.testclient import TestClient
 
 # from tabulate import tabulate
 from geoalchemy2 import Geometry
-from shapely import wkb
 from sqlalchemy import SMALLINT
 from sqlalchemy import TEXT
 from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import LargeBinary
 from sqlalchemy import MetaData
+from sqlalchemy import Select
 from sqlalchemy import Table
+from sqlalchemy import any_
+from sqlalchemy import bindparam
 from sqlalchemy import create_engine
-from sqlalchemy import literal
+from sqlalchemy import exists
+from sqlalchemy import func
+from sqlalchemy import literal_column
 from sqlalchemy import or_
 from sqlalchemy import select
+from sqlalchemy import tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import distinct_on
 from sqlalchemy.engine import Engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import NoSuchTableError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.expression import Alias
+from starlette.routing import Match
 
 # DATABASE ###################################################################
 load_dotenv()
 
+# Uvicorn only configures its own loggers. Without a handler and level, the
+# records of the odapi logger (e.g. the request log) would be dropped below WARNING.
+LOG_LEVEL = os.getenv('ODAPI_LOG_LEVEL', 'INFO').upper()
+logger = logging.getLogger('odapi')
+logger.setLevel(LOG_LEVEL)
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+    logger.addHandler(_log_handler)
+
 
 GROUP_TOTAL_NAME = 'GROUP TOTAL'
 GROUP_TOTAL_ID = 1
 EXCEL_MAX_ROWS = 1_048_575
 
+# XLSX exports are written to a temporary file, which stays in memory up to
+# this size and is moved to disk beyond.
+XLSX_SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+# Parquet falls back to plain encoding once the dictionary page exceeds the
+# limit (default 1 MiB), which a handful of borders already do.
+PARQUET_DICTIONARY_PAGESIZE_LIMIT = 256 * 1024 * 1024
+
+# Rows per record batch when converting parquet to CSV or GeoJSON. GeoJSON
+# features with borders are much larger than CSV rows, keep batches smaller.
+CSV_BATCH_ROWS = 65_536
+GEOJSON_BATCH_ROWS = 8_192
+
+# Connection pool settings per uvicorn worker. Each worker holds two pools:
+# the asyncpg pool of the data endpoints with up to DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW
+# connections and the SQLAlchemy pool for metadata (reflection, data version,
+# geo dims and catalogs) with up to DB_SYNC_POOL_SIZE + DB_SYNC_POOL_MAX_OVERFLOW.
+# Therefore the maximum connections to Postgres are:
+# workers * (DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW + DB_SYNC_POOL_SIZE + DB_SYNC_POOL_MAX_OVERFLOW)
+DB_POOL_SIZE = int(os.getenv('SQLALCHEMY_POOL_SIZE', '5'))
+DB_POOL_MAX_OVERFLOW = int(os.getenv('SQLALCHEMY_POOL_MAX_OVERFLOW', '10'))
+DB_SYNC_POOL_SIZE = int(os.getenv('SQLALCHEMY_SYNC_POOL_SIZE', '1'))
+DB_SYNC_POOL_MAX_OVERFLOW = int(os.getenv('SQLALCHEMY_SYNC_POOL_MAX_OVERFLOW', '2'))
+DB_POOL_PRE_PING = os.getenv('SQLALCHEMY_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+DB_POOL_RECYCLE_SECONDS = int(os.getenv('SQLALCHEMY_POOL_RECYCLE', '1800'))
+
+# Queries are compiled for Postgres independent of the driver. The pyformat
+# placeholders of the templates are filled by `bind_template()`.
+SQL_DIALECT = postgresql.psycopg2.dialect()
+
+# Maximum number of compiled query templates held per worker.
+QUERY_TEMPLATE_CACHE_SIZE = int(os.getenv('ODAPI_QUERY_TEMPLATE_CACHE_SIZE', '1024'))
+
+# Parquet responses are streamed from COPY in chunks of COPY_STREAM_CHUNK_BYTES.
+# At most COPY_STREAM_QUEUE_SIZE chunks are held in memory per request.
+COPY_STREAM_CHUNK_BYTES = int(os.getenv('ODAPI_COPY_STREAM_CHUNK_BYTES', str(64 * 1024)))
+COPY_STREAM_QUEUE_SIZE = int(os.getenv('ODAPI_COPY_STREAM_QUEUE_SIZE', '16'))
+
+# Response cache per worker. Set ODAPI_RESPONSE_CACHE_MAX_BYTES=0 to disable.
+# The data version marker is polled at most every DATA_VERSION_TTL_SECONDS.
+# Responses of these paths also get an ETag, independent of the cache.
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('ODAPI_RESPONSE_CACHE_MAX_BYTES', str(256 * 1024**2)))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv('ODAPI_RESPONSE_CACHE_MAX_ENTRY_BYTES', str(32 * 1024**2)))
+RESPONSE_CACHE_PATH_PREFIXES = (
+    '/indicators/', '/indicator/', '/portrait/', '/batch/', '/matrix/', '/values/', '/municipalities/', '/districts/', '/cantons/',
+)
+# Upper bound for the lists of the batch endpoint.
+BATCH_MAX_INDICATORS = int(os.getenv('ODAPI_BATCH_MAX_INDICATORS', '100'))
+BATCH_MAX_GEO_VALUES = int(os.getenv('ODAPI_BATCH_MAX_GEO_VALUES', '3000'))
+DATA_VERSION_TTL_SECONDS = float(os.getenv('ODAPI_DATA_VERSION_TTL', '60'))
+
+# Admin endpoints are disabled, as long as no token is set.
+ADMIN_TOKEN = os.getenv('ODAPI_ADMIN_TOKEN')
+
+# Opt-in: COPY queries slower than this get explained with EXPLAIN (ANALYZE, BUFFERS).
+# EXPLAIN ANALYZE runs the query again, use the sample rate to explain only a fraction.
+SLOW_QUERY_SECONDS = float(os.environ['ODAPI_SLOW_QUERY_SECONDS']) if os.getenv('ODAPI_SLOW_QUERY_SECONDS') else None
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv('ODAPI_SLOW_QUERY_SAMPLE_RATE', '1.0'))
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv('ODAPI_SLOW_QUERY_BUFFER_SIZE', '50'))
+SLOW_QUERY_EXPLAIN_TIMEOUT_SECONDS = float(os.getenv('ODAPI_SLOW_QUERY_EXPLAIN_TIMEOUT', '120'))
+
 DOC__GEOMETRY_MODE = textwrap.dedent("""
     Optional. Will join the coordinates of the geometries. Default is `border_simple_100m`.
     **Be careful, this can create a big response and may take some time**.
@@ -65,6 +187,35 @@ DOC__GEOMETRY_MODE = textwrap.dedent("""
 """)
 
 
+DOC__GEOMETRY_LAYOUT = textwrap.dedent("""
+    Optional. Layout of the geometries in the response. Default is `inline`.
+    Use `deduplicated` for time series, where the same geometry would be repeated for every period.
+
+    Possible values:
+
+    | Value | Description |
+    | --- | --- |
+    | `inline` | Every row contains its geometry. |
+    | `deduplicated` | Every geometry is returned once. Parquet stores `geometry` as dictionary encoded column. JSON returns the rows in `data` and the GeoJSON geometries in `geometries`, keyed by `geo_value`. Only available for Parquet and JSON. |
+
+""")
+
+
+DOC__CURSOR = textwrap.dedent("""
+    Optional. Continuation token for paging through large results with `limit`.
+    Pass an empty `cursor` (`?limit=1000&cursor=`) for the first page. Rows are then sorted and a full page returns the header `X-Next-Cursor`.
+    Pass its value as `cursor` to get the next page. The last page has no `X-Next-Cursor`.
+    Unlike `skip`, every page is equally fast.
+""")
+
+
+DOC__FIELDS = textwrap.dedent("""
+    Optional. Comma separated list of the columns to return, e.g. `geo_value,period_ref,indicator_value_numeric`.
+    Default returns all columns. `geometry` is a column as well, omit it to get no geometries at all.
+    Tables, which only provide columns that are not requested, are not joined. Therefore, fewer columns are also faster.
+""")
+
+
 DOC__GEO_CODE = textwrap.dedent("""
     Geographic level to return.
 
@@ -78,8 +229,49 @@ DOC__GEO_CODE = textwrap.dedent("""
 """)
 
 
-def get_sync_engine() -> Engine:
-    return create_engine(os.environ['SQLALCHEMY_DATABASE_URL_SYNC'])
+def create_sync_engine() -> Engine:
+    """Create the pooled engine of one worker, only used for metadata.
+
+    The data endpoints use the asyncpg pool, therefore this pool stays small.
+    """
+    return create_engine(
+        os.environ['SQLALCHEMY_DATABASE_URL_SYNC'],
+        pool_size=DB_SYNC_POOL_SIZE,
+        max_overflow=DB_SYNC_POOL_MAX_OVERFLOW,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_recycle=DB_POOL_RECYCLE_SECONDS,
+    )
+
+
+def get_sync_engine(request: Request) -> Engine:
+    return request.app.state.db_sync
+
+
+async def create_async_pool() -> asyncpg.Pool:
+    """Create the asyncpg pool, used for the COPY queries of the data endpoints.
+
+    Connections are opened on demand (min_size=0) and closed again after being
+    idle for DB_POOL_RECYCLE_SECONDS.
+    """
+    url = os.getenv('SQLALCHEMY_DATABASE_URL_ASYNC', os.environ['SQLALCHEMY_DATABASE_URL_SYNC'])
+    dsn = make_url(url).set(drivername='postgresql').render_as_string(hide_password=False)
+    return await asyncpg.create_pool(
+        dsn,
+        min_size=0,
+        max_size=DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW,
+        max_inactive_connection_lifetime=DB_POOL_RECYCLE_SECONDS,
+        init=check_standard_conforming_strings,
+    )
+
+
+async def check_standard_conforming_strings(conn: asyncpg.Connection) -> None:
+    """Refuse connections, on which the literals of `sql_literal()` would be unsafe.
+
+    COPY has no parameters, the values are quoted client side. Only doubling
+    the quotes is correct as long as backslashes are no escape characters.
+    """
+    if conn.get_settings().standard_conforming_strings != 'on':
+        raise RuntimeError('The asyncpg pool requires standard_conforming_strings = on.')
 
 
 def get_metadata():
@@ -152,6 +344,28 @@ class TableApi(TableDefinition):
     TABLE_NAME = 'full_mart_ogd_api'
 
 
+class TableApiCurrent(TableDefinition):
+    """Rows of TableApi with knowledge_date_to IS NULL, rebuilt by the asset mart_ogd_api.
+
+    Not partitioned and stored in the order of (geo_code, indicator_id), therefore
+    an indicator reads contiguous pages. Portraits are answered from a covering
+    index on (geo_code, geo_value) instead of probing every partition.
+    """
+    SCHEMA = 'dbt_marts'
+    TABLE_NAME = 'mart_ogd_api_current'
+
+
+class TableApiLatest(TableDefinition):
+    """Latest value per indicator, geo_value and measure of the group totals, maintained by the asset mart_ogd_api."""
+    SCHEMA = 'dbt_marts'
+    TABLE_NAME = 'mart_ogd_api_latest'
+
+
+class TableDataVersion(TableDefinition):
+    SCHEMA = 'dbt_marts'
+    TABLE_NAME = 'mart_ogd_api_version'
+
+
 class TableGemeinde(TableDefinition):
     SCHEMA = 'dbt_marts'
     TABLE_NAME = 'dim_gemeinde'
@@ -255,6 +469,68 @@ class TableDimGroupValue(TableDefinition):
     # )
 
 
+class TableRegistry:
+    """Holds the reflected tables, so that reflection is done only once per worker.
+
+    Tables are reflected lazily on first use and then reused by all requests.
+    Aliases (e.g. for the multiple joins on dim_group) are cached as well.
+    Call `refresh()` after the structure of the tables has changed (e.g. dbt run),
+    the tables get reflected again on next use.
+    """
+
+    def __init__(self, engine: Engine):
+        self._engine = engine
+        self._lock = threading.Lock()
+        self._tables: dict[type[TableDefinition], Table] = {}
+        self._aliases: dict[tuple[type[TableDefinition], str], Alias] = {}
+
+    def get_table(self, definition: type[TableDefinition], alias: Optional[str] = None) -> Union[Table, Alias]:
+        with self._lock:
+            table = self._tables.get(definition)
+            if table is None:
+                with timed('reflect'):
+                    table = self.reflect(definition)
+                self._tables[definition] = table
+            if alias is None:
+                return table
+            key = (definition, alias)
+            if key not in self._aliases:
+                self._aliases[key] = table.alias(alias)
+            return self._aliases[key]
+
+    def reflect(self, definition: type[TableDefinition]) -> Table:
+        return definition().get_table(self._engine)
+
+    def refresh(self) -> None:
+        with self._lock:
+            self._tables.clear()
+            self._aliases.clear()
+
+    @property
+    def reflected_tables(self) -> list[str]:
+        return sorted(f'{table.schema}.{table.name}' for table in self._tables.values())
+
+
+def get_table_registry(request: Request) -> TableRegistry:
+    return request.app.state.tables
+
+
+def api_table(tables: TableRegistry, knowledge_date: bool) -> Table:
+    """Table with the indicator values.
+
+    Without a knowledge_date only the current rows are queried. They are stored
+    separately, therefore the history does not slow down these queries.
+    """
+    return tables.get_table(TableApi if knowledge_date else TableApiCurrent)
+
+
+def verify_admin_token(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Not Found')
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Invalid admin token')
+
+
 # CUSTOM CLASSES #############################################################
 class GeoCode(str, Enum):
     polg = 'polg'
@@ -270,6 +546,11 @@ class GeometryMode(str, Enum):
     border_simple_500m = 'border_simple_500_meter'
 
 
+class GeometryLayout(str, Enum):
+    inline = 'inline'
+    deduplicated = 'deduplicated'
+
+
 class Measure(str, Enum):
     zahl = 'zahl'
     pro100 = 'pro100'
@@ -277,6 +558,23 @@ class Measure(str, Enum):
     pro100000 = 'pro100000'
 
 
+# Columns of the dim_*_latest tables, containing the geometry for a GeometryMode.
+GEOMETRY_MODE_COLUMN = {
+    GeometryMode.point: 'geom_center',
+    GeometryMode.border: 'geom_border',
+    GeometryMode.border_simple_50m: 'geom_border_simple_50m',
+    GeometryMode.border_simple_100m: 'geom_border_simple_100m',
+    GeometryMode.border_simple_500m: 'geom_border_simple_500m',
+}
+
+# Columns added by join_geo, besides geo_value and geometry.
+GEO_COLUMNS = {
+    GeoCode.polg: ('geo_name', 'bezirk_bfs_id', 'bezirk_name', 'kanton_bfs_id', 'kanton_name'),
+    GeoCode.bezk: ('geo_name', 'kanton_bfs_id', 'kanton_name'),
+    GeoCode.kant: ('geo_name',),
+}
+
+
 class GeoJsonResponse(Response):
     media_type = 'application/geo+json'
 
@@ -322,6 +620,48 @@ class GeoparquetResponse(Response):
             **kwargs
         )
 
+class GeoparquetStreamingResponse(StreamingResponse):
+    media_type = GeoparquetResponse.media_type
+
+    def __init__(self, content: AsyncIterator[bytes], filename: str = 'odapi_data.parquet', status_code: int = 200, *args, **kwargs):
+        super().__init__(
+            content=content,
+            status_code=status_code,
+            headers={'Content-Disposition': f'attachment; filename={filename}'},
+            media_type=self.media_type,
+            *args,
+            **kwargs
+        )
+
+
+class XlsxStreamingResponse(StreamingResponse):
+    media_type = XlsxResponse.media_type
+
+    def __init__(self, content: Iterator[bytes], filename: str = 'odapi_data.xlsx', status_code: int = 200, *args, **kwargs):
+        super().__init__(
+            content=content,
+            status_code=status_code,
+            headers={'Content-Disposition': f'attachment; filename={filename}'},
+            media_type=self.media_type,
+            *args,
+            **kwargs
+        )
+
+
+class GeoJsonStreamingResponse(StreamingResponse):
+    media_type = GeoJsonResponse.media_type
+
+    def __init__(self, content: Iterator[bytes], status_code: int = 200, *args, **kwargs):
+        super().__init__(content=content, status_code=status_code, media_type=self.media_type, *args, **kwargs)
+
+
+class NdjsonStreamingResponse(StreamingResponse):
+    media_type = 'application/x-ndjson'
+
+    def __init__(self, content: Iterator[bytes], status_code: int = 200, *args, **kwargs):
+        super().__init__(content=content, status_code=status_code, media_type=self.media_type, *args, **kwargs)
+
+
 class TxtResponose(Response):
     media_type = 'text/plain'
 
@@ -337,64 +677,495 @@ class TxtResponose(Response):
         )
 
 
+# TIMING #####################################################################
+class Timings:
+    """Durations of the phases of one request, e.g. compile, copy or serialize_total.
+
+    Phases can run several times per request (e.g. once per record batch),
+    their durations are summed up. Phases can be nested, e.g. serialize_total
+    contains decode and geometry, so they do not add up to the total.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases: dict[str, float] = {}
+        self.rows: Optional[int] = None
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def milliseconds(self) -> dict[str, float]:
+        with self._lock:
+            return {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()}
+
+    def server_timing(self, total: float) -> str:
+        phases = {**self.milliseconds(), 'total': round(total * 1000, 1)}
+        return ', '.join(f'{name};dur={duration}' for name, duration in phases.items())
+
+
+# Set per request by the timing middleware. Context variables are copied
+# into tasks and the threadpool, therefore the phases can be timed anywhere.
+_request_timings: ContextVar[Optional[Timings]] = ContextVar('request_timings', default=None)
+_current_request: ContextVar[Optional[Request]] = ContextVar('current_request', default=None)
+
+
+def add_timing(name: str, seconds: float) -> None:
+    if (timings := _request_timings.get()) is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """Add the duration of the block to the phase `name` of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(name, time.perf_counter() - start)
+
+
+def timed_iter(name: str, iterable: Iterable) -> Iterator:
+    """Add the time spent producing the items of iterable to the phase `name`."""
+    iterator = iter(iterable)
+    while True:
+        with timed(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def record_rows(rows: int) -> None:
+    if (timings := _request_timings.get()) is not None:
+        timings.rows = rows
+
+
+# METRICS ####################################################################
+# With multiple workers, PROMETHEUS_MULTIPROC_DIR must point to an empty directory
+# before the workers start. Every worker writes its samples there and /metrics
+# aggregates the samples of all workers.
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+METRIC_REQUEST_DURATION = prometheus_client.Histogram(
+    'odapi_request_duration_seconds',
+    'Duration of requests until the body is sent.',
+    ['route', 'format', 'geo_code'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+METRIC_RESPONSE_BYTES = prometheus_client.Histogram(
+    'odapi_response_bytes',
+    'Size of the response bodies.',
+    ['route', 'format'],
+    buckets=tuple(1024 * 4 ** i for i in range(11)),
+)
+METRIC_RESPONSE_ROWS = prometheus_client.Histogram(
+    'odapi_response_rows',
+    'Rows returned by the query of a response.',
+    ['route', 'format'],
+    buckets=(1, 10, 100, 1_000, 10_000, 100_000, 1_000_000),
+)
+METRIC_COPY_DURATION = prometheus_client.Histogram(
+    'odapi_copy_duration_seconds',
+    'Duration of the COPY queries of a request.',
+    ['route'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+METRIC_RESPONSE_CACHE = prometheus_client.Counter(
+    'odapi_response_cache_requests',
+    'Requests to cacheable paths by result of the response cache (hit or miss).',
+    ['route', 'result'],
+)
+METRIC_DB_POOL_CONNECTIONS = prometheus_client.Gauge(
+    'odapi_db_pool_connections',
+    'Connections of the asyncpg pools of all workers by state (in_use, idle or max).',
+    ['state'],
+    multiprocess_mode='livesum',
+)
+
+
+def metrics_labels(request: Request) -> tuple[str, str, str]:
+    """Route template, format and geo_code of the request.
+
+    Cache hits are answered before routing, therefore the route is matched here
+    again. Unknown paths share one label, so the number of series is bounded.
+    """
+    for route in request.app.router.routes:
+        matched, child_scope = route.matches(request.scope)
+        if matched == Match.FULL:
+            break
+    else:
+        return 'unmatched', '', ''
+    fmt = re.search(r'/(parquet|csv|xlsx|ndjson|txt)$', route.path)
+    geo_code = child_scope.get('path_params', {}).get('geo_code', '')
+    return (
+        route.path,
+        fmt.group(1) if fmt else 'json',
+        geo_code if geo_code in {code.value for code in GeoCode} else '',
+    )
+
+
+def observe_request(request: Request, response: Response, size: int, timings: Timings, duration: float) -> None:
+    route, fmt, geo_code = metrics_labels(request)
+    METRIC_REQUEST_DURATION.labels(route, fmt, geo_code).observe(duration)
+    METRIC_RESPONSE_BYTES.labels(route, fmt).observe(size)
+    if timings.rows is not None:
+        METRIC_RESPONSE_ROWS.labels(route, fmt).observe(timings.rows)
+    if 'copy' in timings.phases:
+        METRIC_COPY_DURATION.labels(route).observe(timings.phases['copy'])
+    if (cache_result := response.headers.get('x-cache')) is not None:
+        METRIC_RESPONSE_CACHE.labels(route, cache_result.lower()).inc()
+
+
+def observe_pool(pool: asyncpg.Pool) -> None:
+    """Set the gauge of the pool connections, on every acquire and release and on /metrics."""
+    METRIC_DB_POOL_CONNECTIONS.labels('in_use').set(pool.get_size() - pool.get_idle_size())
+    METRIC_DB_POOL_CONNECTIONS.labels('idle').set(pool.get_idle_size())
+    METRIC_DB_POOL_CONNECTIONS.labels('max').set(pool.get_max_size())
+
+
+def metrics_registry() -> prometheus_client.CollectorRegistry:
+    if PROMETHEUS_MULTIPROC_DIR is None:
+        return prometheus_client.REGISTRY
+    registry = prometheus_client.CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
 # HELPER FUNC ################################################################
-def response_decision(first_path_element: str, request: Request, buffer: io.BytesIO):
+class GeoDim:
+    """Geo columns of one geo_code and geometry mode, indexed by geo_value.
+
+    Attaches the columns (name, parents and geometry) to the rows of a lean
+    fact query, which then does not have to join and ship them from Postgres.
+    """
+
+    def __init__(self, table: pa.Table):
+        self.table = table
+        self._geo_values = table.column('geo_value').combine_chunks()
+        self._columns = {
+            name: table.column(name).combine_chunks()
+            for name in table.column_names
+            if name != 'geo_value'
+        }
+
+    def schema(self, schema: pa.Schema, dictionary_geometry: bool = False) -> pa.Schema:
+        for name, column in self._columns.items():
+            if name == 'geometry' and dictionary_geometry:
+                schema = schema.append(pa.field(name, pa.dictionary(pa.int32(), column.type)))
+            else:
+                schema = schema.append(pa.field(name, column.type))
+        return schema
 
-    def _transform_geometry_to_wkt(gdf: gpd.GeoDataFrame):
-        """Transform geometry column to WKT."""
-        if first_path_element == 'values':
-            pass
-        else:
-            gdf['geometry'] = gdf['geometry'].apply(lambda b: wkb.loads(bytes(b)).wkt)
-        return gdf
+    def attach(self, data: Union[pa.RecordBatch, pa.Table], dictionary_geometry: bool = False):
+        """Append the geo columns in the order of the rows in data.
 
-    if re.search(f'^/{first_path_element}.*/parquet$', request.url.path):
-        return GeoparquetResponse(content=buffer)
-    elif re.search(f'^/{first_path_element}.*/csv$', request.url.path):
-        table = pq.read_table(buffer)
-        df = table.to_pandas()
-        df = _transform_geometry_to_wkt(df)
-        buffer_out = io.BytesIO()
-        df.to_csv(buffer_out, index=False)
-        return CsvResponse(content=buffer_out)
-    elif re.search(f'^/{first_path_element}.*/xlsx$', request.url.path):
-        table = pq.read_table(buffer)
-        df = table.to_pandas()
-        df = _transform_geometry_to_wkt(df)
-        if len(df.index) > EXCEL_MAX_ROWS:
-            raise HTTPException(
-                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail=(
-                    f'Too many rows. Maximum rows for Excel is {EXCEL_MAX_ROWS}. '
-                    f'You tried to export {len(gdf.index)} rows. '
-                    'Apply more filters or switch to CSV or JSON response'
-                ),
+        With `dictionary_geometry`, the geometry column references the
+        geometries of the dim instead of copying them for every row.
+        """
+        keys = data.column('geo_value')
+        indices = pc.index_in(keys, value_set=self._geo_values.cast(keys.type))
+        if isinstance(indices, pa.ChunkedArray):
+            indices = indices.combine_chunks()
+        for name, column in self._columns.items():
+            if name == 'geometry' and dictionary_geometry:
+                data = data.append_column(name, pa.DictionaryArray.from_arrays(indices, column))
+            else:
+                data = data.append_column(name, column.take(indices))
+        return data
+
+
+def read_batches(
+    buffer: io.BytesIO,
+    batch_rows: int,
+    geo_dim: Optional[GeoDim] = None,
+) -> tuple[pa.Schema, Iterator[pa.RecordBatch]]:
+    """Schema and record batches of the parquet file, with the geo columns attached."""
+    parquet_file = pq.ParquetFile(buffer)
+    schema = parquet_file.schema_arrow
+    batches = timed_iter('decode', parquet_file.iter_batches(batch_size=batch_rows))
+    if geo_dim is None:
+        return schema, batches
+    return geo_dim.schema(schema), (geo_dim.attach(batch) for batch in batches)
+
+
+def _convert_unique_wkb(column: Union[pa.Array, pa.ChunkedArray], convert: Callable) -> pa.Array:
+    """Convert a WKB column to strings with a vectorized shapely function.
+
+    Many rows share the same geometry (one per geo_value and not per
+    indicator value), therefore only the unique geometries are converted.
+    """
+    with timed('geometry'):
+        encoded = pc.dictionary_encode(column)
+        if isinstance(encoded, pa.ChunkedArray):
+            encoded = encoded.combine_chunks()
+        geometries = shapely.from_wkb(encoded.dictionary.to_numpy(zero_copy_only=False))
+        converted = pa.array(convert(geometries), type=pa.string())
+        return pc.take(converted, encoded.indices)
+
+
+def wkb_to_wkt(column: Union[pa.Array, pa.ChunkedArray]) -> pa.Array:
+    return _convert_unique_wkb(column, lambda geometries: shapely.to_wkt(geometries, rounding_precision=-1))
+
+
+def wkb_to_geojson(column: Union[pa.Array, pa.ChunkedArray]) -> pa.Array:
+    return _convert_unique_wkb(column, shapely.to_geojson)
+
+
+def _json_default(value):
+    """Serialize values, which are not supported by the json module."""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (dt.date, dt.datetime, dt.time)):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+_properties_encoder = json.JSONEncoder(separators=(',', ':'), default=_json_default)
+
+
+def iter_geojson(
+    buffer: io.BytesIO,
+    newline_delimited: bool = False,
+    batch_rows: int = GEOJSON_BATCH_ROWS,
+    geo_dim: Optional[GeoDim] = None,
+) -> Iterator[bytes]:
+    """Encode the parquet file as GeoJSON features, one chunk per record batch.
+
+    Returns a FeatureCollection or, with `newline_delimited`, one Feature per
+    line (NDJSON). Only one record batch is held in memory as features.
+    """
+    schema, batches = read_batches(buffer, batch_rows, geo_dim)
+    names = schema.names
+    property_names = [name for name in names if name != 'geometry']
+    feature_id = 0
+    first_batch = True
+
+    if not newline_delimited:
+        yield b'{"type":"FeatureCollection","features":['
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        if 'geometry' in names:
+            geometries = wkb_to_geojson(batch.column('geometry')).to_pylist()
+        else:
+            geometries = [None] * batch.num_rows
+        features = []
+        for properties, geometry in zip(batch.select(property_names).to_pylist(), geometries):
+            features.append(
+                f'{{"id":"{feature_id}","type":"Feature",'
+                f'"properties":{_properties_encoder.encode(properties)},'
+                f'"geometry":{geometry or "null"}}}'
             )
+            feature_id += 1
+        if newline_delimited:
+            yield ''.join(feature + '\n' for feature in features).encode()
+        else:
+            yield (('' if first_batch else ',') + ','.join(features)).encode()
+        first_batch = False
+    if not newline_delimited:
+        yield b']}'
+
+
+def parquet_to_csv(buffer: io.BytesIO, batch_rows: int = CSV_BATCH_ROWS, geo_dim: Optional[GeoDim] = None) -> io.BytesIO:
+    """Write the parquet file as CSV batch by batch, geometry as WKT."""
+    schema, batches = read_batches(buffer, batch_rows, geo_dim)
+    geometry_index = schema.get_field_index('geometry')
+    if geometry_index >= 0:
+        schema = schema.set(geometry_index, pa.field('geometry', pa.string()))
+
+    buffer_out = io.BytesIO()
+    with pacsv.CSVWriter(buffer_out, schema) as writer:
+        for batch in batches:
+            if geometry_index >= 0:
+                batch = batch.set_column(geometry_index, 'geometry', wkb_to_wkt(batch.column(geometry_index)))
+            writer.write_batch(batch)
+    return buffer_out
+
+
+# GeoParquet metadata of the column geometry (WKB in EPSG:4326, which is the default OGC:CRS84).
+GEOPARQUET_METADATA = json.dumps({
+    'version': '1.0.0',
+    'primary_column': 'geometry',
+    'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': []}},
+}).encode()
+
+
+def deduplicate_parquet_geometry(buffer: io.BytesIO, geo_dim: Optional[GeoDim] = None) -> io.BytesIO:
+    """Rewrite the parquet file with a dictionary encoded geometry column.
+
+    Every distinct geometry is stored once in the file and readers get a
+    DictionaryArray, which also keeps the geometries deduplicated in memory.
+    The GeoParquet metadata `geo` of COPY is kept, or added for an attached geometry.
+    """
+    table = pq.read_table(buffer)
+    index = table.schema.get_field_index('geometry')
+    if geo_dim is not None:
+        table = geo_dim.attach(table, dictionary_geometry=True)
+    elif index >= 0:
+        table = table.set_column(index, 'geometry', pc.dictionary_encode(table.column(index)))
+    metadata = table.schema.metadata or {}
+    if 'geometry' in table.column_names and b'geo' not in metadata:
+        table = table.replace_schema_metadata({**metadata, b'geo': GEOPARQUET_METADATA})
+    buffer_out = io.BytesIO()
+    pq.write_table(table, buffer_out, dictionary_pagesize_limit=PARQUET_DICTIONARY_PAGESIZE_LIMIT)
+    return buffer_out
+
+
+def iter_json_deduplicated(
+    buffer: io.BytesIO,
+    batch_rows: int = GEOJSON_BATCH_ROWS,
+    geo_dim: Optional[GeoDim] = None,
+) -> Iterator[bytes]:
+    """Encode the parquet file as rows plus a map of geometries by geo_value.
+
+    Returns `{"data": [...], "geometries": {"<geo_value>": <GeoJSON>}}`.
+    """
+    schema, batches = read_batches(buffer, batch_rows, geo_dim)
+    names = schema.names
+    property_names = [name for name in names if name != 'geometry']
+    geometries: dict[str, Optional[str]] = {}
+    first_batch = True
+
+    yield b'{"data":['
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        if 'geometry' in names:
+            geo_values = batch.column('geo_value').to_pylist()
+            for geo_value, geometry in zip(geo_values, wkb_to_geojson(batch.column('geometry')).to_pylist()):
+                geometries.setdefault(str(geo_value), geometry)
+        rows = ','.join(_properties_encoder.encode(row) for row in batch.select(property_names).to_pylist())
+        yield (('' if first_batch else ',') + rows).encode()
+        first_batch = False
+    yield b'],"geometries":{'
+    yield ','.join(
+        f'{json.dumps(geo_value)}:{geometry or "null"}' for geo_value, geometry in geometries.items()
+    ).encode()
+    yield b'}}'
+
+
+def parquet_to_xlsx(buffer: io.BytesIO, batch_rows: int = CSV_BATCH_ROWS, geo_dim: Optional[GeoDim] = None) -> IO[bytes]:
+    """Write the parquet file as XLSX into a spooled temporary file.
+
+    Uses the constant_memory mode of XlsxWriter, which flushes every row to
+    disk once the next one is written. Together with the record batches, the
+    memory stays flat independent of the number of rows.
+    """
+    num_rows = pq.ParquetFile(buffer).metadata.num_rows
+    if num_rows > EXCEL_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=(
+                f'Too many rows. Maximum rows for Excel is {EXCEL_MAX_ROWS}. '
+                f'You tried to export {num_rows} rows. '
+                'Apply more filters or switch to CSV or JSON response'
+            ),
+        )
+
+    schema, batches = read_batches(buffer, batch_rows, geo_dim)
+    names = schema.names
+    file = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_MAX_BYTES)
+    workbook = xlsxwriter.Workbook(file, {
+        'constant_memory': True,
+        'default_date_format': 'yyyy-mm-dd',
+        'remove_timezone': True,
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+    })
+    try:
+        worksheet = workbook.add_worksheet('odapi_data')
+        worksheet.write_row(0, 0, names, workbook.add_format({'bold': True}))
+        row = 1
+        for batch in batches:
+            if 'geometry' in names:
+                index = names.index('geometry')
+                batch = batch.set_column(index, 'geometry', wkb_to_wkt(batch.column(index)))
+            for values in zip(*(column.to_pylist() for column in batch.columns)):
+                worksheet.write_row(row, 0, values)
+                row += 1
+        workbook.close()
+    except BaseException:
+        file.close()
+        raise
+    file.seek(0)
+    return file
+
+
+def pivot_matrix(buffer: io.BytesIO) -> pa.Table:
+    """Pivot the long format to one row per geo_value and one column per indicator and measure.
+
+    Columns are named `<indicator_id>_<measure_code>`. The period_ref of each
+    column is stored in the schema metadata `odapi:period_ref`.
+    """
+    long = pq.read_table(buffer, columns=['indicator_id', 'measure_code', 'geo_value', 'period_ref', 'indicator_value_numeric'])
+    geo_values, rows = np.unique(long.column('geo_value').to_numpy(), return_inverse=True)
+
+    # Numeric code per column, so the columns are sorted by indicator_id and then measure_code.
+    measures = pc.dictionary_encode(pc.fill_null(long.column('measure_code'), '')).combine_chunks()
+    dictionary = measures.dictionary.to_numpy(zero_copy_only=False)
+    sorted_measures = np.sort(dictionary)
+    measure_index = np.searchsorted(sorted_measures, dictionary)[measures.indices.to_numpy()]
+    codes = long.column('indicator_id').to_numpy().astype(np.int64) * len(sorted_measures) + measure_index
+    column_codes, columns = np.unique(codes, return_inverse=True)
+
+    matrix = np.full((len(geo_values), len(column_codes)), np.nan)
+    matrix[rows, columns] = pc.cast(long.column('indicator_value_numeric'), pa.float64()).to_numpy(zero_copy_only=False)
+
+    names = [
+        f'{code // len(sorted_measures)}_{sorted_measures[code % len(sorted_measures)]}'.rstrip('_')
+        for code in column_codes
+    ]
+    periods = (
+        pa.table({'column': columns, 'period_ref': long.column('period_ref')})
+        .group_by('column')
+        .aggregate([('period_ref', 'max')])
+    )
+    period_by_name = {
+        names[column]: str(period_ref)
+        for column, period_ref in zip(periods.column('column').to_pylist(), periods.column('period_ref_max').to_pylist())
+    }
+
+    data = {'geo_value': pa.array(geo_values, type=long.schema.field('geo_value').type)}
+    for index, name in enumerate(names):
+        data[name] = pa.array(matrix[:, index], from_pandas=True)
+    return pa.table(data).replace_schema_metadata({'odapi:period_ref': json.dumps(period_by_name)})
+
+
+def matrix_to_json(table: pa.Table) -> bytes:
+    """Columnar JSON: `{"columns": {"<name>": [...]}, "period_ref": {"<name>": "<date>"}}`."""
+    columns = {name: table.column(name).to_pylist() for name in table.column_names}
+    period_ref = json.loads((table.schema.metadata or {}).get(b'odapi:period_ref', b'{}'))
+    return _properties_encoder.encode({'columns': columns, 'period_ref': period_ref}).encode()
+
 
-        # XlsxWriter seems to be slightly more performant than openpyxl.
-        buffer_out = io.BytesIO()
-        with pd.ExcelWriter(buffer_out, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='odapi_data', merge_cells=False)
-        return XlsxResponse(content=buffer_out)
+def iter_file(file: IO[bytes], chunk_size: int = COPY_STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    """Read the file chunk by chunk and close it afterwards."""
+    try:
+        while chunk := file.read(chunk_size):
+            yield chunk
+    finally:
+        file.close()
+
+
+def response_decision(first_path_element: str, request: Request, buffer: io.BytesIO, geo_dim: Optional[GeoDim] = None):
+    fmt = response_format(first_path_element, request)
+    if fmt == 'parquet':
+        return GeoparquetResponse(content=buffer)
+    elif fmt == 'csv':
+        return CsvResponse(content=parquet_to_csv(buffer, geo_dim=geo_dim))
+    elif fmt == 'xlsx':
+        return XlsxStreamingResponse(content=iter_file(parquet_to_xlsx(buffer, geo_dim=geo_dim)))
     elif request.url.path.startswith(f'/{first_path_element}'):
-        table = pq.read_table(buffer)
-        df = table.to_pandas()
         if first_path_element == 'values':
+            df = pq.read_table(buffer).to_pandas()
             return GeoJsonResponse(content=df.to_json(orient='records'))
+        elif fmt == 'ndjson':
+            return NdjsonStreamingResponse(content=iter_geojson(buffer, newline_delimited=True, geo_dim=geo_dim))
         else:
-            df['geometry'] = df['geometry'].apply(lambda b: wkb.loads(b))
-            columns_to_convert = [
-                'snapshot_date', 'knowledge_date_from', 'knowledge_date_to', 'period_ref_from', 'period_ref'
-            ]
-            convert_columns = {col: 'str' for col in df.columns if col in columns_to_convert}
-            df = df.astype(convert_columns)
-
-            # After some performance testing, it seems, that the solution with
-            # GeoDataFrame.to_geo_dict() is pretty slow. Therefore, build the
-            # GeoJSON directly and pass the raw string as custom FastAPI response.
-            assert isinstance(df, pd.DataFrame)
-            gdf = gpd.GeoDataFrame(df, geometry='geometry', crs='EPSG:4326')
-            return GeoJsonResponse(content=gdf.to_json())
+            return GeoJsonStreamingResponse(content=iter_geojson(buffer, geo_dim=geo_dim))
+
 
 def generate_indicator_tree(data: pd.DataFrame) -> Optional[str]:
 
@@ -430,242 +1201,331 @@ def generate_indicator_tree(data: pd.DataFrame) -> Optional[str]:
     return buffer.getvalue()
 
 
-# API ########################################################################
-app = FastAPI(
-    title='ODAPI - Open Data API for Switzerland',
-    docs_url='/',
-    summary='API for accessing different indicators from different geographic regions in Switzerland.',
-    description=textwrap.dedent("""
-        ## IMPORTANT
+# QUERIES ####################################################################
+@dataclass(frozen=True)
+class IndicatorQueryShape:
+    """Everything that changes the structure of an indicator query.
+
+    Filter values (like the actual indicator_id) are not part of the shape,
+    they get bound per request. Therefore, queries with the same shape can
+    share one compiled SQL template.
+    """
+    geo_code: GeoCode
+    geometry_mode: GeometryMode = GeometryMode.border_simple_100m
+    filter_indicator_id: bool = False
+    filter_indicator_ids: bool = False
+    filter_geo_value: bool = False
+    filter_geo_values: bool = False
+    filter_measure: bool = False
+    filter_knowledge_date: bool = False
+    filter_period_ref: bool = False
+    join_indicator: bool = False
+    join_geo: bool = False
+    expand_group_1: bool = False
+    expand_group_2: bool = False
+    expand_group_3: bool = False
+    expand_group_4: bool = False
+    offset: bool = False
+    limit: bool = False
+    attach_geo: bool = False
+    keyset: bool = False
+    seek: bool = False
+    fields: Optional[frozenset[str]] = None
+
+
+# Sort keys of the keyset pagination as (column of TableApi, replacement for NULL).
+# NULL must be replaced, because a row comparison with NULL is never true.
+# The partition tables have an index with the same expressions (macro mart_partition).
+INDICATOR_KEYSET = (
+    ('indicator_id', None),
+    ('geo_value', None),
+    ('period_ref', None),
+    ('measure_code', ''),
+    ('group_value_1_id', 0),
+    ('group_value_2_id', 0),
+    ('group_value_3_id', 0),
+    ('group_value_4_id', 0),
+)
+VALUES_KEYSET = (
+    ('indicator_id', None),
+    ('geo_value', None),
+)
+# Type of the cursor value per sort key. Dates are ISO strings in the cursor.
+KEYSET_TYPES = {
+    'indicator_id': int,
+    'geo_value': int,
+    'period_ref': dt.date,
+    'measure_code': str,
+    **{f'group_value_{i}_id': int for i in range(1, 5)},
+}
+
+
+def keyset_columns(tbl_api: Table, keyset: tuple) -> list:
+    return [
+        tbl_api.c[name] if default is None else func.coalesce(tbl_api.c[name], literal_column(sql_literal(default)))
+        for name, default in keyset
+    ]
+
+
+def keyset_seek(tbl_api: Table, keyset: tuple, values: Optional[list] = None):
+    """Predicate for the rows after the cursor.
+
+    Without `values`, the cursor is bound as parameters `cursor_0`, `cursor_1`, ...
+    """
+    return tuple_(*keyset_columns(tbl_api, keyset)) > tuple_(*[
+        bindparam(f'cursor_{i}') if values is None else bindparam(f'cursor_{i}', value=values[i])
+        for i in range(len(keyset))
+    ])
+
+
+def encode_cursor(values: list) -> str:
+    data = json.dumps(values, default=str, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def is_cursor_value(value, value_type: type) -> bool:
+    if value_type is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    if value_type is dt.date:
+        try:
+            dt.date.fromisoformat(value)
+        except (TypeError, ValueError):
+            return False
+        return True
+    return isinstance(value, value_type)
+
+
+def decode_cursor(cursor: str, keyset: tuple) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if (
+        not isinstance(values, list)
+        or len(values) != len(keyset)
+        or not all(is_cursor_value(value, KEYSET_TYPES[name]) for value, (name, _) in zip(values, keyset))
+    ):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid cursor.')
+    return values
+
+
+def cursor_params(cursor: Optional[str], keyset: tuple) -> dict:
+    if not cursor:
+        return {}
+    return {f'cursor_{i}': value for i, value in enumerate(decode_cursor(cursor, keyset))}
+
+
+def use_keyset(cursor: Optional[str], skip: Optional[int], limit: Optional[int]) -> bool:
+    """Keyset pagination is opt-in, an empty cursor requests the first page."""
+    if cursor is None:
+        return False
+    if skip or not limit:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='cursor can only be used together with limit and without skip.',
+        )
+    return True
+
+
+def next_cursor(buffer: io.BytesIO, keyset: tuple, limit: Optional[int]) -> Optional[str]:
+    """Cursor pointing after the last row of a full page, None after the last page."""
+    if not limit or pq.ParquetFile(buffer).metadata.num_rows < limit:
+        return None
+    table = pq.read_table(buffer, columns=[name for name, _ in keyset])
+    last_row = table.slice(table.num_rows - 1).to_pylist()[0]
+    return encode_cursor([
+        default if last_row[name] is None else last_row[name]
+        for name, default in keyset
+    ])
+
+
+def parse_fields(fields: Optional[str], *required: str) -> Optional[frozenset[str]]:
+    """Column names of the query parameter `fields`, None if all columns are requested.
+
+    The `required` columns are always part of the result, e.g. for the cursor.
+    """
+    if fields is None:
+        return None
+    names = {name.strip() for name in fields.split(',') if name.strip()}
+    if not names:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Parameter fields must contain at least one column.')
+    return frozenset(names.union(required))
+
+
+def check_fields(fields: Optional[frozenset[str]], available: Iterator[str]) -> None:
+    if fields is None:
+        return
+    if unknown := fields - set(available):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Unknown fields: {", ".join(sorted(unknown))}.',
+        )
 
-        * This API is under heavy development. Endpoints and responses **can and will change in the future**.
-        * This is **not** an official API from the Swiss Government, but just a private iniative from [myself](https://bardos.dev).
 
-        The source code of the API as well as the data transformation can be found [on Github](https://github.com/fbardos/odapi).
-    """)
-)
+def project_columns(query: Select, fields: Optional[frozenset[str]]) -> Select:
+    """Keep only the requested columns of the query, in the order of the query."""
+    check_fields(fields, query.selected_columns.keys())
+    if fields is None:
+        return query
+    return query.with_only_columns(*(column for column in query.selected_columns if column.name in fields))
 
 
-# INDICATORS #################################################################
-@app.get(
-    '/indicators/{geo_code}/txt',
-    tags=['Indicators'],
-    description='List all available indicators in a human readable format.',
-    response_class=TxtResponose,
-)
-@app.get(
-    '/indicators/{geo_code}',
-    tags=['Indicators'],
-    description='List all available indicators.',
-)
-def get_all_available_indicators(
-    request: Request,
-    db_sync: Engine = Depends(get_sync_engine),
-    geo_code: GeoCode = Path(
-        ...,
-        description=textwrap.dedent("""
-            Geographic level to return.
+def build_indicator_query(tables: TableRegistry, shape: IndicatorQueryShape) -> Select:
+    """Build the query for the indicator and portrait endpoints.
 
-            Possible values:
+    All filter values are bound parameters with the same name as the
+    corresponding query parameter of the endpoints.
+    With `attach_geo`, the geo columns and the geometry are not part of the
+    query, they get attached afterwards from the GeoDimCache.
+    With `fields`, only the requested columns are selected and dimension
+    tables without requested columns are not joined.
+    """
+    if shape.fields is not None:
+        # The complete query defines which fields are available.
+        full_shape = replace(shape, fields=None, attach_geo=False)
+        check_fields(shape.fields, build_indicator_query(tables, full_shape).selected_columns.keys())
 
-            | Value | EN | DE |
-            | --- | --- | --- |
-            | `polg` | municipality | Politische Gemeinde |
-            | `bezk` | district | Bezirk |
-            | `kant` | canton | Kanton |
-        """),
-    ),
-):
-    tbl_available_indicator = TableAvailableIndicator().get_table(db_sync)
+    def requested(*names: str) -> bool:
+        return shape.fields is None or any(name in shape.fields for name in names)
+
+    tbl_indicator = tables.get_table(TableIndicator)
+    tbl_api = api_table(tables, shape.filter_knowledge_date)
+    tbl_dim_source = tables.get_table(TableDimSource)
     query = (
-        select(
-            tbl_available_indicator.c.indicator_id,
-            tbl_available_indicator.c.indicator_name,
-            tbl_available_indicator.c.topic_1,
-            tbl_available_indicator.c.topic_2,
-            tbl_available_indicator.c.topic_3,
-            tbl_available_indicator.c.topic_4,
-            tbl_available_indicator.c.indicator_unit,
-            tbl_available_indicator.c.indicator_description,
-            tbl_available_indicator.c.measure_codes,
-        )
-        .where(tbl_available_indicator.c.geo_code == geo_code)
+        select(*(
+            tbl_api.c[name]
+            for name in (
+                'indicator_id', 'geo_code', 'geo_value', 'period_type', 'period_code', 'period_ref_from', 'period_ref',
+            )
+            if requested(name)
+        ))
+        .select_from(tbl_api)
+        .where(tbl_api.c.geo_code == bindparam('geo_code'))
     )
-    with db_sync.connect() as conn:
-        df = pd.read_sql_query(
-            sql=query.compile(dialect=db_sync.dialect),
-            con=conn,
+    # Groups are joined with an outer join, therefore they can be left out without changing the rows.
+    for i in range(1, 5):
+        if requested(f'group_{i}_name'):
+            tbl_dim_group = tables.get_table(TableDimGroup, alias=f'tbl_dim_group_{i}')
+            query = (
+                query
+                .join(tbl_dim_group, tbl_api.c[f'group_{i}_id'] == tbl_dim_group.c.group_id, isouter=True)
+                .add_columns(tbl_dim_group.c.group_name.label(f'group_{i}_name'))
+            )
+        if requested(f'group_{i}_value'):
+            tbl_dim_group_value = tables.get_table(TableDimGroupValue, alias=f'tbl_dim_group_value_{i}')
+            query = (
+                query
+                .join(tbl_dim_group_value, tbl_api.c[f'group_value_{i}_id'] == tbl_dim_group_value.c.group_value_id, isouter=True)
+                .add_columns(tbl_dim_group_value.c.group_value_name.label(f'group_{i}_value'))
+            )
+    query = query.add_columns(*(
+        tbl_api.c[name]
+        for name in ('measure_code', 'indicator_value_numeric', 'indicator_value_text', 'source_id')
+        if requested(name)
+    ))
+    if requested('source'):
+        query = (
+            query
+            .join(tbl_dim_source, tbl_api.c.source_id == tbl_dim_source.c.id)
+            .add_columns(tbl_dim_source.c.source)
         )
-        assert isinstance(df, pd.DataFrame)
-    if re.search(f'^/indicators.*/txt$', request.url.path):
-        data = generate_indicator_tree(df)
-        return TxtResponose(content=data)
     else:
-        return df.to_dict(orient='records')
+        # Only keep the rows, which the join with dim_source would return.
+        query = query.where(exists().where(tbl_dim_source.c.id == tbl_api.c.source_id))
+    if shape.keyset:
+        # The group value ids are part of the cursor, therefore they must be returned.
+        query = (
+            query
+            .add_columns(
+                tbl_api.c.group_value_1_id,
+                tbl_api.c.group_value_2_id,
+                tbl_api.c.group_value_3_id,
+                tbl_api.c.group_value_4_id,
+            )
+            .order_by(*keyset_columns(tbl_api, INDICATOR_KEYSET))
+        )
+    if shape.seek:
+        query = query.where(keyset_seek(tbl_api, INDICATOR_KEYSET))
+    if shape.filter_indicator_id:
+        query = query.where(tbl_api.c.indicator_id == bindparam('indicator_id'))
+    if shape.filter_indicator_ids:
+        # Constant array, therefore the partitions are still pruned by the planner.
+        query = query.where(tbl_api.c.indicator_id == any_(bindparam('indicator_ids')))
+    if shape.filter_geo_value:
+        query = query.where(tbl_api.c.geo_value == bindparam('geo_value'))
+    if shape.filter_geo_values:
+        query = query.where(tbl_api.c.geo_value == any_(bindparam('geo_values')))
+    if shape.filter_measure:
+        query = query.where(tbl_api.c.measure_code == bindparam('measure'))
+    if not shape.expand_group_1:
+        query = query.where(tbl_api.c._group_value_1_is_total == True)
+    if not shape.expand_group_2:
+        query = query.where(tbl_api.c._group_value_2_is_total == True)
+    if not shape.expand_group_3:
+        query = query.where(tbl_api.c._group_value_3_is_total == True)
+    if not shape.expand_group_4:
+        query = query.where(tbl_api.c._group_value_4_is_total == True)
+    if requested('knowledge_date'):
+        query = query.add_columns(bindparam('knowledge_date', type_=TEXT).label('knowledge_date'))
+    if shape.filter_knowledge_date:
+        query = (
+            query
+            .where(tbl_api.c.knowledge_date_from <= bindparam('knowledge_date'))
+            # is much faster than a coalesce (because of idx scan)
+            .where(or_(tbl_api.c.knowledge_date_to > bindparam('knowledge_date'), tbl_api.c.knowledge_date_to == None))
+        )
+    if shape.join_indicator:
+        indicator_columns = [
+            tbl_indicator.c[name]
+            for name in (
+                'indicator_name', 'topic_1', 'topic_2', 'topic_3', 'topic_4', 'indicator_unit', 'indicator_description',
+            )
+            if requested(name)
+        ]
+        if indicator_columns:
+            query = (
+                query
+                .join(tbl_indicator, tbl_api.c.indicator_id == tbl_indicator.c.indicator_id)
+                .add_columns(*indicator_columns)
+            )
+        else:
+            query = query.where(exists().where(tbl_indicator.c.indicator_id == tbl_api.c.indicator_id))
 
+    if shape.attach_geo or not requested('geometry', *GEO_COLUMNS[shape.geo_code] if shape.join_geo else ()):
+        # Only keep the rows, which the join with the geometry tables would return.
+        query = query.where(exists().where(geo_dim_key(tables, shape.geo_code) == tbl_api.c.geo_value))
+    else:
+        query = join_geo_columns(query, tables, tbl_api, shape)
+    if shape.filter_period_ref:
+        query = query.where(tbl_api.c.period_ref == bindparam('period_ref'))
+    if shape.offset:
+        query = query.offset(bindparam('skip', type_=Integer))
+    if shape.limit:
+        query = query.limit(bindparam('limit', type_=Integer))
+    return query
 
-# INDICATOR ##################################################################
-@app.get(
-    '/indicator/{geo_code}/{indicator_id}/parquet',
-    tags=['Indicator'],
-    description=textwrap.dedent("""
-        Returns as Parquet file for a selected indicator. This is the fastes way to read data.
-        Geometry is stored as serialized WKT in column `geometry`.
-    """),
-    response_class=GeoparquetResponse,
-)
-@app.get(
-    '/indicator/{geo_code}/{indicator_id}/xlsx',
-    tags=['Indicator'],
-    description=textwrap.dedent("""
-        Returns as Excel file for a selected indicator.
 
-        **Be careful, this can create a big response and may take some time**.
-        **Additionally, Microsoft Excel cannot contain a spreadsheet with more than 1,048,576 rows.**
-    """),
-    response_class=XlsxResponse,
-)
-@app.get(
-    '/indicator/{geo_code}/{indicator_id}/csv',
-    tags=['Indicator'],
-    description='Returns as CSV for a selected indicator. Can be easily parsed by frameworks like pandas or dplyr.',
-    response_class=CsvResponse,
-)
-@app.get(
-    '/indicator/{geo_code}/{indicator_id}',
-    tags=['Indicator'],
-    description='Returns a GeoJSON for a selected indicator.',
-    response_class=GeoJsonResponse,
-)
-def get_indicator(
-    request: Request,
-    geo_code: GeoCode = Path(
-        ...,
-        description=DOC__GEO_CODE,
-    ),
-    indicator_id: int = Path(..., description='Select an indicator. If you want to check all possible indicators run path `/indicator` first.'),
-    geo_value: Optional[int] = Query(None, description='ID for a selected `geo_code`. E.g. when `geo_code == polg` is selected, `geo_value == 230` will return Winterthur.'),
-    knowledge_date: Optional[str] = Query(None, examples=[dt.date.today().strftime('%Y-%m-%d')], description='Optional. Allows to query a different state of the data in the past. Format: ISO-8601'),
-    period_ref: Optional[str] = Query(None, description='Allows to filter for a specific period_ref. Format: ISO-8601, Example: `2023-12-31`'),
-    measure: Optional[Measure] = Query(None, description='Show values as simple mumber (zahl), or per 100 (pro100), per 1\'000 (pro1000) or per 100\'000 (pro100000) inhabitants. Default (none) does not filter.'),
-    join_indicator: Optional[bool] = Query(None, description='Optional. Joins information about the indicator.'),
-    join_geo: Optional[bool] = Query(None, description='Optional. Joins information about the geometry like its name or its parents.'),
-    geometry_mode: Optional[GeometryMode] = Query(
-        None,
-        description=DOC__GEOMETRY_MODE,
-    ),
-    skip: Optional[int] = Query(None, examples=[0], description='Optional. Skip the first n rows.'),
-    limit: Optional[int] = Query(None, examples=[100], description='Optional. Limit response to the set amount of rows.'),
-    expand_all_groups: Optional[bool] = Query(None, description='Optional. Expand all groups in the response.'),
-    expand_group_1: Optional[bool] = Query(None, description='Optional. Expand group 1 in the response.'),
-    expand_group_2: Optional[bool] = Query(None, description='Optional. Expand group 2 in the response.'),
-    expand_group_3: Optional[bool] = Query(None, description='Optional. Expand group 3 in the response.'),
-    expand_group_4: Optional[bool] = Query(None, description='Optional. Expand group 4 in the response.'),
-    db_sync: Engine = Depends(get_sync_engine),
-):
-    FIRST_PATH_ELEMENT = 'indicator'
-    tbl_indicator = TableIndicator().get_table(db_sync)
-    tbl_api = TableApi().get_table(db_sync)
-    tbl_gemeinde = TableGemeindeLatest().get_table(db_sync)
-    tbl_bezirk =  TableBezirkLatest().get_table(db_sync)
-    tbl_kanton = TableKantonLatest().get_table(db_sync)
-    tbl_dim_source = TableDimSource().get_table(db_sync)
-    tbl_dim_group_1 = TableDimGroup().get_table(db_sync).alias('tbl_dim_group_1')
-    tbl_dim_group_2 = TableDimGroup().get_table(db_sync).alias('tbl_dim_group_2')
-    tbl_dim_group_3 = TableDimGroup().get_table(db_sync).alias('tbl_dim_group_3')
-    tbl_dim_group_4 = TableDimGroup().get_table(db_sync).alias('tbl_dim_group_4')
-    tbl_dim_group_value_1 = TableDimGroupValue().get_table(db_sync).alias('tbl_dim_group_value_1')
-    tbl_dim_group_value_2 = TableDimGroupValue().get_table(db_sync).alias('tbl_dim_group_value_2')
-    tbl_dim_group_value_3 = TableDimGroupValue().get_table(db_sync).alias('tbl_dim_group_value_3')
-    tbl_dim_group_value_4 = TableDimGroupValue().get_table(db_sync).alias('tbl_dim_group_value_4')
-    query = (
-        select(
-            tbl_api.c.indicator_id,
-            tbl_api.c.geo_code,
-            tbl_api.c.geo_value,
-            tbl_api.c.period_type,
-            tbl_api.c.period_code,
-            tbl_api.c.period_ref_from,
-            tbl_api.c.period_ref,
-            tbl_dim_group_1.c.group_name.label('group_1_name'),
-            tbl_dim_group_value_1.c.group_value_name.label('group_1_value'),
-            tbl_dim_group_2.c.group_name.label('group_2_name'),
-            tbl_dim_group_value_2.c.group_value_name.label('group_2_value'),
-            tbl_dim_group_3.c.group_name.label('group_3_name'),
-            tbl_dim_group_value_3.c.group_value_name.label('group_3_value'),
-            tbl_dim_group_4.c.group_name.label('group_4_name'),
-            tbl_dim_group_value_4.c.group_value_name.label('group_4_value'),
-            tbl_api.c.measure_code,
-            tbl_api.c.indicator_value_numeric,
-            tbl_api.c.indicator_value_text,
-            tbl_api.c.source_id,
-            tbl_dim_source.c.source,
-        )
-        .join(tbl_dim_source, tbl_api.c.source_id == tbl_dim_source.c.id)
-        .join(tbl_dim_group_1, tbl_api.c.group_1_id == tbl_dim_group_1.c.group_id, isouter=True)
-        .join(tbl_dim_group_2, tbl_api.c.group_2_id == tbl_dim_group_2.c.group_id, isouter=True)
-        .join(tbl_dim_group_3, tbl_api.c.group_3_id == tbl_dim_group_3.c.group_id, isouter=True)
-        .join(tbl_dim_group_4, tbl_api.c.group_4_id == tbl_dim_group_4.c.group_id, isouter=True)
-        .join(tbl_dim_group_value_1, tbl_api.c.group_value_1_id == tbl_dim_group_value_1.c.group_value_id, isouter=True)
-        .join(tbl_dim_group_value_2, tbl_api.c.group_value_2_id == tbl_dim_group_value_2.c.group_value_id, isouter=True)
-        .join(tbl_dim_group_value_3, tbl_api.c.group_value_3_id == tbl_dim_group_value_3.c.group_value_id, isouter=True)
-        .join(tbl_dim_group_value_4, tbl_api.c.group_value_4_id == tbl_dim_group_value_4.c.group_value_id, isouter=True)
-        .where(tbl_api.c.indicator_id == indicator_id)
-        .where(tbl_api.c.geo_code == geo_code)
-    )
-    if measure:
-        query = query.where(tbl_api.c.measure_code == measure)
-    if geo_value:
-        query = query.where(tbl_api.c.geo_value == geo_value)
-    if any([expand_all_groups, expand_group_1]):
-        pass  # if any selection is made, do not filter the table
-    else:
-        query = query.where(tbl_api.c._group_value_1_is_total == True)
-    if any([expand_all_groups, expand_group_2]):
-        pass  # if any selection is made, do not filter the table
-    else:
-        query = query.where(tbl_api.c._group_value_2_is_total == True)
-    if any([expand_all_groups, expand_group_3]):
-        pass  # if any selection is made, do not filter the table
-    else:
-        query = query.where(tbl_api.c._group_value_3_is_total == True)
-    if any([expand_all_groups, expand_group_4]):
-        pass  # if any selection is made, do not filter the table
-    else:
-        query = query.where(tbl_api.c._group_value_4_is_total == True)
-    if knowledge_date:
-        _knowledge_date = dt.date.fromisoformat(knowledge_date).strftime('%Y-%m-%d')
-        query = (
-            query
-            .add_columns(literal(_knowledge_date).label('knowledge_date'))
-            .where(tbl_api.c.knowledge_date_from <= _knowledge_date)
-            # is much faster than a coalesce (because of idx scan)
-            .where(or_(tbl_api.c.knowledge_date_to > _knowledge_date, tbl_api.c.knowledge_date_to == None))
-        )
-    else:
-        _knowledge_date = dt.date.today().strftime('%Y-%m-%d')
-        query = (
-            query
-            .add_columns(literal(_knowledge_date).label('knowledge_date'))
-            .where(tbl_api.c.knowledge_date_to == None)
-        )
-    if join_indicator:
-        query = (
-            query
-            .join(tbl_indicator, tbl_api.c.indicator_id == tbl_indicator.c.indicator_id).add_columns(
-                tbl_indicator.c.indicator_name,
-                tbl_indicator.c.topic_1,
-                tbl_indicator.c.topic_2,
-                tbl_indicator.c.topic_3,
-                tbl_indicator.c.topic_4,
-                tbl_indicator.c.indicator_unit,
-                tbl_indicator.c.indicator_description,
-            )
-        )
+def geo_dim_key(tables: TableRegistry, geo_code: GeoCode) -> Column:
+    match geo_code:
+        case GeoCode.polg:
+            return tables.get_table(TableGemeindeLatest).c.gemeinde_bfs_id
+        case GeoCode.bezk:
+            return tables.get_table(TableBezirkLatest).c.bezirk_bfs_id
+        case GeoCode.kant:
+            return tables.get_table(TableKantonLatest).c.kanton_bfs_id
+
+
+def join_geo_columns(query: Select, tables: TableRegistry, tbl_api: Table, shape: IndicatorQueryShape) -> Select:
+    """Join the geometry tables and add the geo columns and the geometry."""
+    tbl_gemeinde = tables.get_table(TableGemeindeLatest)
+    tbl_bezirk = tables.get_table(TableBezirkLatest)
+    tbl_kanton = tables.get_table(TableKantonLatest)
+
     # The join of the geometry tables must happen before adding
     # the columns. The geometry tables are used by join_geo AND geometry_mode.
-    match geo_code:
+    match shape.geo_code:
         case GeoCode.polg:
+            tbl_geo = tbl_gemeinde
             query = (
                 query
                 .join(tbl_gemeinde, tbl_api.c.geo_value == tbl_gemeinde.c.gemeinde_bfs_id)
@@ -673,102 +1533,1321 @@ def get_indicator(
                 .join(tbl_kanton, tbl_gemeinde.c.kanton_bfs_id == tbl_kanton.c.kanton_bfs_id)
             )
         case GeoCode.bezk:
+            tbl_geo = tbl_bezirk
             query = (
                 query
                 .join(tbl_bezirk, tbl_api.c.geo_value == tbl_bezirk.c.bezirk_bfs_id)
                 .join(tbl_kanton, tbl_bezirk.c.kanton_bfs_id == tbl_kanton.c.kanton_bfs_id)
             )
         case GeoCode.kant:
+            tbl_geo = tbl_kanton
             query = (
                 query
                 .join(tbl_kanton, tbl_api.c.geo_value == tbl_kanton.c.kanton_bfs_id)
             )
 
     # If join_geo is set, add the relevant columns to the query.
-    if join_geo:
-        match geo_code:
+    if shape.join_geo:
+        match shape.geo_code:
             case GeoCode.polg:
-                query = query.add_columns(
+                columns = [
                     tbl_gemeinde.c.gemeinde_name.label('geo_name'),
                     tbl_bezirk.c.bezirk_bfs_id,
                     tbl_bezirk.c.bezirk_name,
                     tbl_kanton.c.kanton_bfs_id,
                     tbl_kanton.c.kanton_name,
-                )
+                ]
             case GeoCode.bezk:
-                query = query.add_columns(
+                columns = [
                     tbl_bezirk.c.bezirk_name.label('geo_name'),
                     tbl_kanton.c.kanton_bfs_id,
                     tbl_kanton.c.kanton_name,
-                )
+                ]
             case GeoCode.kant:
-                query = query.add_columns(
+                columns = [
                     tbl_kanton.c.kanton_name.label('geo_name'),
-                )
+                ]
+        query = query.add_columns(*(
+            column for column in columns
+            if shape.fields is None or column.name in shape.fields
+        ))
 
     # Column geometry should be the last column in the query.
-    if geometry_mode == GeometryMode.point:
-        match geo_code:
-            case GeoCode.polg:
-                query = query.add_columns(tbl_gemeinde.c.geom_center.label('geometry'))
-            case GeoCode.bezk:
-                query = query.add_columns(tbl_bezirk.c.geom_center.label('geometry'))
-            case GeoCode.kant:
-                query = query.add_columns(tbl_kanton.c.geom_center.label('geometry'))
-    elif geometry_mode == GeometryMode.border:
-        match geo_code:
-            case GeoCode.polg:
-                query = query.add_columns(tbl_gemeinde.c.geom_border.label('geometry'))
-            case GeoCode.bezk:
-                query = query.add_columns(tbl_bezirk.c.geom_border.label('geometry'))
-            case GeoCode.kant:
-                query = query.add_columns(tbl_kanton.c.geom_border.label('geometry'))
-    elif geometry_mode == GeometryMode.border_simple_50m:
-        match geo_code:
-            case GeoCode.polg:
-                query = query.add_columns(tbl_gemeinde.c.geom_border_simple_50m.label('geometry'))
-            case GeoCode.bezk:
-                query = query.add_columns(tbl_bezirk.c.geom_border_simple_50m.label('geometry'))
-            case GeoCode.kant:
-                query = query.add_columns(tbl_kanton.c.geom_border_simple_50m.label('geometry'))
-    elif geometry_mode == GeometryMode.border_simple_100m or geometry_mode is None:  # Default
-        match geo_code:
-            case GeoCode.polg:
-                query = query.add_columns(tbl_gemeinde.c.geom_border_simple_100m.label('geometry'))
-            case GeoCode.bezk:
-                query = query.add_columns(tbl_bezirk.c.geom_border_simple_100m.label('geometry'))
-            case GeoCode.kant:
-                query = query.add_columns(tbl_kanton.c.geom_border_simple_100m.label('geometry'))
-    elif geometry_mode == GeometryMode.border_simple_500m:
-        match geo_code:
-            case GeoCode.polg:
-                query = query.add_columns(tbl_gemeinde.c.geom_border_simple_500m.label('geometry'))
-            case GeoCode.bezk:
-                query = query.add_columns(tbl_bezirk.c.geom_border_simple_500m.label('geometry'))
-            case GeoCode.kant:
-                query = query.add_columns(tbl_kanton.c.geom_border_simple_500m.label('geometry'))
-    if period_ref:
-        query = query.where(tbl_api.c.period_ref == dt.date.fromisoformat(period_ref).strftime('%Y-%m-%d'))
-    if skip:
-        query = query.offset(skip)
-    if limit:
-        query = query.limit(limit)
+    if shape.fields is None or 'geometry' in shape.fields:
+        query = query.add_columns(wkb_geometry(tbl_geo.c[GEOMETRY_MODE_COLUMN[shape.geometry_mode]]))
+    return query
 
+
+def wkb_geometry(column: Column):
+    """Geometry as ISO WKB in plain bytes, like pg_parquet writes the geometry.
+
+    Used by the joined and the attached geometry, so the column has the same
+    encoding in every geometry layout. Geoalchemy2 would select EWKB otherwise.
+    """
+    return func.ST_AsBinary(column, type_=LargeBinary).label('geometry')
+
+
+def build_geo_dim_query(tables: TableRegistry, geo_code: GeoCode, geometry_mode: GeometryMode) -> Select:
+    """Query for the GeoDimCache, with the same columns as join_geo_columns."""
+    tbl_gemeinde = tables.get_table(TableGemeindeLatest)
+    tbl_bezirk = tables.get_table(TableBezirkLatest)
+    tbl_kanton = tables.get_table(TableKantonLatest)
+    match geo_code:
+        case GeoCode.polg:
+            query = (
+                select(
+                    tbl_gemeinde.c.gemeinde_bfs_id.label('geo_value'),
+                    tbl_gemeinde.c.gemeinde_name.label('geo_name'),
+                    tbl_bezirk.c.bezirk_bfs_id,
+                    tbl_bezirk.c.bezirk_name,
+                    tbl_kanton.c.kanton_bfs_id,
+                    tbl_kanton.c.kanton_name,
+                )
+                .join(tbl_bezirk, tbl_gemeinde.c.bezirk_bfs_id == tbl_bezirk.c.bezirk_bfs_id)
+                .join(tbl_kanton, tbl_gemeinde.c.kanton_bfs_id == tbl_kanton.c.kanton_bfs_id)
+            )
+            tbl_geo = tbl_gemeinde
+        case GeoCode.bezk:
+            query = (
+                select(
+                    tbl_bezirk.c.bezirk_bfs_id.label('geo_value'),
+                    tbl_bezirk.c.bezirk_name.label('geo_name'),
+                    tbl_kanton.c.kanton_bfs_id,
+                    tbl_kanton.c.kanton_name,
+                )
+                .join(tbl_kanton, tbl_bezirk.c.kanton_bfs_id == tbl_kanton.c.kanton_bfs_id)
+            )
+            tbl_geo = tbl_bezirk
+        case GeoCode.kant:
+            query = select(
+                tbl_kanton.c.kanton_bfs_id.label('geo_value'),
+                tbl_kanton.c.kanton_name.label('geo_name'),
+            )
+            tbl_geo = tbl_kanton
+    return query.add_columns(wkb_geometry(tbl_geo.c[GEOMETRY_MODE_COLUMN[geometry_mode]]))
+
+
+class QueryTemplateCache:
+    """Keeps compiled SQL per query shape, so a query is built and compiled only once.
+
+    The templates contain placeholders for the filter values, which are bound
+    per request with `bind_template()`.
+    """
+
+    def __init__(self, maxsize: int = QUERY_TEMPLATE_CACHE_SIZE):
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._templates: OrderedDict[Hashable, str] = OrderedDict()
+
+    def get(self, key: Hashable, build: Callable[[], Select]) -> str:
+        with self._lock:
+            if key in self._templates:
+                self._templates.move_to_end(key)
+                return self._templates[key]
+        with timed('compile'):
+            template = str(build().compile(dialect=SQL_DIALECT))
+        with self._lock:
+            self._templates[key] = template
+            if len(self._templates) > self._maxsize:
+                self._templates.popitem(last=False)
+        return template
+
+    def clear(self) -> None:
+        with self._lock:
+            self._templates.clear()
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+
+def get_query_templates(request: Request) -> QueryTemplateCache:
+    return request.app.state.query_templates
+
+
+def indicator_query_params(
+    geo_code: GeoCode,
+    indicator_id: Optional[int] = None,
+    geo_value: Optional[int] = None,
+    knowledge_date: Optional[str] = None,
+    period_ref: Optional[str] = None,
+    measure: Optional[Measure] = None,
+    skip: Optional[int] = None,
+    limit: Optional[int] = None,
+    indicator_ids: Optional[list[int]] = None,
+    geo_values: Optional[list[int]] = None,
+) -> dict:
+    """Values for the bound parameters of `build_indicator_query()`."""
+    if knowledge_date:
+        _knowledge_date = dt.date.fromisoformat(knowledge_date).strftime('%Y-%m-%d')
+    else:
+        _knowledge_date = dt.date.today().strftime('%Y-%m-%d')
+    return {
+        'geo_code': geo_code.value,
+        'indicator_id': indicator_id,
+        'geo_value': geo_value,
+        'knowledge_date': _knowledge_date,
+        'period_ref': dt.date.fromisoformat(period_ref).strftime('%Y-%m-%d') if period_ref else None,
+        'measure': measure.value if measure else None,
+        'skip': skip,
+        'limit': limit,
+        'indicator_ids': indicator_ids,
+        'geo_values': geo_values,
+    }
+
+
+def compile_literal(query: Select) -> str:
+    with timed('compile'):
+        return str(query.compile(dialect=SQL_DIALECT, compile_kwargs={'literal_binds': True}))
+
+
+def sql_literal(value) -> str:
+    """Render a filter value as SQL literal.
+
+    Strings are quoted by doubling the single quotes. This is only safe, as the
+    pool hands out connections with standard_conforming_strings alone
+    (see `check_standard_conforming_strings()`).
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, Enum):
+        value = value.value
+    if isinstance(value, int):
+        return str(int(value))
+    if isinstance(value, (dt.date, dt.datetime)):
+        value = value.isoformat()
+    if isinstance(value, (list, tuple)):
+        # An empty ARRAY[] has no type, the string literal gets the type of the column.
+        return 'ARRAY[' + ', '.join(sql_literal(v) for v in value) + ']' if value else "'{}'"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def bind_template(template: str, params: dict) -> str:
+    """Fill the placeholders of a compiled template with the quoted values of `params`."""
+    return template % {name: sql_literal(value) for name, value in params.items()}
+
+
+def get_async_pool(request: Request) -> asyncpg.Pool:
+    return request.app.state.db_async
+
+
+async def copy_to_output(pool: asyncpg.Pool, sql: str, output: Callable[[bytes], Awaitable]) -> None:
+    """Run the query as COPY TO STDOUT and pass the resulting parquet file to `output`.
+
+    COPY does not support parameters, therefore `sql` must already contain
+    all values (see `bind_template()`).
+    The phase `copy` only contains the time of the server. Time spent waiting
+    in `output`, e.g. on a slow client of a stream, is the phase `copy_wait`.
+    """
     # Use a new approach with COPY TO STDOUT, which is much (8x) faster than
     # gathering row by row. With the newly installed pg_parquet extension,
     # STDOUT can transfer a prebuilt parquet file, including geometry as WKB.
-    with db_sync.connect() as conn:
-        psycopg2_connection = conn.connection
-        curs = psycopg2_connection.cursor()
-        buffer = io.BytesIO()
-        copy_sql = f"""
-            COPY (
-                {query.compile(dialect=db_sync.dialect, compile_kwargs={'literal_binds': True})}
-            ) TO STDOUT WITH (FORMAT PARQUET);
+    output_duration = 0.0
+
+    async def timed_output(data: bytes):
+        nonlocal output_duration
+        start = time.perf_counter()
+        try:
+            await output(data)
+        finally:
+            output_duration += time.perf_counter() - start
+
+    acquire_start = time.perf_counter()
+    async with pool.acquire() as conn:
+        add_timing('acquire', time.perf_counter() - acquire_start)
+        observe_pool(pool)
+        copy_start = time.perf_counter()
+        await conn.copy_from_query(sql, output=timed_output, format='parquet')
+        copy_duration = time.perf_counter() - copy_start - output_duration
+    observe_pool(pool)
+    add_timing('copy', copy_duration)
+    add_timing('copy_wait', output_duration)
+    capture_slow_query(pool, sql, copy_duration)
+
+
+async def copy_to_parquet(pool: asyncpg.Pool, sql: str) -> io.BytesIO:
+    buffer = io.BytesIO()
+
+    async def write(data: bytes):
+        buffer.write(data)
+
+    await copy_to_output(pool, sql, write)
+    return buffer
+
+
+class _QueueWriter:
+    """Hands over the COPY output to a bounded queue.
+
+    Small COPY messages are merged to chunks of `chunk_size` bytes. When the
+    queue is full, the COPY waits until the client consumed some chunks.
+    """
+
+    def __init__(self, chunks: asyncio.Queue, chunk_size: int = COPY_STREAM_CHUNK_BYTES):
+        self._chunks = chunks
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+
+    async def write(self, data: bytes) -> None:
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        if self._buffer:
+            await self._chunks.put(bytes(self._buffer))
+            self._buffer.clear()
+
+
+_COPY_DONE = object()
+
+
+class CopyStream:
+    """Chunks of a COPY, which runs as separate task.
+
+    The task holds a connection of the pool until the COPY is done.
+    `aclose()` stops it, also when the chunks were never iterated.
+    """
+
+    def __init__(self, task: asyncio.Task, chunks: asyncio.Queue, first: bytes):
+        self._task = task
+        self._chunks = chunks
+        self._next: Optional[object] = first
+
+    def __aiter__(self) -> 'CopyStream':
+        return self
+
+    async def __anext__(self) -> bytes:
+        if self._next is not None:
+            item, self._next = self._next, None
+        else:
+            item = await self._chunks.get()
+        if item is _COPY_DONE or isinstance(item, Exception):
+            # Later calls must not wait for chunks, which never come.
+            self._next = _COPY_DONE
+        if item is _COPY_DONE:
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def aclose(self) -> None:
+        if not self._task.done():
+            self._task.cancel()
+
+
+async def stream_copy_to_parquet(pool: asyncpg.Pool, sql: str) -> CopyStream:
+    """Run the COPY as separate task and stream its output in chunks.
+
+    Memory per request is bounded by the size of the queue. Waits for the first
+    chunk before returning, so errors of the query are raised before the
+    response has started.
+    """
+    chunks = asyncio.Queue(maxsize=COPY_STREAM_QUEUE_SIZE)
+    writer = _QueueWriter(chunks)
+
+    async def run_copy():
+        try:
+            await copy_to_output(pool, sql, writer.write)
+            await writer.flush()
+            await chunks.put(_COPY_DONE)
+        except Exception as e:
+            await chunks.put(e)
+
+    task = asyncio.create_task(run_copy())
+    try:
+        first = await chunks.get()
+    except BaseException:
+        # The request was cancelled, e.g. the client disconnected. Without a
+        # consumer, the task would block on the full queue and keep its connection.
+        task.cancel()
+        raise
+    if isinstance(first, Exception):
+        raise first
+    return CopyStream(task, chunks, first)
+
+
+class CopyStreamingResponse(GeoparquetStreamingResponse):
+    """Parquet streamed from a running COPY, see `stream_copy_to_parquet()`.
+
+    The COPY is stopped together with the response, e.g. when the client
+    disconnected, even before the first chunk was sent.
+    """
+
+    def __init__(self, content: CopyStream, *args, **kwargs):
+        super().__init__(content, *args, **kwargs)
+        self.copy_stream = content
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.copy_stream.aclose()
+
+
+def response_format(first_path_element: str, request: Request) -> str:
+    for fmt in ('parquet', 'csv', 'xlsx', 'ndjson'):
+        if re.search(f'^/{first_path_element}.*/{fmt}$', request.url.path):
+            return fmt
+    return 'json'
+
+
+async def query_response(
+    first_path_element: str,
+    request: Request,
+    pool: asyncpg.Pool,
+    sql: str,
+    geometry_layout: GeometryLayout = GeometryLayout.inline,
+    geo_dim: Optional[GeoDim] = None,
+    keyset: Optional[tuple] = None,
+    limit: Optional[int] = None,
+) -> Response:
+    """Run the query and answer in the format requested by the path.
+
+    Parquet is passed through from Postgres chunk by chunk. All other formats
+    need the whole parquet file for the conversion, which runs in the threadpool
+    to not block the event loop. GeoJSON is encoded and sent batch by batch.
+    With `geo_dim`, its columns get attached to the rows during the conversion.
+    With `keyset`, the cursor of the next page is returned in header X-Next-Cursor.
+    """
+    fmt = response_format(first_path_element, request)
+    if geometry_layout == GeometryLayout.deduplicated and fmt not in ('parquet', 'json'):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'geometry_layout={geometry_layout.value} is only available for Parquet and JSON responses.',
+        )
+    if fmt == 'parquet' and geometry_layout == GeometryLayout.inline and keyset is None:
+        return CopyStreamingResponse(content=await stream_copy_to_parquet(pool, sql))
+
+    # The page is limited, therefore it can be held in memory to read the last row.
+    buffer = await copy_to_parquet(pool, sql)
+    response = await buffered_response(first_path_element, request, buffer, fmt, geometry_layout, geo_dim)
+    if keyset is not None and (cursor := await run_in_threadpool(next_cursor, buffer, keyset, limit)):
+        response.headers['X-Next-Cursor'] = cursor
+    return response
+
+
+async def buffered_response(
+    first_path_element: str,
+    request: Request,
+    buffer: io.BytesIO,
+    fmt: str,
+    geometry_layout: GeometryLayout,
+    geo_dim: Optional[GeoDim],
+) -> Response:
+    """Answer with the parquet file of the query, which is completely in memory.
+
+    Streamed bodies are serialized while they are sent, their phase
+    `serialize_total` is only part of the log and not of the header Server-Timing.
+    The phase includes the nested phases `decode` and `geometry`.
+    """
+    record_rows(pq.ParquetFile(buffer).metadata.num_rows)
+    if geometry_layout == GeometryLayout.deduplicated:
+        if fmt == 'parquet':
+            with timed('serialize_total'):
+                content = await run_in_threadpool(deduplicate_parquet_geometry, buffer, geo_dim)
+            return GeoparquetResponse(content=content)
+        return StreamingResponse(content=timed_iter('serialize_total', iter_json_deduplicated(buffer, geo_dim=geo_dim)), media_type='application/json')
+    if first_path_element != 'values' and fmt == 'json':
+        return GeoJsonStreamingResponse(content=timed_iter('serialize_total', iter_geojson(buffer, geo_dim=geo_dim)))
+    if first_path_element != 'values' and fmt == 'ndjson':
+        return NdjsonStreamingResponse(content=timed_iter('serialize_total', iter_geojson(buffer, newline_delimited=True, geo_dim=geo_dim)))
+    with timed('serialize_total'):
+        return await run_in_threadpool(response_decision, first_path_element, request, buffer, geo_dim)
+
+
+def attach_geo_in_arrow(first_path_element: str, request: Request, geometry_layout: GeometryLayout) -> bool:
+    """Whether the geo columns get attached from the GeoDimCache instead of the query.
+
+    Only plain parquet is streamed from Postgres as it is, all other responses
+    are converted anyway and can attach the columns without extra cost.
+    """
+    return (
+        response_format(first_path_element, request) != 'parquet'
+        or geometry_layout == GeometryLayout.deduplicated
+    )
+
+
+# CACHE ######################################################################
+class DataVersion:
+    """Published version of the data, written by the Dagster asset mart_ogd_api.
+
+    The marker is polled at most every `ttl` seconds, so most requests do not
+    touch the database for it. Registered callbacks are run once the version
+    changes, e.g. to drop caches holding data of the previous version.
+    A failed lookup keeps the previous version. Returns None, when the marker
+    was never read. Caches must be bypassed then.
+    """
+
+    def __init__(self, engine: Engine, tables: TableRegistry, ttl: float = DATA_VERSION_TTL_SECONDS):
+        self._engine = engine
+        self._tables = tables
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._checked_at: Optional[float] = None
+        self._callbacks: list[Callable[[], None]] = []
+
+    def on_change(self, callback: Callable[[], None]) -> None:
+        self._callbacks.append(callback)
+
+    def fetch(self) -> Optional[str]:
+        tbl_version = self._tables.get_table(TableDataVersion)
+        with self._engine.connect() as conn:
+            version = conn.execute(select(func.max(tbl_version.c.data_version))).scalar_one()
+        return None if version is None else str(version)
+
+    def _is_fresh(self) -> bool:
+        return self._checked_at is not None and time.monotonic() - self._checked_at < self._ttl
+
+    def get(self) -> Optional[str]:
+        if self._is_fresh():
+            return self._version
+        with self._lock:
+            if self._is_fresh():
+                return self._version
+            try:
+                version = self.fetch()
+            except (SQLAlchemyError, NoSuchTableError):
+                logger.exception(f'Could not read data version, keeping {self._version}.')
+                version = self._version
+            self._checked_at = time.monotonic()
+            previous, self._version = self._version, version
+        if previous is not None and previous != version:
+            logger.info(f'Data version changed from {previous} to {version}.')
+            for callback in self._callbacks:
+                try:
+                    callback()
+                except Exception:
+                    logger.exception(f'Callback {callback!r} of the data version change failed.')
+        return version
+
+
+class GeoDimCache:
+    """Geo columns of the dim_*_latest tables, per geo_code and geometry mode.
+
+    The tables hold only a few thousand rows, which are loaded once per worker
+    instead of joined and shipped with every indicator query.
+    """
+
+    def __init__(self, engine: Engine, tables: TableRegistry):
+        self._engine = engine
+        self._tables = tables
+        self._lock = threading.Lock()
+        self._dims: dict[tuple[GeoCode, GeometryMode], pa.Table] = {}
+
+    def load(self, geo_code: GeoCode, geometry_mode: GeometryMode) -> pa.Table:
+        query = build_geo_dim_query(self._tables, geo_code, geometry_mode)
+        with self._engine.connect() as conn:
+            df = pd.read_sql_query(sql=query, con=conn)
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+    def get(
+        self,
+        geo_code: GeoCode,
+        geometry_mode: GeometryMode,
+        join_geo: bool = False,
+        fields: Optional[frozenset[str]] = None,
+    ) -> GeoDim:
+        key = (geo_code, geometry_mode)
+        with self._lock:
+            if key not in self._dims:
+                with timed('geo_dims'):
+                    self._dims[key] = self.load(geo_code, geometry_mode)
+            table = self._dims[key]
+        names = table.column_names if join_geo else ['geo_value', 'geometry']
+        if fields is not None:
+            names = [name for name in names if name == 'geo_value' or name in fields]
+        return GeoDim(table.select(names))
+
+    def geo_values_of_parent(self, geo_code: GeoCode, geometry_mode: GeometryMode, parent: str, parent_value: int) -> list[int]:
+        """All geo_values of geo_code, which belong to the parent, e.g. kanton_bfs_id = 1."""
+        table = self.get(geo_code, geometry_mode, join_geo=True).table
+        if parent not in table.column_names:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f'Filter {parent} is not available for geo_code {geo_code.value}.',
+            )
+        mask = pc.equal(table.column(parent), pa.scalar(parent_value, table.column(parent).type))
+        return table.filter(mask).column('geo_value').to_pylist()
+
+    def warm(self, geometry_mode: GeometryMode = GeometryMode.border_simple_100m) -> None:
+        for geo_code in GeoCode:
+            self.get(geo_code, geometry_mode)
+
+    def refresh(self) -> None:
+        """Load all cached dims again, e.g. after a new data version was published."""
+        with self._lock:
+            keys = list(self._dims)
+            self._dims.clear()
+        for geo_code, geometry_mode in keys:
+            self.get(geo_code, geometry_mode)
+
+    @property
+    def size(self) -> int:
+        return sum(table.nbytes for table in self._dims.values())
+
+    def __len__(self) -> int:
+        return len(self._dims)
+
+
+@dataclass
+class IndicatorCatalog:
+    """Available indicators of one geo_code, with the rendered tree and a search index.
+
+    The index maps every token of the names, topics, units and descriptions
+    to the positions of the indicators containing it. Tokens are kept sorted,
+    therefore all tokens with a prefix are found with a binary search.
+    """
+    records: list[dict]
+    tree: Optional[str]
+    index: dict[str, set[int]]
+    tokens: list[str]
+
+    SEARCH_COLUMNS = ('indicator_name', 'topic_1', 'topic_2', 'topic_3', 'topic_4', 'indicator_unit', 'indicator_description')
+
+    @staticmethod
+    def tokenize(text) -> list[str]:
+        return re.findall(r'\w+', str(text).casefold()) if text is not None else []
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'IndicatorCatalog':
+        records = df.to_dict(orient='records')
+        index: dict[str, set[int]] = {}
+        for position, record in enumerate(records):
+            for column in ('indicator_id', *cls.SEARCH_COLUMNS):
+                for token in cls.tokenize(record.get(column)):
+                    index.setdefault(token, set()).add(position)
+        return cls(
+            records=records,
+            tree=generate_indicator_tree(df) if len(df) > 0 else '',
+            index=index,
+            tokens=sorted(index),
+        )
+
+    def _positions(self, term: str) -> set[int]:
+        """Indicators with a token starting with term."""
+        positions: set[int] = set()
+        for i in range(bisect.bisect_left(self.tokens, term), len(self.tokens)):
+            if not self.tokens[i].startswith(term):
+                break
+            positions |= self.index[self.tokens[i]]
+        return positions
+
+    def search(self, q: str, limit: Optional[int] = None) -> list[dict]:
+        """Indicators matching all terms of q (as prefix), best matches in the name first."""
+        terms = self.tokenize(q)
+        if not terms:
+            return []
+        positions = set.intersection(*(self._positions(term) for term in terms))
+
+        def rank(position: int) -> tuple:
+            name_tokens = self.tokenize(self.records[position]['indicator_name'])
+            in_name = sum(any(token.startswith(term) for token in name_tokens) for term in terms)
+            return (-in_name, self.records[position]['indicator_id'])
+
+        return [self.records[position] for position in sorted(positions, key=rank)[:limit]]
+
+
+class IndicatorCatalogCache:
+    """Indicator catalog per geo_code, which only changes with a new data version."""
+
+    def __init__(self, engine: Engine, tables: TableRegistry):
+        self._engine = engine
+        self._tables = tables
+        self._lock = threading.Lock()
+        self._catalogs: dict[GeoCode, IndicatorCatalog] = {}
+
+    def load(self, geo_code: GeoCode) -> pd.DataFrame:
+        tbl_available_indicator = self._tables.get_table(TableAvailableIndicator)
+        query = (
+            select(
+                tbl_available_indicator.c.indicator_id,
+                tbl_available_indicator.c.indicator_name,
+                tbl_available_indicator.c.topic_1,
+                tbl_available_indicator.c.topic_2,
+                tbl_available_indicator.c.topic_3,
+                tbl_available_indicator.c.topic_4,
+                tbl_available_indicator.c.indicator_unit,
+                tbl_available_indicator.c.indicator_description,
+                tbl_available_indicator.c.measure_codes,
+            )
+            .where(tbl_available_indicator.c.geo_code == geo_code)
+        )
+        with self._engine.connect() as conn:
+            df = pd.read_sql_query(
+                sql=query.compile(dialect=self._engine.dialect),
+                con=conn,
+            )
+            assert isinstance(df, pd.DataFrame)
+        return df
+
+    def get(self, geo_code: GeoCode) -> IndicatorCatalog:
+        with self._lock:
+            if geo_code not in self._catalogs:
+                self._catalogs[geo_code] = IndicatorCatalog.from_frame(self.load(geo_code))
+            return self._catalogs[geo_code]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._catalogs.clear()
+
+    def __len__(self) -> int:
+        return len(self._catalogs)
+
+
+def get_indicator_catalogs(request: Request) -> IndicatorCatalogCache:
+    return request.app.state.indicator_catalogs
+
+
+def get_geo_dims(request: Request) -> GeoDimCache:
+    return request.app.state.geo_dims
+
+
+def get_data_version(request: Request) -> DataVersion:
+    return request.app.state.data_version
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    status_code: int
+    media_type: Optional[str]
+    headers: dict[str, str]
+
+    def __len__(self) -> int:
+        return len(self.body)
+
+    def to_response(self) -> Response:
+        return Response(
+            content=self.body,
+            status_code=self.status_code,
+            media_type=self.media_type,
+            headers=self.headers,
+        )
+
+
+class ResponseCache:
+    """In memory LRU cache for serialized responses, bounded by total size in bytes.
+
+    Keys contain the data version, therefore entries of an old data version
+    are never served again. `clear()` only frees the memory.
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, max_entry_bytes: int = RESPONSE_CACHE_MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(data_version: str, request: Request) -> tuple:
+        """Data version and normalized request.
+
+        Without knowledge_date, the rows contain today as knowledge_date
+        (see `indicator_query_params()`), therefore today is part of the key.
         """
-        curs.copy_expert(copy_sql, buffer)
-        curs.close()
-        return response_decision(FIRST_PATH_ELEMENT, request, buffer)
+        today = None if request.query_params.get('knowledge_date') else dt.date.today().isoformat()
+        return (data_version, today, request.url.path, tuple(sorted(request.query_params.multi_items())))
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, entry: CachedResponse) -> None:
+        if len(entry) > self.max_entry_bytes:
+            return
+        with self._lock:
+            if (previous := self._entries.pop(key, None)) is not None:
+                self.size -= len(previous)
+            self._entries[key] = entry
+            self.size += len(entry)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SlowQueryLog:
+    """Ring buffer with the plans of slow COPY queries of this worker.
+
+    Once a COPY took longer than `threshold` seconds, the query is run again
+    with EXPLAIN (ANALYZE, BUFFERS) in the background and its plan is stored
+    with the parameters of the request. Only one query is explained at a time,
+    slow queries in the meantime are skipped.
+    """
+
+    def __init__(
+        self,
+        threshold: Optional[float] = SLOW_QUERY_SECONDS,
+        sample_rate: float = SLOW_QUERY_SAMPLE_RATE,
+        maxlen: int = SLOW_QUERY_BUFFER_SIZE,
+    ):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self._entries: deque[dict] = deque(maxlen=maxlen)
+        self._task: Optional[asyncio.Task] = None
+        self.skipped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold is not None
+
+    def should_explain(self, duration: float) -> bool:
+        if not self.enabled or duration < self.threshold:
+            return False
+        if self._task is not None and not self._task.done():
+            self.skipped += 1
+            return False
+        return random.random() < self.sample_rate
+
+    async def explain(self, pool: asyncpg.Pool, sql: str) -> list:
+        async with pool.acquire() as conn:
+            plan = await conn.fetchval(
+                f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}',
+                timeout=SLOW_QUERY_EXPLAIN_TIMEOUT_SECONDS,
+            )
+        return json.loads(plan) if isinstance(plan, str) else plan
+
+    async def capture(self, pool: asyncpg.Pool, sql: str, duration: float, request: Request) -> None:
+        entry = {
+            'captured_at': dt.datetime.now(dt.timezone.utc).isoformat(),
+            'pid': os.getpid(),
+            'path': request.url.path,
+            'query_params': dict(request.query_params.multi_items()),
+            'copy_duration_ms': round(duration * 1000, 1),
+            'sql': sql,
+        }
+        try:
+            entry['plan'] = await self.explain(pool, sql)
+        except Exception as e:
+            logger.exception('Could not explain slow query.')
+            entry['error'] = repr(e)
+        self._entries.append(entry)
+
+    def start(self, pool: asyncpg.Pool, sql: str, duration: float, request: Request) -> None:
+        # A reference to the task is kept, otherwise it could be garbage collected.
+        self._task = asyncio.create_task(self.capture(pool, sql, duration, request))
+
+    def entries(self) -> list[dict]:
+        """Captured queries, newest first."""
+        return list(reversed(self._entries))
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def capture_slow_query(pool: asyncpg.Pool, sql: str, duration: float) -> None:
+    """Explain the query in the background, if it was slow and the capture is enabled."""
+    request = _current_request.get()
+    if request is None:
+        return
+    slow_queries: Optional[SlowQueryLog] = getattr(request.app.state, 'slow_queries', None)
+    if slow_queries is not None and slow_queries.should_explain(duration):
+        slow_queries.start(pool, sql, duration, request)
+
+
+def request_etag(data_version: str, request: Request) -> str:
+    """Strong ETag of the key of the ResponseCache.
+
+    The key contains the data version, the normalized request and, without
+    knowledge_date, today. Equal on all workers, as the response only depends on these.
+    """
+    digest = hashlib.sha256(repr(ResponseCache.key(data_version, request)).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of If-None-Match, as required for GET (RFC 9110)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [candidate.strip().removeprefix('W/') for candidate in if_none_match.split(',')]
+    return etag in candidates
+
+
+# API ########################################################################
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Engine (and its connection pool) lives as long as the worker process.
+    # Creating an engine per request would open a new pool and connection
+    # (TCP, TLS and authentication) for every single call.
+    app.state.db_sync = create_sync_engine()
+    app.state.tables = TableRegistry(app.state.db_sync)
+    app.state.db_async = await create_async_pool()
+    app.state.query_templates = QueryTemplateCache()
+    app.state.response_cache = ResponseCache()
+    app.state.data_version = DataVersion(app.state.db_sync, app.state.tables)
+    app.state.geo_dims = GeoDimCache(app.state.db_sync, app.state.tables)
+    app.state.indicator_catalogs = IndicatorCatalogCache(app.state.db_sync, app.state.tables)
+    app.state.slow_queries = SlowQueryLog()
+    try:
+        await run_in_threadpool(app.state.geo_dims.warm)
+    except SQLAlchemyError:
+        logger.exception('Could not load the geo dims, they are loaded on first use.')
+    # After a pipeline run, also the structure of the tables could have changed.
+    app.state.data_version.on_change(app.state.response_cache.clear)
+    app.state.data_version.on_change(app.state.tables.refresh)
+    app.state.data_version.on_change(app.state.query_templates.clear)
+    app.state.data_version.on_change(app.state.geo_dims.refresh)
+    app.state.data_version.on_change(app.state.indicator_catalogs.clear)
+    yield
+    await app.state.db_async.close()
+    app.state.db_sync.dispose()
+    if PROMETHEUS_MULTIPROC_DIR is not None:
+        # Removes the samples of the live gauges of this worker.
+        multiprocess.mark_process_dead(os.getpid())
+
+
+app = FastAPI(
+    title='ODAPI - Open Data API for Switzerland',
+    docs_url='/',
+    summary='API for accessing different indicators from different geographic regions in Switzerland.',
+    description=textwrap.dedent("""
+        ## IMPORTANT
+
+        * This API is under heavy development. Endpoints and responses **can and will change in the future**.
+        * This is **not** an official API from the Swiss Government, but just a private iniative from [myself](https://bardos.dev).
+
+        The source code of the API as well as the data transformation can be found [on Github](https://github.com/fbardos/odapi).
+    """),
+    lifespan=lifespan,
+)
+
+
+@app.middleware('http')
+async def response_cache_middleware(request: Request, call_next):
+    """Answer conditional and repeated requests without a query, as long as the data version is the same.
+
+    Requests with a matching If-None-Match get 304 Not Modified, before any
+    query is built. Other repeated requests are served from the response cache.
+    """
+    cache: ResponseCache = request.app.state.response_cache
+    if (
+        request.method != 'GET'
+        or not request.url.path.startswith(RESPONSE_CACHE_PATH_PREFIXES)
+    ):
+        return await call_next(request)
+    with timed('data_version'):
+        data_version = await run_in_threadpool(request.app.state.data_version.get)
+    if data_version is None:
+        return await call_next(request)
+
+    etag = request_etag(data_version, request)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    if not cache.enabled:
+        response = await call_next(request)
+        if response.status_code == status.HTTP_200_OK:
+            response.headers['ETag'] = etag
+        return response
+
+    key = cache.key(data_version, request)
+    if (cached := cache.get(key)) is not None:
+        response = cached.to_response()
+        response.headers['ETag'] = etag
+        response.headers['X-Cache'] = 'HIT'
+        return response
+
+    response = await call_next(request)
+    response.headers['X-Cache'] = 'MISS'
+    if response.status_code != status.HTTP_200_OK:
+        return response
+    response.headers['ETag'] = etag
+
+    # Pass the body through to the client and keep a copy for the cache,
+    # as long as the response does not exceed the maximum entry size.
+    async def tee_body(body_iterator):
+        chunks, size = [], 0
+        async for chunk in body_iterator:
+            if chunks is not None:
+                size += len(chunk)
+                if size > cache.max_entry_bytes:
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+        if chunks is not None:
+            headers = {k: v for k, v in response.headers.items() if k not in ('content-length', 'x-cache', 'etag', 'server-timing')}
+            cache.put(key, CachedResponse(b''.join(chunks), response.status_code, response.media_type, headers))
+
+    response.body_iterator = tee_body(response.body_iterator)
+    return response
+
+
+# Registered last, therefore it is the outermost middleware and also times cache hits.
+@app.middleware('http')
+async def timing_middleware(request: Request, call_next):
+    """Report the durations of the request phases in header Server-Timing, the log and the metrics.
+
+    The header contains the phases until the response starts. The log and the
+    metrics are written after the body is sent and contain all phases, size and
+    number of rows.
+    """
+    timings = Timings()
+    token = _request_timings.set(timings)
+    request_token = _current_request.set(request)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _request_timings.reset(token)
+        _current_request.reset(request_token)
+    response.headers['Server-Timing'] = timings.server_timing(time.perf_counter() - start)
+
+    async def log_after_body(body_iterator):
+        size = 0
+        async for chunk in body_iterator:
+            size += len(chunk)
+            yield chunk
+        duration = time.perf_counter() - start
+        observe_request(request, response, size, timings, duration)
+        logger.info(json.dumps({
+            'event': 'request',
+            'method': request.method,
+            'path': request.url.path,
+            'query': str(request.query_params),
+            'status': response.status_code,
+            'cache': response.headers.get('x-cache'),
+            'bytes': size,
+            'rows': timings.rows,
+            'duration_ms': round(duration * 1000, 1),
+            'phases_ms': timings.milliseconds(),
+        }))
+
+    response.body_iterator = log_after_body(response.body_iterator)
+    return response
+
+
+# STATUS #####################################################################
+@app.get(
+    '/status/pool',
+    tags=['Status'],
+    description=textwrap.dedent("""
+        Returns statistics about the database connection pools of the answering worker.
+        The data endpoints use the async pool, the sync pool is used for metadata like reflection.
+    """),
+)
+def get_pool_status(
+    db_sync: Engine = Depends(get_sync_engine),
+    db_async: asyncpg.Pool = Depends(get_async_pool),
+):
+    pool = db_sync.pool
+    return {
+        'pid': os.getpid(),
+        'pool_size': pool.size(),
+        'max_overflow': DB_SYNC_POOL_MAX_OVERFLOW,
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+        'status': pool.status(),
+        'async_pool': {
+            'size': db_async.get_size(),
+            'idle': db_async.get_idle_size(),
+            'min_size': db_async.get_min_size(),
+            'max_size': db_async.get_max_size(),
+        },
+    }
+
+
+@app.get(
+    '/status/cache',
+    tags=['Status'],
+    description='Returns statistics about the response cache of the answering worker.',
+)
+def get_cache_status(
+    request: Request,
+):
+    cache: ResponseCache = request.app.state.response_cache
+    return {
+        'pid': os.getpid(),
+        'enabled': cache.enabled,
+        'data_version': request.app.state.data_version.get(),
+        'entries': len(cache),
+        'size_bytes': cache.size,
+        'max_bytes': cache.max_bytes,
+        'hits': cache.hits,
+        'misses': cache.misses,
+        'geo_dims': len(request.app.state.geo_dims),
+        'geo_dims_size_bytes': request.app.state.geo_dims.size,
+        'indicator_catalogs': len(request.app.state.indicator_catalogs),
+    }
+
+
+@app.get(
+    '/metrics',
+    tags=['Status'],
+    description=textwrap.dedent("""
+        Prometheus metrics of all workers: latency, response size and rows per route,
+        COPY durations, response cache hits and misses and connections of the database pools.
+    """),
+    response_class=TxtResponose,
+)
+def get_metrics(request: Request):
+    if (pool := getattr(request.app.state, 'db_async', None)) is not None:
+        observe_pool(pool)
+    return Response(
+        content=prometheus_client.generate_latest(metrics_registry()),
+        media_type=prometheus_client.CONTENT_TYPE_LATEST,
+    )
+
+
+# ADMIN ######################################################################
+@app.post(
+    '/admin/refresh',
+    tags=['Admin'],
+    description=textwrap.dedent("""
+        Drops the reflected table definitions and compiled query templates of the answering worker
+        and reloads the cached geo dims and indicator catalogs.
+        Tables get reflected again on next use, e.g. after a dbt run changed columns.
+        Requires header `X-Admin-Token`.
+    """),
+    dependencies=[Depends(verify_admin_token)],
+)
+def refresh_tables(
+    tables: TableRegistry = Depends(get_table_registry),
+    query_templates: QueryTemplateCache = Depends(get_query_templates),
+    geo_dims: GeoDimCache = Depends(get_geo_dims),
+    indicator_catalogs: IndicatorCatalogCache = Depends(get_indicator_catalogs),
+):
+    refreshed = tables.reflected_tables
+    tables.refresh()
+    query_templates.clear()
+    geo_dims.refresh()
+    indicator_catalogs.clear()
+    return {'pid': os.getpid(), 'refreshed_tables': refreshed}
+
+
+@app.get(
+    '/admin/slow-queries',
+    tags=['Admin'],
+    description=textwrap.dedent("""
+        Slow COPY queries of the answering worker with their plan of EXPLAIN (ANALYZE, BUFFERS), newest first.
+        Only captured when `ODAPI_SLOW_QUERY_SECONDS` is set, a fraction can be sampled with `ODAPI_SLOW_QUERY_SAMPLE_RATE`.
+        Requires header `X-Admin-Token`.
+    """),
+    dependencies=[Depends(verify_admin_token)],
+)
+def get_slow_queries(
+    request: Request,
+):
+    slow_queries: SlowQueryLog = request.app.state.slow_queries
+    return {
+        'pid': os.getpid(),
+        'enabled': slow_queries.enabled,
+        'threshold_seconds': slow_queries.threshold,
+        'sample_rate': slow_queries.sample_rate,
+        'skipped': slow_queries.skipped,
+        'queries': slow_queries.entries(),
+    }
+
+
+# INDICATORS #################################################################
+@app.get(
+    '/indicators/{geo_code}/search',
+    tags=['Indicators'],
+    description=textwrap.dedent("""
+        Search the available indicators by their name, topics, unit, description or ID.
+
+        Every word of `q` must match the beginning of a word, e.g. `bev entw` finds indicators about the development of the population (Bevölkerung, Entwicklung).
+        Indicators matching in their name are returned first.
+    """),
+)
+def search_available_indicators(
+    geo_code: GeoCode = Path(
+        ...,
+        description=DOC__GEO_CODE,
+    ),
+    q: str = Query(..., min_length=1, description='Search terms, separated by spaces.'),
+    limit: Optional[int] = Query(None, ge=1, examples=[20], description='Optional. Limit response to the set amount of indicators.'),
+    indicator_catalogs: IndicatorCatalogCache = Depends(get_indicator_catalogs),
+):
+    return indicator_catalogs.get(geo_code).search(q, limit)
+
+
+@app.get(
+    '/indicators/{geo_code}/txt',
+    tags=['Indicators'],
+    description='List all available indicators in a human readable format.',
+    response_class=TxtResponose,
+)
+@app.get(
+    '/indicators/{geo_code}',
+    tags=['Indicators'],
+    description='List all available indicators.',
+)
+def get_all_available_indicators(
+    request: Request,
+    indicator_catalogs: IndicatorCatalogCache = Depends(get_indicator_catalogs),
+    geo_code: GeoCode = Path(
+        ...,
+        description=textwrap.dedent("""
+            Geographic level to return.
+
+            Possible values:
+
+            | Value | EN | DE |
+            | --- | --- | --- |
+            | `polg` | municipality | Politische Gemeinde |
+            | `bezk` | district | Bezirk |
+            | `kant` | canton | Kanton |
+        """),
+    ),
+):
+    catalog = indicator_catalogs.get(geo_code)
+    if re.search(f'^/indicators.*/txt$', request.url.path):
+        return TxtResponose(content=catalog.tree)
+    else:
+        return catalog.records
+
+
+# INDICATOR ##################################################################
+@app.get(
+    '/indicator/{geo_code}/{indicator_id}/parquet',
+    tags=['Indicator'],
+    description=textwrap.dedent("""
+        Returns as Parquet file for a selected indicator. This is the fastes way to read data.
+        Geometry is stored as serialized WKT in column `geometry`.
+    """),
+    response_class=GeoparquetResponse,
+)
+@app.get(
+    '/indicator/{geo_code}/{indicator_id}/xlsx',
+    tags=['Indicator'],
+    description=textwrap.dedent("""
+        Returns as Excel file for a selected indicator.
+
+        **Be careful, this can create a big response and may take some time**.
+        **Additionally, Microsoft Excel cannot contain a spreadsheet with more than 1,048,576 rows.**
+    """),
+    response_class=XlsxResponse,
+)
+@app.get(
+    '/indicator/{geo_code}/{indicator_id}/csv',
+    tags=['Indicator'],
+    description='Returns as CSV for a selected indicator. Can be easily parsed by frameworks like pandas or dplyr.',
+    response_class=CsvResponse,
+)
+@app.get(
+    '/indicator/{geo_code}/{indicator_id}/ndjson',
+    tags=['Indicator'],
+    description='Returns newline delimited GeoJSON features (NDJSON) for a selected indicator.',
+    response_class=NdjsonStreamingResponse,
+)
+@app.get(
+    '/indicator/{geo_code}/{indicator_id}',
+    tags=['Indicator'],
+    description='Returns a GeoJSON for a selected indicator.',
+    response_class=GeoJsonResponse,
+)
+async def get_indicator(
+    request: Request,
+    geo_code: GeoCode = Path(
+        ...,
+        description=DOC__GEO_CODE,
+    ),
+    indicator_id: int = Path(..., description='Select an indicator. If you want to check all possible indicators run path `/indicator` first.'),
+    geo_value: Optional[int] = Query(None, description='ID for a selected `geo_code`. E.g. when `geo_code == polg` is selected, `geo_value == 230` will return Winterthur.'),
+    knowledge_date: Optional[str] = Query(None, examples=[dt.date.today().strftime('%Y-%m-%d')], description='Optional. Allows to query a different state of the data in the past. Format: ISO-8601'),
+    period_ref: Optional[str] = Query(None, description='Allows to filter for a specific period_ref. Format: ISO-8601, Example: `2023-12-31`'),
+    measure: Optional[Measure] = Query(None, description='Show values as simple mumber (zahl), or per 100 (pro100), per 1\'000 (pro1000) or per 100\'000 (pro100000) inhabitants. Default (none) does not filter.'),
+    join_indicator: Optional[bool] = Query(None, description='Optional. Joins information about the indicator.'),
+    join_geo: Optional[bool] = Query(None, description='Optional. Joins information about the geometry like its name or its parents.'),
+    geometry_mode: Optional[GeometryMode] = Query(
+        None,
+        description=DOC__GEOMETRY_MODE,
+    ),
+    geometry_layout: Optional[GeometryLayout] = Query(
+        None,
+        description=DOC__GEOMETRY_LAYOUT,
+    ),
+    skip: Optional[int] = Query(None, examples=[0], description='Optional. Skip the first n rows.'),
+    limit: Optional[int] = Query(None, examples=[100], description='Optional. Limit response to the set amount of rows.'),
+    cursor: Optional[str] = Query(None, description=DOC__CURSOR),
+    fields: Optional[str] = Query(None, description=DOC__FIELDS),
+    expand_all_groups: Optional[bool] = Query(None, description='Optional. Expand all groups in the response.'),
+    expand_group_1: Optional[bool] = Query(None, description='Optional. Expand group 1 in the response.'),
+    expand_group_2: Optional[bool] = Query(None, description='Optional. Expand group 2 in the response.'),
+    expand_group_3: Optional[bool] = Query(None, description='Optional. Expand group 3 in the response.'),
+    expand_group_4: Optional[bool] = Query(None, description='Optional. Expand group 4 in the response.'),
+    db_async: asyncpg.Pool = Depends(get_async_pool),
+    tables: TableRegistry = Depends(get_table_registry),
+    query_templates: QueryTemplateCache = Depends(get_query_templates),
+    geo_dims: GeoDimCache = Depends(get_geo_dims),
+):
+    FIRST_PATH_ELEMENT = 'indicator'
+    keyset = use_keyset(cursor, skip, limit)
+    shape = IndicatorQueryShape(
+        geo_code=geo_code,
+        geometry_mode=geometry_mode or GeometryMode.border_simple_100m,
+        filter_indicator_id=True,
+        filter_geo_value=bool(geo_value),
+        filter_measure=bool(measure),
+        filter_knowledge_date=bool(knowledge_date),
+        filter_period_ref=bool(period_ref),
+        join_indicator=bool(join_indicator),
+        join_geo=bool(join_geo),
+        expand_group_1=any([expand_all_groups, expand_group_1]),
+        expand_group_2=any([expand_all_groups, expand_group_2]),
+        expand_group_3=any([expand_all_groups, expand_group_3]),
+        expand_group_4=any([expand_all_groups, expand_group_4]),
+        offset=bool(skip),
+        limit=bool(limit),
+        attach_geo=attach_geo_in_arrow(FIRST_PATH_ELEMENT, request, geometry_layout or GeometryLayout.inline),
+        keyset=keyset,
+        seek=bool(cursor),
+        # The columns of the cursor must be returned, even if they are not requested.
+        fields=parse_fields(fields, 'geo_value', *(name for name, _ in (INDICATOR_KEYSET if keyset else ()))),
+    )
+    template = await run_in_threadpool(query_templates.get, shape, lambda: build_indicator_query(tables, shape))
+    params = indicator_query_params(
+        geo_code=geo_code,
+        indicator_id=indicator_id,
+        geo_value=geo_value,
+        knowledge_date=knowledge_date,
+        period_ref=period_ref,
+        measure=measure,
+        skip=skip,
+        limit=limit,
+    )
+    params.update(cursor_params(cursor, INDICATOR_KEYSET))
+    geo_dim = None
+    if shape.attach_geo:
+        geo_dim = await run_in_threadpool(geo_dims.get, geo_code, shape.geometry_mode, shape.join_geo, shape.fields)
+    return await query_response(
+        FIRST_PATH_ELEMENT,
+        request,
+        db_async,
+        bind_template(template, params),
+        geometry_layout=geometry_layout or GeometryLayout.inline,
+        geo_dim=geo_dim,
+        keyset=INDICATOR_KEYSET if shape.keyset else None,
+        limit=limit,
+    )
 
 
 # PORTRAIT ###################################################################
@@ -798,12 +2877,18 @@ def get_indicator(
     description='Returns a CSV for the selected geometry. Can be easily parsed by frameworks like pandas or dplyr.',
     response_class=CsvResponse,
 )
+@app.get(
+    '/portrait/{geo_code}/{geo_value}/ndjson',
+    tags=['Portrait'],
+    description='Returns newline delimited GeoJSON features (NDJSON) for a selected geometry.',
+    response_class=NdjsonStreamingResponse,
+)
 @app.get(
     '/portrait/{geo_code}/{geo_value}',
     tags=['Portrait'],
     description='Returns a GeoJSON for a selected geometry.',
 )
-def list_all_indicators_for_one_geometry(
+async def list_all_indicators_for_one_geometry(
     request: Request,
     geo_code: GeoCode = Path(
         ...,
@@ -819,216 +2904,312 @@ def list_all_indicators_for_one_geometry(
         None,
         description=DOC__GEOMETRY_MODE,
     ),
+    geometry_layout: Optional[GeometryLayout] = Query(
+        None,
+        description=DOC__GEOMETRY_LAYOUT,
+    ),
     skip: Optional[int] = Query(None, examples=[0], description='Optional. Skip the first n rows.'),
     limit: Optional[int] = Query(None, examples=[100], description='Optional. Limit response to the set amount of rows.'),
+    cursor: Optional[str] = Query(None, description=DOC__CURSOR),
+    fields: Optional[str] = Query(None, description=DOC__FIELDS),
     expand_all_groups: Optional[bool] = Query(None, description='Optional. Expand all groups in the response.'),
     expand_group_1: Optional[bool] = Query(None, description='Optional. Expand group 1 in the response.'),
     expand_group_2: Optional[bool] = Query(None, description='Optional. Expand group 2 in the response.'),
     expand_group_3: Optional[bool] = Query(None, description='Optional. Expand group 3 in the response.'),
     expand_group_4: Optional[bool] = Query(None, description='Optional. Expand group 4 in the response.'),
-    db_sync: Engine = Depends(get_sync_engine),
+    db_async: asyncpg.Pool = Depends(get_async_pool),
+    tables: TableRegistry = Depends(get_table_registry),
+    query_templates: QueryTemplateCache = Depends(get_query_templates),
+    geo_dims: GeoDimCache = Depends(get_geo_dims),
 ):
     FIRST_PATH_ELEMENT = 'portrait'
-    tbl_indicator = TableIndicator().get_table(db_sync)
-    tbl_api = TableApi().get_table(db_sync)
-    tbl_gemeinde = TableGemeindeLatest().get_table(db_sync)
-    tbl_bezirk =  TableBezirkLatest().get_table(db_sync)
-    tbl_kanton = TableKantonLatest().get_table(db_sync)
-    tbl_dim_source = TableDimSource().get_table(db_sync)
-    tbl_dim_group_1 = TableDimGroup().get_table(db_sync).alias('tbl_dim_group_1')
-    tbl_dim_group_2 = TableDimGroup().get_table(db_sync).alias('tbl_dim_group_2')
-    tbl_dim_group_3 = TableDimGroup().get_table(db_sync).alias('tbl_dim_group_3')
-    tbl_dim_group_4 = TableDimGroup().get_table(db_sync).alias('tbl_dim_group_4')
-    tbl_dim_group_value_1 = TableDimGroupValue().get_table(db_sync).alias('tbl_dim_group_value_1')
-    tbl_dim_group_value_2 = TableDimGroupValue().get_table(db_sync).alias('tbl_dim_group_value_2')
-    tbl_dim_group_value_3 = TableDimGroupValue().get_table(db_sync).alias('tbl_dim_group_value_3')
-    tbl_dim_group_value_4 = TableDimGroupValue().get_table(db_sync).alias('tbl_dim_group_value_4')
-    query = (
-        select(
-            tbl_api.c.indicator_id,
-            tbl_api.c.geo_code,
-            tbl_api.c.geo_value,
-            tbl_api.c.period_type,
-            tbl_api.c.period_code,
-            tbl_api.c.period_ref_from,
-            tbl_api.c.period_ref,
-            tbl_dim_group_1.c.group_name.label('group_1_name'),
-            tbl_dim_group_value_1.c.group_value_name.label('group_1_value'),
-            tbl_dim_group_2.c.group_name.label('group_2_name'),
-            tbl_dim_group_value_2.c.group_value_name.label('group_2_value'),
-            tbl_dim_group_3.c.group_name.label('group_3_name'),
-            tbl_dim_group_value_3.c.group_value_name.label('group_3_value'),
-            tbl_dim_group_4.c.group_name.label('group_4_name'),
-            tbl_dim_group_value_4.c.group_value_name.label('group_4_value'),
-            tbl_api.c.measure_code,
-            tbl_api.c.indicator_value_numeric,
-            tbl_api.c.indicator_value_text,
-            tbl_api.c.source_id,
-            tbl_dim_source.c.source,
-        )
-        .join(tbl_dim_source, tbl_api.c.source_id == tbl_dim_source.c.id)
-        .join(tbl_dim_group_1, tbl_api.c.group_1_id == tbl_dim_group_1.c.group_id, isouter=True)
-        .join(tbl_dim_group_2, tbl_api.c.group_2_id == tbl_dim_group_2.c.group_id, isouter=True)
-        .join(tbl_dim_group_3, tbl_api.c.group_3_id == tbl_dim_group_3.c.group_id, isouter=True)
-        .join(tbl_dim_group_4, tbl_api.c.group_4_id == tbl_dim_group_4.c.group_id, isouter=True)
-        .join(tbl_dim_group_value_1, tbl_api.c.group_value_1_id == tbl_dim_group_value_1.c.group_value_id, isouter=True)
-        .join(tbl_dim_group_value_2, tbl_api.c.group_value_2_id == tbl_dim_group_value_2.c.group_value_id, isouter=True)
-        .join(tbl_dim_group_value_3, tbl_api.c.group_value_3_id == tbl_dim_group_value_3.c.group_value_id, isouter=True)
-        .join(tbl_dim_group_value_4, tbl_api.c.group_value_4_id == tbl_dim_group_value_4.c.group_value_id, isouter=True)
-        .where(tbl_api.c.geo_code == geo_code)
-        .where(tbl_api.c.geo_value == geo_value)
+    keyset = use_keyset(cursor, skip, limit)
+    shape = IndicatorQueryShape(
+        geo_code=geo_code,
+        geometry_mode=geometry_mode or GeometryMode.border_simple_100m,
+        filter_geo_value=True,
+        filter_measure=bool(measure),
+        filter_knowledge_date=bool(knowledge_date),
+        filter_period_ref=bool(period_ref),
+        join_indicator=bool(join_indicator),
+        join_geo=bool(join_geo),
+        expand_group_1=any([expand_all_groups, expand_group_1]),
+        expand_group_2=any([expand_all_groups, expand_group_2]),
+        expand_group_3=any([expand_all_groups, expand_group_3]),
+        expand_group_4=any([expand_all_groups, expand_group_4]),
+        offset=bool(skip),
+        limit=bool(limit),
+        attach_geo=attach_geo_in_arrow(FIRST_PATH_ELEMENT, request, geometry_layout or GeometryLayout.inline),
+        keyset=keyset,
+        seek=bool(cursor),
+        # The columns of the cursor must be returned, even if they are not requested.
+        fields=parse_fields(fields, 'geo_value', *(name for name, _ in (INDICATOR_KEYSET if keyset else ()))),
     )
-    if measure:
-        query = query.where(tbl_api.c.measure_code == measure)
-    if any([expand_all_groups, expand_group_1]):
-        pass  # if any selection is made, do not filter the table
-    else:
-        query = query.where(tbl_api.c._group_value_1_is_total == True)
-    if any([expand_all_groups, expand_group_2]):
-        pass  # if any selection is made, do not filter the table
-    else:
-        query = query.where(tbl_api.c._group_value_2_is_total == True)
-    if any([expand_all_groups, expand_group_3]):
-        pass  # if any selection is made, do not filter the table
-    else:
-        query = query.where(tbl_api.c._group_value_3_is_total == True)
-    if any([expand_all_groups, expand_group_4]):
-        pass  # if any selection is made, do not filter the table
-    else:
-        query = query.where(tbl_api.c._group_value_4_is_total == True)
-    if knowledge_date:
-        _knowledge_date = dt.date.fromisoformat(knowledge_date).strftime('%Y-%m-%d')
-        query = (
-            query
-            .add_columns(literal(_knowledge_date).label('knowledge_date'))
-            .where(tbl_api.c.knowledge_date_from <= _knowledge_date)
-            # is much faster than a coalesce (because of idx scan)
-            .where(or_(tbl_api.c.knowledge_date_to > _knowledge_date, tbl_api.c.knowledge_date_to == None))
-        )
-    else:
-        _knowledge_date = dt.date.today().strftime('%Y-%m-%d')
-        query = (
-            query
-            .add_columns(literal(_knowledge_date).label('knowledge_date'))
-            .where(tbl_api.c.knowledge_date_to == None)
+    template = await run_in_threadpool(query_templates.get, shape, lambda: build_indicator_query(tables, shape))
+    params = indicator_query_params(
+        geo_code=geo_code,
+        geo_value=geo_value,
+        knowledge_date=knowledge_date,
+        period_ref=period_ref,
+        measure=measure,
+        skip=skip,
+        limit=limit,
+    )
+    params.update(cursor_params(cursor, INDICATOR_KEYSET))
+    geo_dim = None
+    if shape.attach_geo:
+        geo_dim = await run_in_threadpool(geo_dims.get, geo_code, shape.geometry_mode, shape.join_geo, shape.fields)
+    return await query_response(
+        FIRST_PATH_ELEMENT,
+        request,
+        db_async,
+        bind_template(template, params),
+        geometry_layout=geometry_layout or GeometryLayout.inline,
+        geo_dim=geo_dim,
+        keyset=INDICATOR_KEYSET if shape.keyset else None,
+        limit=limit,
+    )
+
+
+# BATCH ######################################################################
+@app.get(
+    '/batch/{geo_code}/parquet',
+    tags=['Batch'],
+    description=textwrap.dedent("""
+        Returns as Parquet file for multiple indicators and geo_values at once.
+        Geometry is stored as serialized WKB in column `geometry`.
+    """),
+    response_class=GeoparquetResponse,
+)
+@app.get(
+    '/batch/{geo_code}/csv',
+    tags=['Batch'],
+    description='Returns a CSV for multiple indicators and geo_values at once.',
+    response_class=CsvResponse,
+)
+@app.get(
+    '/batch/{geo_code}/ndjson',
+    tags=['Batch'],
+    description='Returns newline delimited GeoJSON features (NDJSON) for multiple indicators and geo_values at once.',
+    response_class=NdjsonStreamingResponse,
+)
+@app.get(
+    '/batch/{geo_code}',
+    tags=['Batch'],
+    description=textwrap.dedent("""
+        Returns a GeoJSON for multiple indicators and geo_values at once, e.g. to compare municipalities.
+        Runs one query instead of one request per indicator or geo_value.
+
+        Repeat the parameters for multiple values, e.g. `?indicator_id=1&indicator_id=2&kanton_bfs_id=1`.
+        `geo_value`, `bezirk_bfs_id` and `kanton_bfs_id` can be combined, rows must match all of them.
+    """),
+    response_class=GeoJsonResponse,
+)
+async def get_batch(
+    request: Request,
+    geo_code: GeoCode = Path(
+        ...,
+        description=DOC__GEO_CODE,
+    ),
+    indicator_id: list[int] = Query(..., description=f'One or more indicators (at most {BATCH_MAX_INDICATORS}).'),
+    geo_value: Optional[list[int]] = Query(None, description=f'Optional. One or more IDs for the selected `geo_code` (at most {BATCH_MAX_GEO_VALUES}).'),
+    bezirk_bfs_id: Optional[int] = Query(None, description='Optional. Only geo_values in this district. Only for `geo_code == polg`.'),
+    kanton_bfs_id: Optional[int] = Query(None, description='Optional. Only geo_values in this canton. Only for `geo_code` `polg` and `bezk`.'),
+    knowledge_date: Optional[str] = Query(None, examples=[dt.date.today().strftime('%Y-%m-%d')], description='Optional. Allows to query a different state of the data in the past. Format: ISO-8601'),
+    period_ref: Optional[str] = Query(None, description='Allows to filter for a specific period_ref. Format: ISO-8601, Example: `2023-12-31`'),
+    measure: Optional[Measure] = Query(None, description='Show values as simple mumber (zahl), or per 100 (pro100), per 1\'000 (pro1000) or per 100\'000 (pro100000) inhabitants. Default (none) does not filter.'),
+    join_indicator: Optional[bool] = Query(None, description='Optional. Joins information about the indicator.'),
+    join_geo: Optional[bool] = Query(None, description='Optional. Joins information about the geometry like its name or its parents.'),
+    geometry_mode: Optional[GeometryMode] = Query(
+        None,
+        description=DOC__GEOMETRY_MODE,
+    ),
+    geometry_layout: Optional[GeometryLayout] = Query(
+        None,
+        description=DOC__GEOMETRY_LAYOUT,
+    ),
+    fields: Optional[str] = Query(None, description=DOC__FIELDS),
+    expand_all_groups: Optional[bool] = Query(None, description='Optional. Expand all groups in the response.'),
+    db_async: asyncpg.Pool = Depends(get_async_pool),
+    tables: TableRegistry = Depends(get_table_registry),
+    query_templates: QueryTemplateCache = Depends(get_query_templates),
+    geo_dims: GeoDimCache = Depends(get_geo_dims),
+):
+    FIRST_PATH_ELEMENT = 'batch'
+    if len(indicator_id) > BATCH_MAX_INDICATORS or len(geo_value or []) > BATCH_MAX_GEO_VALUES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'At most {BATCH_MAX_INDICATORS} indicators and {BATCH_MAX_GEO_VALUES} geo_values per request.',
         )
-    if join_indicator:
-        query = (
-            query
-            .join(tbl_indicator, tbl_api.c.indicator_id == tbl_indicator.c.indicator_id).add_columns(
-                tbl_indicator.c.indicator_name,
-                tbl_indicator.c.topic_1,
-                tbl_indicator.c.topic_2,
-                tbl_indicator.c.topic_3,
-                tbl_indicator.c.topic_4,
-                tbl_indicator.c.indicator_unit,
-                tbl_indicator.c.indicator_description,
-            )
+    geometry_mode = geometry_mode or GeometryMode.border_simple_100m
+
+    # Parents are resolved from the cached geo dims to a list of geo_values.
+    geo_values = set(geo_value) if geo_value else None
+    for parent, parent_value in (('bezirk_bfs_id', bezirk_bfs_id), ('kanton_bfs_id', kanton_bfs_id)):
+        if parent_value is None:
+            continue
+        children = await run_in_threadpool(geo_dims.geo_values_of_parent, geo_code, geometry_mode, parent, parent_value)
+        geo_values = set(children) if geo_values is None else geo_values & set(children)
+
+    shape = IndicatorQueryShape(
+        geo_code=geo_code,
+        geometry_mode=geometry_mode,
+        filter_indicator_ids=True,
+        filter_geo_values=geo_values is not None,
+        filter_measure=bool(measure),
+        filter_knowledge_date=bool(knowledge_date),
+        filter_period_ref=bool(period_ref),
+        join_indicator=bool(join_indicator),
+        join_geo=bool(join_geo),
+        expand_group_1=bool(expand_all_groups),
+        expand_group_2=bool(expand_all_groups),
+        expand_group_3=bool(expand_all_groups),
+        expand_group_4=bool(expand_all_groups),
+        attach_geo=attach_geo_in_arrow(FIRST_PATH_ELEMENT, request, geometry_layout or GeometryLayout.inline),
+        fields=parse_fields(fields, 'geo_value'),
+    )
+    template = await run_in_threadpool(query_templates.get, shape, lambda: build_indicator_query(tables, shape))
+    params = indicator_query_params(
+        geo_code=geo_code,
+        knowledge_date=knowledge_date,
+        period_ref=period_ref,
+        measure=measure,
+        indicator_ids=sorted(set(indicator_id)),
+        geo_values=sorted(geo_values) if geo_values is not None else None,
+    )
+    geo_dim = None
+    if shape.attach_geo:
+        geo_dim = await run_in_threadpool(geo_dims.get, geo_code, shape.geometry_mode, shape.join_geo, shape.fields)
+    return await query_response(
+        FIRST_PATH_ELEMENT,
+        request,
+        db_async,
+        bind_template(template, params),
+        geometry_layout=geometry_layout or GeometryLayout.inline,
+        geo_dim=geo_dim,
+    )
+
+
+# MATRIX #####################################################################
+@app.get(
+    '/matrix/{geo_code}/parquet',
+    tags=['Matrix'],
+    description=textwrap.dedent("""
+        Returns as Parquet file with one row per geo_value and one column per indicator and measure.
+        The period_ref of every column is stored in the schema metadata `odapi:period_ref`.
+    """),
+    response_class=GeoparquetResponse,
+)
+@app.get(
+    '/matrix/{geo_code}/csv',
+    tags=['Matrix'],
+    description='Returns a CSV with one row per geo_value and one column per indicator and measure.',
+    response_class=CsvResponse,
+)
+@app.get(
+    '/matrix/{geo_code}',
+    tags=['Matrix'],
+    description=textwrap.dedent("""
+        Returns a geo_value × indicator matrix as columnar JSON, ready for analytics without reshaping.
+
+        Columns are named `<indicator_id>_<measure_code>` and contain the value of the group total.
+        Without `period_ref`, every indicator and measure returns its latest period, listed in `period_ref`.
+        Does not contain geometries, use `join_geo` for names and parents.
+    """),
+)
+async def get_matrix(
+    request: Request,
+    geo_code: GeoCode = Path(
+        ...,
+        description=DOC__GEO_CODE,
+    ),
+    indicator_id: list[int] = Query(..., description=f'One or more indicators (at most {BATCH_MAX_INDICATORS}).'),
+    geo_value: Optional[list[int]] = Query(None, description=f'Optional. One or more IDs for the selected `geo_code` (at most {BATCH_MAX_GEO_VALUES}).'),
+    period_ref: Optional[str] = Query(None, description='Optional. Fixed period_ref for all indicators. Default is the latest period per indicator. Format: ISO-8601, Example: `2023-12-31`'),
+    measure: Optional[Measure] = Query(None, description='Show values as simple mumber (zahl), or per 100 (pro100), per 1\'000 (pro1000) or per 100\'000 (pro100000) inhabitants. Default (none) returns a column per measure.'),
+    knowledge_date: Optional[str] = Query(None, examples=[dt.date.today().strftime('%Y-%m-%d')], description='Optional. Allows to query a different state of the data in the past. Format: ISO-8601'),
+    join_geo: Optional[bool] = Query(None, description='Optional. Joins information about the geometry like its name or its parents.'),
+    db_async: asyncpg.Pool = Depends(get_async_pool),
+    tables: TableRegistry = Depends(get_table_registry),
+    geo_dims: GeoDimCache = Depends(get_geo_dims),
+):
+    FIRST_PATH_ELEMENT = 'matrix'
+    if len(indicator_id) > BATCH_MAX_INDICATORS or len(geo_value or []) > BATCH_MAX_GEO_VALUES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'At most {BATCH_MAX_INDICATORS} indicators and {BATCH_MAX_GEO_VALUES} geo_values per request.',
         )
 
-    # The join of the geometry tables must happen before adding
-    # the columns. The geometry tables are used by join_geo AND geometry_mode.
-    match geo_code:
-        case GeoCode.polg:
+    # Reflection and compilation block, therefore the query is built in the threadpool.
+    def build() -> str:
+        tbl_api = api_table(tables, bool(knowledge_date))
+
+        def filtered(query: Select) -> Select:
             query = (
                 query
-                .join(tbl_gemeinde, tbl_api.c.geo_value == tbl_gemeinde.c.gemeinde_bfs_id)
-                .join(tbl_bezirk, tbl_gemeinde.c.bezirk_bfs_id == tbl_bezirk.c.bezirk_bfs_id)
-                .join(tbl_kanton, tbl_gemeinde.c.kanton_bfs_id == tbl_kanton.c.kanton_bfs_id)
+                .where(tbl_api.c.geo_code == geo_code)
+                .where(tbl_api.c.indicator_id.in_(sorted(set(indicator_id))))
+                .where(tbl_api.c._group_value_1_is_total == True)
+                .where(tbl_api.c._group_value_2_is_total == True)
+                .where(tbl_api.c._group_value_3_is_total == True)
+                .where(tbl_api.c._group_value_4_is_total == True)
             )
-        case GeoCode.bezk:
-            query = (
-                query
-                .join(tbl_bezirk, tbl_api.c.geo_value == tbl_bezirk.c.bezirk_bfs_id)
-                .join(tbl_kanton, tbl_bezirk.c.kanton_bfs_id == tbl_kanton.c.kanton_bfs_id)
+            if knowledge_date:
+                _knowledge_date = dt.date.fromisoformat(knowledge_date).strftime('%Y-%m-%d')
+                query = (
+                    query
+                    .where(tbl_api.c.knowledge_date_from <= _knowledge_date)
+                    # is much faster than a coalesce (because of idx scan)
+                    .where(or_(tbl_api.c.knowledge_date_to > _knowledge_date, tbl_api.c.knowledge_date_to == None))
+                )
+            if measure:
+                query = query.where(tbl_api.c.measure_code == measure)
+            return query
+
+        query = filtered(
+            select(
+                tbl_api.c.indicator_id,
+                tbl_api.c.measure_code,
+                tbl_api.c.geo_value,
+                tbl_api.c.period_ref,
+                tbl_api.c.indicator_value_numeric,
             )
-        case GeoCode.kant:
-            query = (
-                query
-                .join(tbl_kanton, tbl_api.c.geo_value == tbl_kanton.c.kanton_bfs_id)
+        )
+        if geo_value:
+            query = query.where(tbl_api.c.geo_value.in_(sorted(set(geo_value))))
+        if period_ref:
+            query = query.where(tbl_api.c.period_ref == dt.date.fromisoformat(period_ref).strftime('%Y-%m-%d'))
+        else:
+            # Measures of an indicator can have different periods, each column gets its latest.
+            latest = filtered(
+                select(tbl_api.c.indicator_id, tbl_api.c.measure_code, func.max(tbl_api.c.period_ref).label('period_ref'))
+                .group_by(tbl_api.c.indicator_id, tbl_api.c.measure_code)
+            ).subquery('latest')
+            query = query.join(
+                latest,
+                (tbl_api.c.indicator_id == latest.c.indicator_id)
+                & tbl_api.c.measure_code.is_not_distinct_from(latest.c.measure_code)
+                & (tbl_api.c.period_ref == latest.c.period_ref),
             )
+        return compile_literal(query)
 
-    # If join_geo is set, add the relevant columns to the query.
+    buffer = await copy_to_parquet(db_async, await run_in_threadpool(build))
+    table = await run_in_threadpool(pivot_matrix, buffer)
     if join_geo:
-        match geo_code:
-            case GeoCode.polg:
-                query = query.add_columns(
-                    tbl_gemeinde.c.gemeinde_name.label('geo_name'),
-                    tbl_bezirk.c.bezirk_bfs_id,
-                    tbl_bezirk.c.bezirk_name,
-                    tbl_kanton.c.kanton_bfs_id,
-                    tbl_kanton.c.kanton_name,
-                )
-            case GeoCode.bezk:
-                query = query.add_columns(
-                    tbl_bezirk.c.bezirk_name.label('geo_name'),
-                    tbl_kanton.c.kanton_bfs_id,
-                    tbl_kanton.c.kanton_name,
-                )
-            case GeoCode.kant:
-                query = query.add_columns(
-                    tbl_kanton.c.kanton_name.label('geo_name'),
-                )
-
-    # Column geometry should be the last column in the query.
-    if geometry_mode == GeometryMode.point:
-        match geo_code:
-            case GeoCode.polg:
-                query = query.add_columns(tbl_gemeinde.c.geom_center.label('geometry'))
-            case GeoCode.bezk:
-                query = query.add_columns(tbl_bezirk.c.geom_center.label('geometry'))
-            case GeoCode.kant:
-                query = query.add_columns(tbl_kanton.c.geom_center.label('geometry'))
-    elif geometry_mode == GeometryMode.border:
-        match geo_code:
-            case GeoCode.polg:
-                query = query.add_columns(tbl_gemeinde.c.geom_border.label('geometry'))
-            case GeoCode.bezk:
-                query = query.add_columns(tbl_bezirk.c.geom_border.label('geometry'))
-            case GeoCode.kant:
-                query = query.add_columns(tbl_kanton.c.geom_border.label('geometry'))
-    elif geometry_mode == GeometryMode.border_simple_50m:
-        match geo_code:
-            case GeoCode.polg:
-                query = query.add_columns(tbl_gemeinde.c.geom_border_simple_50m.label('geometry'))
-            case GeoCode.bezk:
-                query = query.add_columns(tbl_bezirk.c.geom_border_simple_50m.label('geometry'))
-            case GeoCode.kant:
-                query = query.add_columns(tbl_kanton.c.geom_border_simple_50m.label('geometry'))
-    elif geometry_mode == GeometryMode.border_simple_100m or geometry_mode is None:  # Default
-        match geo_code:
-            case GeoCode.polg:
-                query = query.add_columns(tbl_gemeinde.c.geom_border_simple_100m.label('geometry'))
-            case GeoCode.bezk:
-                query = query.add_columns(tbl_bezirk.c.geom_border_simple_100m.label('geometry'))
-            case GeoCode.kant:
-                query = query.add_columns(tbl_kanton.c.geom_border_simple_100m.label('geometry'))
-    elif geometry_mode == GeometryMode.border_simple_500m:
-        match geo_code:
-            case GeoCode.polg:
-                query = query.add_columns(tbl_gemeinde.c.geom_border_simple_500m.label('geometry'))
-            case GeoCode.bezk:
-                query = query.add_columns(tbl_bezirk.c.geom_border_simple_500m.label('geometry'))
-            case GeoCode.kant:
-                query = query.add_columns(tbl_kanton.c.geom_border_simple_500m.label('geometry'))
-    if period_ref:
-        query = query.where(tbl_api.c.period_ref == dt.date.fromisoformat(period_ref).strftime('%Y-%m-%d'))
-    if skip:
-        query = query.offset(skip)
-    if limit:
-        query = query.limit(limit)
-    with db_sync.connect() as conn:
-        psycopg2_connection = conn.connection
-        curs = psycopg2_connection.cursor()
-        buffer = io.BytesIO()
-        copy_sql = f"""
-            COPY (
-                {query.compile(dialect=db_sync.dialect, compile_kwargs={'literal_binds': True})}
-            ) TO STDOUT WITH (FORMAT PARQUET);
-        """
-        curs.copy_expert(copy_sql, buffer)
-        curs.close()
-        return response_decision(FIRST_PATH_ELEMENT, request, buffer)
+        geo_dim = await run_in_threadpool(geo_dims.get, geo_code, GeometryMode.border_simple_100m, True)
+        table = GeoDim(geo_dim.table.drop_columns(['geometry'])).attach(table)
+
+    match response_format(FIRST_PATH_ELEMENT, request):
+        case 'parquet':
+            buffer_out = io.BytesIO()
+            pq.write_table(table, buffer_out)
+            return GeoparquetResponse(content=buffer_out)
+        case 'csv':
+            buffer_out = io.BytesIO()
+            pacsv.write_csv(table, buffer_out)
+            return CsvResponse(content=buffer_out)
+        case _:
+            return Response(content=await run_in_threadpool(matrix_to_json, table), media_type='application/json')
 
 
 # NUMBERS ####################################################################
@@ -1076,7 +3257,7 @@ def list_all_indicators_for_one_geometry(
     """),
     response_class=GeoJsonResponse,
 )
-def get_numbers(
+async def get_numbers(
     request: Request,
     geo_code: GeoCode = Path(
         ...,
@@ -1086,62 +3267,66 @@ def get_numbers(
     knowledge_date: Optional[str] = Query(None, examples=[dt.date.today().strftime('%Y-%m-%d')], description='Optional. Allows to query a different state of the data in the past. Format: ISO-8601'),
     skip: Optional[int] = Query(None, examples=[0], description='Optional. Skip the first n rows.'),
     limit: Optional[int] = Query(None, examples=[100], description='Optional. Limit response to the set amount of rows.'),
-    db_sync: Engine = Depends(get_sync_engine),
+    cursor: Optional[str] = Query(None, description=DOC__CURSOR),
+    fields: Optional[str] = Query(None, description=DOC__FIELDS),
+    db_async: asyncpg.Pool = Depends(get_async_pool),
+    tables: TableRegistry = Depends(get_table_registry),
 ):
     FIRST_PATH_ELEMENT = 'values'
-    tbl_api = TableApi().get_table(db_sync)
+    keyset = use_keyset(cursor, skip, limit)
+
+    # Reflection and compilation block, therefore the query is built in the threadpool.
+    def build() -> str:
+        if knowledge_date:
+            tbl_api = tables.get_table(TableApi)
+        else:
+            # Contains only the latest row per measure, the DISTINCT ON has to pick between few rows.
+            tbl_api = tables.get_table(TableApiLatest)
 
-    query = (
-        select(
-            tbl_api.c.indicator_id,
-            tbl_api.c.geo_value,
-            tbl_api.c.measure_code,
-            tbl_api.c.indicator_value_numeric,
-            tbl_api.c.source_id,
-        )
-        .distinct(tbl_api.c.indicator_id, tbl_api.c.geo_value)
-        .where(tbl_api.c.geo_code == geo_code)
-        .where(tbl_api.c._group_value_1_is_total == True)
-        .where(tbl_api.c._group_value_2_is_total == True)
-        .where(tbl_api.c._group_value_3_is_total == True)
-        .where(tbl_api.c._group_value_4_is_total == True)
-        .order_by(tbl_api.c.indicator_id, tbl_api.c.geo_value, tbl_api.c.period_ref_from.desc())
-    )
-    if knowledge_date:
-        _knowledge_date = dt.date.fromisoformat(knowledge_date).strftime('%Y-%m-%d')
-        query = (
-            query
-            .where(tbl_api.c.knowledge_date_from <= _knowledge_date)
-            # is much faster than a coalesce (because of idx scan)
-            .where(or_(tbl_api.c.knowledge_date_to > _knowledge_date, tbl_api.c.knowledge_date_to == None))
-        )
-    else:
         query = (
-            query
-            .where(tbl_api.c.knowledge_date_to == None)
+            select(
+                tbl_api.c.indicator_id,
+                tbl_api.c.geo_value,
+                tbl_api.c.measure_code,
+                tbl_api.c.indicator_value_numeric,
+                tbl_api.c.source_id,
+            )
+            .ext(distinct_on(tbl_api.c.indicator_id, tbl_api.c.geo_value))
+            .where(tbl_api.c.geo_code == geo_code)
+            .order_by(tbl_api.c.indicator_id, tbl_api.c.geo_value, tbl_api.c.period_ref_from.desc())
         )
-    if measure:
-        query = query.where(tbl_api.c.measure_code == measure)
-    if skip:
-        query = query.offset(skip)
-    if limit:
-        query = query.limit(limit)
-
-    # Use a new approach with COPY TO STDOUT, which is much (8x) faster than
-    # gathering row by row. With the newly installed pg_parquet extension,
-    # STDOUT can transfer a prebuilt parquet file, including geometry as WKB.
-    with db_sync.connect() as conn:
-        psycopg2_connection = conn.connection
-        curs = psycopg2_connection.cursor()
-        buffer = io.BytesIO()
-        copy_sql = f"""
-            COPY (
-                {query.compile(dialect=db_sync.dialect, compile_kwargs={'literal_binds': True})}
-            ) TO STDOUT WITH (FORMAT PARQUET);
-        """
-        curs.copy_expert(copy_sql, buffer)
-        curs.close()
-        return response_decision(FIRST_PATH_ELEMENT, request, buffer)
+        if knowledge_date:
+            _knowledge_date = dt.date.fromisoformat(knowledge_date).strftime('%Y-%m-%d')
+            query = (
+                query
+                .where(tbl_api.c._group_value_1_is_total == True)
+                .where(tbl_api.c._group_value_2_is_total == True)
+                .where(tbl_api.c._group_value_3_is_total == True)
+                .where(tbl_api.c._group_value_4_is_total == True)
+                .where(tbl_api.c.knowledge_date_from <= _knowledge_date)
+                # is much faster than a coalesce (because of idx scan)
+                .where(or_(tbl_api.c.knowledge_date_to > _knowledge_date, tbl_api.c.knowledge_date_to == None))
+            )
+        if measure:
+            query = query.where(tbl_api.c.measure_code == measure)
+        if cursor:
+            # Rows are already sorted by the keyset, because of DISTINCT ON.
+            query = query.where(keyset_seek(tbl_api, VALUES_KEYSET, decode_cursor(cursor, VALUES_KEYSET)))
+        query = project_columns(query, parse_fields(fields, *(name for name, _ in (VALUES_KEYSET if keyset else ()))))
+        if skip:
+            query = query.offset(skip)
+        if limit:
+            query = query.limit(limit)
+        return compile_literal(query)
+
+    return await query_response(
+        FIRST_PATH_ELEMENT,
+        request,
+        db_async,
+        await run_in_threadpool(build),
+        keyset=VALUES_KEYSET if keyset else None,
+        limit=limit,
+    )
 
 
 # DIM MUNICIPALITIES #########################################################
@@ -1181,6 +3366,12 @@ def get_numbers(
     """),
     response_class=CsvResponse,
 )
+@app.get(
+    '/municipalities/{year}/ndjson',
+    tags=['DIM Municipalities'],
+    description='Returns municipalities of Switzerland for a given year (since 1850) as newline delimited GeoJSON features (NDJSON).',
+    response_class=NdjsonStreamingResponse,
+)
 @app.get(
     '/municipalities/{year}',
     tags=['DIM Municipalities'],
@@ -1192,7 +3383,7 @@ def get_numbers(
         * [From 2016: Swissboundaries3D](https://www.swisstopo.admin.ch/de/landschaftsmodell-swissboundaries3d)
     """),
 )
-def list_municipalities_by_year(
+async def list_municipalities_by_year(
     request: Request,
     year: int = Path(..., ge=1850, le=dt.datetime.now().year, description='Snapshot year.'),
     geometry_mode: GeometryMode = Query(
@@ -1201,48 +3392,44 @@ def list_municipalities_by_year(
     ),
     skip: Optional[int] = Query(None, examples=[0], description='Optional. Skip the first n rows.'),
     limit: Optional[int] = Query(None, examples=[100], description='Optional. Limit response to the set amount of rows.'),
-    db_sync: Engine = Depends(get_sync_engine),
+    fields: Optional[str] = Query(None, description=DOC__FIELDS),
+    db_async: asyncpg.Pool = Depends(get_async_pool),
+    tables: TableRegistry = Depends(get_table_registry),
 ):
     FIRST_PATH_ELEMENT = 'municipalities'
-    tbl_gemeinde = TableGemeinde().get_table(db_sync)
-    query = (
-        select(
-            tbl_gemeinde.c.snapshot_date,
-            tbl_gemeinde.c.gemeinde_bfs_id,
-            tbl_gemeinde.c.gemeinde_hist_bfs_id,
-            tbl_gemeinde.c.gemeinde_name,
-            tbl_gemeinde.c.bezirk_bfs_id,
-            tbl_gemeinde.c.kanton_bfs_id,
+
+    def build() -> str:
+        tbl_gemeinde = tables.get_table(TableGemeinde)
+        query = (
+            select(
+                tbl_gemeinde.c.snapshot_date,
+                tbl_gemeinde.c.gemeinde_bfs_id,
+                tbl_gemeinde.c.gemeinde_hist_bfs_id,
+                tbl_gemeinde.c.gemeinde_name,
+                tbl_gemeinde.c.bezirk_bfs_id,
+                tbl_gemeinde.c.kanton_bfs_id,
+            )
+            .where(tbl_gemeinde.c.snapshot_year == year)
         )
-        .where(tbl_gemeinde.c.snapshot_year == year)
-    )
-    match geometry_mode:
-        case GeometryMode.point:
-            query = query.add_columns(tbl_gemeinde.c.geom_center.label('geometry'))
-        case GeometryMode.border:
-            query = query.add_columns(tbl_gemeinde.c.geometry)
-        case GeometryMode.border_simple_50m:
-            query = query.add_columns(tbl_gemeinde.c.geom_border_simple_50m.label('geometry'))
-        case GeometryMode.border_simple_100m:
-            query = query.add_columns(tbl_gemeinde.c.geom_border_simple_100m.label('geometry'))
-        case GeometryMode.border_simple_500m:
-            query = query.add_columns(tbl_gemeinde.c.geom_border_simple_500m.label('geometry'))
-    if skip:
-        query = query.offset(skip)
-    if limit:
-        query = query.limit(limit)
-    with db_sync.connect() as conn:
-        psycopg2_connection = conn.connection
-        curs = psycopg2_connection.cursor()
-        buffer = io.BytesIO()
-        copy_sql = f"""
-            COPY (
-                {query.compile(dialect=db_sync.dialect, compile_kwargs={'literal_binds': True})}
-            ) TO STDOUT WITH (FORMAT PARQUET);
-        """
-        curs.copy_expert(copy_sql, buffer)
-        curs.close()
-        return response_decision(FIRST_PATH_ELEMENT, request, buffer)
+        match geometry_mode:
+            case GeometryMode.point:
+                query = query.add_columns(tbl_gemeinde.c.geom_center.label('geometry'))
+            case GeometryMode.border:
+                query = query.add_columns(tbl_gemeinde.c.geometry)
+            case GeometryMode.border_simple_50m:
+                query = query.add_columns(tbl_gemeinde.c.geom_border_simple_50m.label('geometry'))
+            case GeometryMode.border_simple_100m:
+                query = query.add_columns(tbl_gemeinde.c.geom_border_simple_100m.label('geometry'))
+            case GeometryMode.border_simple_500m:
+                query = query.add_columns(tbl_gemeinde.c.geom_border_simple_500m.label('geometry'))
+        query = project_columns(query, parse_fields(fields))
+        if skip:
+            query = query.offset(skip)
+        if limit:
+            query = query.limit(limit)
+        return compile_literal(query)
+
+    return await query_response(FIRST_PATH_ELEMENT, request, db_async, await run_in_threadpool(build))
 
 
 # DIM DISTRICTS ##############################################################
@@ -1282,6 +3469,12 @@ def list_municipalities_by_year(
     """),
     response_class=CsvResponse,
 )
+@app.get(
+    '/districts/{year}/ndjson',
+    tags=['DIM Districts'],
+    description='Returns districts of Switzerland for a given year (since 1850) as newline delimited GeoJSON features (NDJSON).',
+    response_class=NdjsonStreamingResponse,
+)
 @app.get(
     '/districts/{year}',
     tags=['DIM Districts'],
@@ -1293,7 +3486,7 @@ def list_municipalities_by_year(
         * [From 2016: Swissboundaries3D](https://www.swisstopo.admin.ch/de/landschaftsmodell-swissboundaries3d)
     """),
 )
-def list_districts_by_year(
+async def list_districts_by_year(
     request: Request,
     year: int = Path(..., ge=1850, le=dt.datetime.now().year, description='Snapshot year.'),
     geometry_mode: GeometryMode = Query(
@@ -1302,47 +3495,43 @@ def list_districts_by_year(
     ),
     skip: Optional[int] = Query(None, examples=[0], description='Optional. Skip the first n rows.'),
     limit: Optional[int] = Query(None, examples=[100], description='Optional. Limit response to the set amount of rows.'),
-    db_sync: Engine = Depends(get_sync_engine),
+    fields: Optional[str] = Query(None, description=DOC__FIELDS),
+    db_async: asyncpg.Pool = Depends(get_async_pool),
+    tables: TableRegistry = Depends(get_table_registry),
 ):
     FIRST_PATH_ELEMENT = 'districts'
-    tbl_bezirk = TableBezirk().get_table(db_sync)
 
-    query = (
-        select(
-            tbl_bezirk.c.snapshot_date,
-            tbl_bezirk.c.bezirk_bfs_id,
-            tbl_bezirk.c.bezirk_name,
-            tbl_bezirk.c.kanton_bfs_id,
+    def build() -> str:
+        tbl_bezirk = tables.get_table(TableBezirk)
+
+        query = (
+            select(
+                tbl_bezirk.c.snapshot_date,
+                tbl_bezirk.c.bezirk_bfs_id,
+                tbl_bezirk.c.bezirk_name,
+                tbl_bezirk.c.kanton_bfs_id,
+            )
+            .where(tbl_bezirk.c.snapshot_year == year)
         )
-        .where(tbl_bezirk.c.snapshot_year == year)
-    )
-    match geometry_mode:
-        case GeometryMode.point:
-            query = query.add_columns(tbl_bezirk.c.geom_center.label('geometry'))
-        case GeometryMode.border:
-            query = query.add_columns(tbl_bezirk.c.geometry)
-        case GeometryMode.border_simple_50m:
-            query = query.add_columns(tbl_bezirk.c.geom_border_simple_50m.label('geometry'))
-        case GeometryMode.border_simple_100m:
-            query = query.add_columns(tbl_bezirk.c.geom_border_simple_100m.label('geometry'))
-        case GeometryMode.border_simple_500m:
-            query = query.add_columns(tbl_bezirk.c.geom_border_simple_500m.label('geometry'))
-    if skip:
-        query = query.offset(skip)
-    if limit:
-        query = query.limit(limit)
-    with db_sync.connect() as conn:
-        psycopg2_connection = conn.connection
-        curs = psycopg2_connection.cursor()
-        buffer = io.BytesIO()
-        copy_sql = f"""
-            COPY (
-                {query.compile(dialect=db_sync.dialect, compile_kwargs={'literal_binds': True})}
-            ) TO STDOUT WITH (FORMAT PARQUET);
-        """
-        curs.copy_expert(copy_sql, buffer)
-        curs.close()
-        return response_decision(FIRST_PATH_ELEMENT, request, buffer)
+        match geometry_mode:
+            case GeometryMode.point:
+                query = query.add_columns(tbl_bezirk.c.geom_center.label('geometry'))
+            case GeometryMode.border:
+                query = query.add_columns(tbl_bezirk.c.geometry)
+            case GeometryMode.border_simple_50m:
+                query = query.add_columns(tbl_bezirk.c.geom_border_simple_50m.label('geometry'))
+            case GeometryMode.border_simple_100m:
+                query = query.add_columns(tbl_bezirk.c.geom_border_simple_100m.label('geometry'))
+            case GeometryMode.border_simple_500m:
+                query = query.add_columns(tbl_bezirk.c.geom_border_simple_500m.label('geometry'))
+        query = project_columns(query, parse_fields(fields))
+        if skip:
+            query = query.offset(skip)
+        if limit:
+            query = query.limit(limit)
+        return compile_literal(query)
+
+    return await query_response(FIRST_PATH_ELEMENT, request, db_async, await run_in_threadpool(build))
 
 
 # DIM PARQUET ################################################################
@@ -1382,6 +3571,12 @@ def list_districts_by_year(
     """),
     response_class=CsvResponse,
 )
+@app.get(
+    '/cantons/{year}/ndjson',
+    tags=['DIM Cantons'],
+    description='Returns cantons of Switzerland for a given year (since 1850) as newline delimited GeoJSON features (NDJSON).',
+    response_class=NdjsonStreamingResponse,
+)
 @app.get(
     '/cantons/{year}',
     tags=['DIM Cantons'],
@@ -1393,7 +3588,7 @@ def list_districts_by_year(
         * [From 2016: Swissboundaries3D](https://www.swisstopo.admin.ch/de/landschaftsmodell-swissboundaries3d)
     """),
 )
-def list_cantons_by_year(
+async def list_cantons_by_year(
     request: Request,
     year: int = Path(..., ge=1850, le=dt.datetime.now().year, description='Snapshot year.'),
     geometry_mode: GeometryMode = Query(
@@ -1402,44 +3597,40 @@ def list_cantons_by_year(
     ),
     skip: Optional[int] = Query(None, examples=[0], description='Optional. Skip the first n rows.'),
     limit: Optional[int] = Query(None, examples=[100], description='Optional. Limit response to the set amount of rows.'),
-    db_sync: Engine = Depends(get_sync_engine),
+    fields: Optional[str] = Query(None, description=DOC__FIELDS),
+    db_async: asyncpg.Pool = Depends(get_async_pool),
+    tables: TableRegistry = Depends(get_table_registry),
 ):
     FIRST_PATH_ELEMENT = 'cantons'
-    tbl_kanton = TableKanton().get_table(db_sync)
 
-    query = (
-        select(
-            tbl_kanton.c.snapshot_date,
-            tbl_kanton.c.kanton_bfs_id,
-            tbl_kanton.c.kanton_name,
-            tbl_kanton.c.icc,
+    def build() -> str:
+        tbl_kanton = tables.get_table(TableKanton)
+
+        query = (
+            select(
+                tbl_kanton.c.snapshot_date,
+                tbl_kanton.c.kanton_bfs_id,
+                tbl_kanton.c.kanton_name,
+                tbl_kanton.c.icc,
+            )
+            .where(tbl_kanton.c.snapshot_year == year)
         )
-        .where(tbl_kanton.c.snapshot_year == year)
-    )
-    match geometry_mode:
-        case GeometryMode.point:
-            query = query.add_columns(tbl_kanton.c.geom_center.label('geometry'))
-        case GeometryMode.border:
-            query = query.add_columns(tbl_kanton.c.geometry)
-        case GeometryMode.border_simple_50m:
-            query = query.add_columns(tbl_kanton.c.geom_border_simple_50m.label('geometry'))
-        case GeometryMode.border_simple_100m:
-            query = query.add_columns(tbl_kanton.c.geom_border_simple_100m.label('geometry'))
-        case GeometryMode.border_simple_500m:
-            query = query.add_columns(tbl_kanton.c.geom_border_simple_500m.label('geometry'))
-    if skip:
-        query = query.offset(skip)
-    if limit:
-        query = query.limit(limit)
-    with db_sync.connect() as conn:
-        psycopg2_connection = conn.connection
-        curs = psycopg2_connection.cursor()
-        buffer = io.BytesIO()
-        copy_sql = f"""
-            COPY (
-                {query.compile(dialect=db_sync.dialect, compile_kwargs={'literal_binds': True})}
-            ) TO STDOUT WITH (FORMAT PARQUET);
-        """
-        curs.copy_expert(copy_sql, buffer)
-        curs.close()
-        return response_decision(FIRST_PATH_ELEMENT, request, buffer)
+        match geometry_mode:
+            case GeometryMode.point:
+                query = query.add_columns(tbl_kanton.c.geom_center.label('geometry'))
+            case GeometryMode.border:
+                query = query.add_columns(tbl_kanton.c.geometry)
+            case GeometryMode.border_simple_50m:
+                query = query.add_columns(tbl_kanton.c.geom_border_simple_50m.label('geometry'))
+            case GeometryMode.border_simple_100m:
+                query = query.add_columns(tbl_kanton.c.geom_border_simple_100m.label('geometry'))
+            case GeometryMode.border_simple_500m:
+                query = query.add_columns(tbl_kanton.c.geom_border_simple_500m.label('geometry'))
+        query = project_columns(query, parse_fields(fields))
+        if skip:
+            query = query.offset(skip)
+        if limit:
+            query = query.limit(limit)
+        return compile_literal(query)
+
+    return await query_response(FIRST_PATH_ELEMENT, request, db_async, await run_in_threadpool(build))
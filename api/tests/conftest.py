@@ -1,10 +1,146 @@
+import io
+from contextlib import asynccontextmanager
+
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
 from fastapi.testclient import TestClient
+from geoalchemy2 import Geometry
+from sqlalchemy import BOOLEAN
+from sqlalchemy import DATE
+from sqlalchemy import NUMERIC
+from sqlalchemy import SMALLINT
+from sqlalchemy import TEXT
+from sqlalchemy import TIMESTAMP
+from sqlalchemy import Column
+from sqlalchemy import MetaData
+from sqlalchemy import Table
+from sqlalchemy import create_engine
 
+import odapi
 from odapi import app
 
 
+def make_parquet(table: pa.Table) -> io.BytesIO:
+    """Parquet file of the table, like COPY returns it."""
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    buffer.seek(0)
+    return buffer
+
+
+class FakePool:
+    """Pool of asyncpg with one connection, counts the acquired connections like asyncpg."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.in_use = 0
+
+    @asynccontextmanager
+    async def acquire(self):
+        self.in_use += 1
+        try:
+            yield self.connection
+        finally:
+            self.in_use -= 1
+
+    def get_size(self) -> int:
+        return 1
+
+    def get_idle_size(self) -> int:
+        return 1 - self.in_use
+
+    def get_max_size(self) -> int:
+        return 1
+
+
 @pytest.fixture(scope='session')
 def client():
     with TestClient(app) as client:
         yield client
+
+
+class OfflineTableRegistry(odapi.TableRegistry):
+    """Registry with hand written table definitions, does not need a database."""
+
+    _GEOMETRY_COLUMNS = (
+        'geom_center',
+        'geom_border',
+        'geom_border_simple_50m',
+        'geom_border_simple_100m',
+        'geom_border_simple_500m',
+    )
+
+    def reflect(self, definition):
+        metadata = MetaData(schema=definition.SCHEMA)
+        geometries = [Column(name, Geometry(srid=4326)) for name in self._GEOMETRY_COLUMNS]
+        match definition:
+            case odapi.TableApi | odapi.TableApiCurrent | odapi.TableApiLatest:
+                groups = []
+                for i in range(1, 5):
+                    groups += [
+                        Column(f'group_{i}_id', SMALLINT),
+                        Column(f'group_value_{i}_id', SMALLINT),
+                        Column(f'_group_value_{i}_is_total', BOOLEAN),
+                    ]
+                columns = [
+                    Column('indicator_id', SMALLINT),
+                    Column('geo_code', TEXT),
+                    Column('geo_value', SMALLINT),
+                    Column('knowledge_date_from', TIMESTAMP),
+                    Column('knowledge_date_to', TIMESTAMP),
+                    Column('period_type', TEXT),
+                    Column('period_code', TEXT),
+                    Column('period_ref_from', DATE),
+                    Column('period_ref', DATE),
+                    *groups,
+                    Column('indicator_value_numeric', NUMERIC(32, 9)),
+                    Column('indicator_value_text', TEXT),
+                    Column('measure_code', TEXT),
+                    Column('source_id', SMALLINT),
+                ]
+            case odapi.TableIndicator | odapi.TableAvailableIndicator:
+                columns = [
+                    Column('indicator_id', SMALLINT),
+                    Column('geo_code', TEXT),
+                    Column('indicator_name', TEXT),
+                    *[Column(f'topic_{i}', TEXT) for i in range(1, 5)],
+                    Column('indicator_unit', TEXT),
+                    Column('indicator_description', TEXT),
+                    Column('measure_codes', TEXT),
+                ]
+            case odapi.TableGemeindeLatest:
+                columns = [
+                    Column('gemeinde_bfs_id', SMALLINT),
+                    Column('gemeinde_name', TEXT),
+                    Column('bezirk_bfs_id', SMALLINT),
+                    Column('kanton_bfs_id', SMALLINT),
+                    *geometries,
+                ]
+            case odapi.TableBezirkLatest:
+                columns = [
+                    Column('bezirk_bfs_id', SMALLINT),
+                    Column('bezirk_name', TEXT),
+                    Column('kanton_bfs_id', SMALLINT),
+                    *geometries,
+                ]
+            case odapi.TableKantonLatest:
+                columns = [
+                    Column('kanton_bfs_id', SMALLINT),
+                    Column('kanton_name', TEXT),
+                    *geometries,
+                ]
+            case odapi.TableDimSource | odapi.TableDimGroup | odapi.TableDimGroupValue:
+                columns = [column.copy() for column in definition.COLUMNS]
+        return Table(definition.TABLE_NAME, metadata, *columns)
+
+
+@pytest.fixture
+def offline_engine():
+    # Engine is only used for its dialect, no connection is made.
+    return create_engine('postgresql+psycopg2://odapi@localhost/odapi')
+
+
+@pytest.fixture
+def offline_tables(offline_engine):
+    return OfflineTableRegistry(offline_engine)
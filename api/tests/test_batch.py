@@ -0,0 +1,63 @@
+import pyarrow as pa
+import pytest
+from fastapi import HTTPException
+
+import odapi
+
+
+class StaticGeoDimCache(odapi.GeoDimCache):
+
+    def __init__(self, tables: dict):
+        super().__init__(engine=None, tables=None)
+        self.tables = tables
+
+    def load(self, geo_code, geometry_mode):
+        return self.tables[geo_code]
+
+
+@pytest.fixture
+def geo_dims():
+    return StaticGeoDimCache({
+        odapi.GeoCode.polg: pa.table({
+            'geo_value': [1, 2, 230, 261],
+            'geo_name': ['Aeugst', 'Affoltern', 'Winterthur', 'Zürich'],
+            'bezirk_bfs_id': [101, 101, 110, 112],
+            'kanton_bfs_id': [1, 1, 1, 1],
+            'geometry': pa.array([None] * 4, pa.binary()),
+        }),
+        odapi.GeoCode.kant: pa.table({
+            'geo_value': [1, 2],
+            'geo_name': ['Zürich', 'Bern'],
+            'geometry': pa.array([None] * 2, pa.binary()),
+        }),
+    })
+
+
+@pytest.mark.unit
+def test_geo_values_of_parent(geo_dims):
+    mode = odapi.GeometryMode.point
+    assert geo_dims.geo_values_of_parent(odapi.GeoCode.polg, mode, 'bezirk_bfs_id', 101) == [1, 2]
+    assert geo_dims.geo_values_of_parent(odapi.GeoCode.polg, mode, 'kanton_bfs_id', 2) == []
+
+
+@pytest.mark.unit
+def test_geo_values_of_unknown_parent(geo_dims):
+    with pytest.raises(HTTPException) as excinfo:
+        geo_dims.geo_values_of_parent(odapi.GeoCode.kant, odapi.GeometryMode.point, 'kanton_bfs_id', 1)
+    assert excinfo.value.status_code == 400
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('value, literal', [([1, 2], 'ARRAY[1, 2]'), ([], "'{}'")])
+def test_sql_literal_list(value, literal):
+    assert odapi.sql_literal(value) == literal
+
+
+@pytest.mark.unit
+def test_batch_template_filters_lists(offline_tables):
+    shape = odapi.IndicatorQueryShape(geo_code=odapi.GeoCode.polg, filter_indicator_ids=True, filter_geo_values=True)
+    template = odapi.QueryTemplateCache().get(shape, lambda: odapi.build_indicator_query(offline_tables, shape))
+    params = odapi.indicator_query_params(odapi.GeoCode.polg, indicator_ids=[1, 2], geo_values=[230, 261])
+    sql = odapi.bind_template(template, params)
+    assert 'mart_ogd_api_current.indicator_id = ANY (ARRAY[1, 2])' in sql
+    assert 'mart_ogd_api_current.geo_value = ANY (ARRAY[230, 261])' in sql
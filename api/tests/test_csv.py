@@ -0,0 +1,38 @@
+import csv
+import io
+
+import pyarrow as pa
+import pytest
+import shapely
+
+import odapi
+from tests.conftest import make_parquet
+
+
+def read_csv(buffer: io.BytesIO) -> list[dict]:
+    return list(csv.DictReader(io.StringIO(buffer.getvalue().decode())))
+
+
+@pytest.mark.unit
+def test_csv_converts_geometry_to_wkt():
+    point = shapely.Point(8.5, 47.3)
+    polygon = shapely.box(8.0, 47.0, 8.1, 47.1)
+    table = pa.table({
+        'geo_value': [1, 1, 2, 3],
+        'indicator_value_numeric': [1.5, 2.5, None, 4.0],
+        'geometry': pa.array([shapely.to_wkb(point), shapely.to_wkb(point), shapely.to_wkb(polygon), None], pa.binary()),
+    })
+    rows = read_csv(odapi.parquet_to_csv(make_parquet(table), batch_rows=3))
+    assert [row['geo_value'] for row in rows] == ['1', '1', '2', '3']
+    assert rows[0]['geometry'] == point.wkt
+    assert rows[1]['geometry'] == point.wkt
+    assert rows[2]['geometry'] == polygon.wkt
+    assert rows[3]['geometry'] == ''
+    assert rows[2]['indicator_value_numeric'] == ''
+
+
+@pytest.mark.unit
+def test_csv_without_geometry():
+    table = pa.table({'geo_value': [1, 2], 'indicator_name': ['a', 'b,c']})
+    rows = read_csv(odapi.parquet_to_csv(make_parquet(table)))
+    assert rows == [{'geo_value': '1', 'indicator_name': 'a'}, {'geo_value': '2', 'indicator_name': 'b,c'}]
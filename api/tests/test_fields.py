@@ -0,0 +1,100 @@
+import pyarrow as pa
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+
+import odapi
+
+
+def build(offline_tables, **kwargs) -> odapi.Select:
+    shape = odapi.IndicatorQueryShape(geo_code=odapi.GeoCode.polg, **kwargs)
+    return odapi.build_indicator_query(offline_tables, shape)
+
+
+@pytest.mark.unit
+def test_parse_fields():
+    assert odapi.parse_fields(None, 'geo_value') is None
+    assert odapi.parse_fields(' period_ref, indicator_value_numeric ,', 'geo_value') == {
+        'geo_value', 'period_ref', 'indicator_value_numeric',
+    }
+    with pytest.raises(HTTPException) as excinfo:
+        odapi.parse_fields(' , ')
+    assert excinfo.value.status_code == 400
+
+
+@pytest.mark.unit
+def test_all_columns_without_fields(offline_tables):
+    columns = list(build(offline_tables).selected_columns.keys())
+    assert columns[:3] == ['indicator_id', 'geo_code', 'geo_value']
+    assert {'group_1_name', 'group_4_value', 'source', 'knowledge_date'} <= set(columns)
+    assert columns[-1] == 'geometry'
+
+
+@pytest.mark.unit
+def test_fields_prune_columns_and_joins(offline_tables):
+    fields = odapi.parse_fields('period_ref,indicator_value_numeric', 'geo_value')
+    query = build(offline_tables, join_indicator=True, join_geo=True, fields=fields)
+    assert list(query.selected_columns.keys()) == ['geo_value', 'period_ref', 'indicator_value_numeric']
+    sql = odapi.compile_literal(query)
+    assert 'JOIN' not in sql
+    assert 'dim_group' not in sql
+    assert 'dim_source.id = dbt_marts.mart_ogd_api_current.source_id' in sql
+    # Joins without columns are replaced by EXISTS, which returns the same rows.
+    assert sql.count('EXISTS') == 3
+
+
+@pytest.mark.unit
+def test_fields_keep_requested_joins(offline_tables):
+    fields = odapi.parse_fields('group_2_value,source,geo_name', 'geo_value')
+    query = build(offline_tables, join_geo=True, fields=fields)
+    assert list(query.selected_columns.keys()) == ['geo_value', 'group_2_value', 'source', 'geo_name']
+    sql = odapi.compile_literal(query)
+    assert 'tbl_dim_group_value_2' in sql
+    assert 'tbl_dim_group_2 ' not in sql
+    assert 'dim_gemeinde_latest' in sql
+
+
+@pytest.mark.unit
+def test_fields_keep_cursor_columns(offline_tables):
+    keyset_names = [name for name, _ in odapi.INDICATOR_KEYSET]
+    fields = odapi.parse_fields('indicator_value_numeric', 'geo_value', *keyset_names)
+    query = build(offline_tables, keyset=True, limit=True, fields=fields)
+    assert set(keyset_names) <= set(query.selected_columns.keys())
+
+
+@pytest.mark.unit
+def test_unknown_field(offline_tables):
+    with pytest.raises(HTTPException) as excinfo:
+        build(offline_tables, fields=frozenset({'geo_value', 'geo_name'}))
+    assert excinfo.value.status_code == 400
+    assert 'geo_name' in excinfo.value.detail
+    # Geo columns are valid with join_geo, also when they are attached from the GeoDimCache.
+    build(offline_tables, join_geo=True, attach_geo=True, fields=frozenset({'geo_value', 'geo_name'}))
+
+
+@pytest.mark.unit
+def test_project_columns(offline_tables):
+    tbl_api = offline_tables.get_table(odapi.TableApi)
+    query = select(tbl_api.c.indicator_id, tbl_api.c.geo_value, tbl_api.c.source_id).where(tbl_api.c.geo_code == 'polg')
+    projected = odapi.project_columns(query, frozenset({'source_id', 'indicator_id'}))
+    assert list(projected.selected_columns.keys()) == ['indicator_id', 'source_id']
+    assert "geo_code = 'polg'" in odapi.compile_literal(projected)
+    assert odapi.project_columns(query, None) is query
+    with pytest.raises(HTTPException):
+        odapi.project_columns(query, frozenset({'geometry'}))
+
+
+@pytest.mark.unit
+def test_geo_dim_fields():
+    table = pa.table({
+        'geo_value': [230, 261],
+        'geo_name': ['Winterthur', 'Zürich'],
+        'kanton_bfs_id': [1, 1],
+        'geometry': pa.array([b'\x01', b'\x02'], pa.binary()),
+    })
+    geo_dims = odapi.GeoDimCache(engine=None, tables=None)
+    geo_dims.load = lambda geo_code, geometry_mode: table
+    geo_dim = geo_dims.get(odapi.GeoCode.polg, odapi.GeometryMode.point, join_geo=True, fields=frozenset({'geo_value', 'geo_name'}))
+    assert geo_dim.table.column_names == ['geo_value', 'geo_name']
+    geo_dim = geo_dims.get(odapi.GeoCode.polg, odapi.GeometryMode.point, fields=frozenset({'geo_value', 'geometry'}))
+    assert geo_dim.table.column_names == ['geo_value', 'geometry']
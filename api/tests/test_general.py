@@ -32,3 +32,12 @@ def test_swagger_ui_docs_page(client):
     assert response.status_code == 200
     html = response.text
     assert '<title>Swagger UI</title>' in html or 'swagger-ui' in html.lower()
+
+
+@pytest.mark.integration
+def test_pool_status_available(client):
+    response = client.get('/status/pool')
+    assert response.status_code == 200
+    payload = response.json()
+    assert payload['pool_size'] > 0
+    assert payload['checked_out'] >= 0
@@ -0,0 +1,133 @@
+import csv
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import shapely
+
+import odapi
+from tests.conftest import make_parquet
+
+
+@pytest.fixture
+def dim_table():
+    return pa.table({
+        'geo_value': pa.array([230, 261], pa.int64()),
+        'geo_name': ['Winterthur', 'Zürich'],
+        'geometry': pa.array([shapely.to_wkb(shapely.Point(8.7, 47.5)), shapely.to_wkb(shapely.Point(8.5, 47.4))], pa.binary()),
+    })
+
+
+@pytest.fixture
+def facts():
+    return pa.table({
+        'geo_value': pa.array([261, 230, 261, 999], pa.int32()),
+        'indicator_value_numeric': [1.0, 2.0, 3.0, 4.0],
+    })
+
+
+class StaticGeoDimCache(odapi.GeoDimCache):
+
+    def __init__(self, table: pa.Table):
+        super().__init__(engine=None, tables=None)
+        self.table = table
+        self.loads = []
+
+    def load(self, geo_code, geometry_mode):
+        self.loads.append((geo_code, geometry_mode))
+        return self.table
+
+
+@pytest.mark.unit
+def test_lean_query_does_not_join_geometry(offline_tables):
+    shape = odapi.IndicatorQueryShape(geo_code=odapi.GeoCode.polg, join_geo=True, attach_geo=True)
+    sql = odapi.compile_literal(odapi.build_indicator_query(offline_tables, shape))
+    assert 'EXISTS' in sql
+    assert 'ST_AsBinary' not in sql
+    assert 'geo_name' not in sql
+    assert 'dim_bezirk_latest' not in sql
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('geo_code', list(odapi.GeoCode))
+def test_geo_dim_query(offline_tables, geo_code):
+    sql = odapi.compile_literal(odapi.build_geo_dim_query(offline_tables, geo_code, odapi.GeometryMode.border))
+    assert 'ST_AsBinary' in sql
+    assert 'geom_border ' in sql or 'geom_border)' in sql
+
+
+@pytest.mark.unit
+def test_attach_keeps_row_order(dim_table, facts):
+    geo_dim = odapi.GeoDim(dim_table)
+    attached = geo_dim.attach(facts)
+    assert attached.column_names == ['geo_value', 'indicator_value_numeric', 'geo_name', 'geometry']
+    assert attached.column('geo_name').to_pylist() == ['Zürich', 'Winterthur', 'Zürich', None]
+    assert attached.schema == geo_dim.schema(facts.schema)
+
+
+@pytest.mark.unit
+def test_attach_dictionary_geometry(dim_table, facts):
+    geo_dim = odapi.GeoDim(dim_table)
+    attached = geo_dim.attach(facts, dictionary_geometry=True)
+    geometry = attached.column('geometry').combine_chunks()
+    assert pa.types.is_dictionary(geometry.type)
+    assert len(geometry.dictionary) == 2
+    assert geometry.to_pylist() == geo_dim.attach(facts).column('geometry').to_pylist()
+
+
+@pytest.mark.unit
+def test_cache_loads_once_per_geometry_mode(dim_table):
+    geo_dims = StaticGeoDimCache(dim_table)
+    assert geo_dims.get(odapi.GeoCode.polg, odapi.GeometryMode.border).table.column_names == ['geo_value', 'geometry']
+    assert geo_dims.get(odapi.GeoCode.polg, odapi.GeometryMode.border, join_geo=True).table.column_names == ['geo_value', 'geo_name', 'geometry']
+    geo_dims.get(odapi.GeoCode.polg, odapi.GeometryMode.point)
+    assert len(geo_dims.loads) == 2
+    geo_dims.refresh()
+    assert len(geo_dims.loads) == 4
+    assert len(geo_dims) == 2
+
+
+@pytest.mark.unit
+def test_csv_with_attached_geometry(dim_table, facts):
+    buffer = odapi.parquet_to_csv(make_parquet(facts), geo_dim=odapi.GeoDim(dim_table))
+    rows = list(csv.DictReader(io.StringIO(buffer.getvalue().decode())))
+    assert [row['geometry'] for row in rows] == ['POINT (8.5 47.4)', 'POINT (8.7 47.5)', 'POINT (8.5 47.4)', '']
+
+
+@pytest.mark.unit
+def test_deduplicated_parquet_with_attached_geometry_is_geoparquet(dim_table, facts):
+    buffer = odapi.deduplicate_parquet_geometry(make_parquet(facts), geo_dim=odapi.GeoDim(dim_table))
+    metadata = json.loads(pq.read_schema(buffer).metadata[b'geo'])
+    assert metadata['primary_column'] == 'geometry'
+    assert metadata['columns']['geometry']['encoding'] == 'WKB'
+
+
+@pytest.mark.unit
+def test_deduplicated_parquet_keeps_geo_metadata_of_copy(dim_table):
+    geo = b'{"version": "1.1.0", "primary_column": "geometry", "columns": {"geometry": {"encoding": "WKB", "geometry_types": ["Point"]}}}'
+    table = dim_table.replace_schema_metadata({b'geo': geo})
+    buffer = odapi.deduplicate_parquet_geometry(make_parquet(table))
+    assert pq.read_schema(buffer).metadata[b'geo'] == geo
+
+
+@pytest.mark.unit
+def test_joined_and_attached_geometry_have_same_encoding(offline_tables):
+    joined = odapi.IndicatorQueryShape(geo_code=odapi.GeoCode.polg, join_geo=True)
+    joined_sql = odapi.compile_literal(odapi.build_indicator_query(offline_tables, joined))
+    attached_sql = odapi.compile_literal(odapi.build_geo_dim_query(offline_tables, odapi.GeoCode.polg, odapi.GeometryMode.border_simple_100m))
+    geometry = 'ST_AsBinary(dbt_marts.dim_gemeinde_latest.geom_border_simple_100m) AS geometry'
+    assert geometry in joined_sql
+    assert geometry in attached_sql
+    assert 'EWKB' not in joined_sql
+
+
+@pytest.mark.unit
+def test_inline_and_deduplicated_layouts_are_equal_bytes(dim_table, facts):
+    geo_dim = odapi.GeoDim(dim_table)
+    inline = odapi.deduplicate_parquet_geometry(make_parquet(geo_dim.attach(facts)))
+    attached = odapi.deduplicate_parquet_geometry(make_parquet(facts), geo_dim=geo_dim)
+    inline_geometry = pq.read_table(inline).column('geometry').to_pylist()
+    assert inline_geometry == pq.read_table(attached).column('geometry').to_pylist()
+    assert inline_geometry[0] == shapely.to_wkb(shapely.Point(8.5, 47.4))
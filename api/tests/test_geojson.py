@@ -0,0 +1,61 @@
+import datetime as dt
+import json
+
+import pyarrow as pa
+import pytest
+import shapely
+
+import odapi
+from tests.conftest import make_parquet
+
+
+@pytest.fixture
+def indicator_table():
+    point = shapely.to_wkb(shapely.Point(8.5, 47.3))
+    return pa.table({
+        'geo_value': [230, 230, 261],
+        'indicator_value_numeric': [1.5, None, 3.0],
+        'period_ref': [dt.date(2023, 12, 31)] * 3,
+        'geometry': pa.array([point, point, None], pa.binary()),
+    })
+
+
+@pytest.mark.unit
+def test_geojson_feature_collection(indicator_table):
+    chunks = list(odapi.iter_geojson(make_parquet(indicator_table), batch_rows=2))
+    assert len(chunks) > 2
+    collection = json.loads(b''.join(chunks))
+    assert collection['type'] == 'FeatureCollection'
+    assert [feature['id'] for feature in collection['features']] == ['0', '1', '2']
+    assert collection['features'][0]['geometry'] == {'type': 'Point', 'coordinates': [8.5, 47.3]}
+    assert collection['features'][0]['properties'] == {
+        'geo_value': 230, 'indicator_value_numeric': 1.5, 'period_ref': '2023-12-31',
+    }
+    assert collection['features'][1]['properties']['indicator_value_numeric'] is None
+    assert collection['features'][2]['geometry'] is None
+
+
+@pytest.mark.unit
+def test_geojson_newline_delimited(indicator_table):
+    body = b''.join(odapi.iter_geojson(make_parquet(indicator_table), newline_delimited=True, batch_rows=2))
+    lines = body.decode().splitlines()
+    assert len(lines) == 3
+    assert all(json.loads(line)['type'] == 'Feature' for line in lines)
+
+
+@pytest.mark.unit
+def test_geojson_empty_result():
+    table = pa.table({'geo_value': pa.array([], pa.int64()), 'geometry': pa.array([], pa.binary())})
+    assert json.loads(b''.join(odapi.iter_geojson(make_parquet(table)))) == {'type': 'FeatureCollection', 'features': []}
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('path, media_type', [
+    ('/indicator/polg/1', 'application/geo+json'),
+    ('/indicator/polg/1/ndjson', 'application/x-ndjson'),
+])
+def test_response_decision_streams_geojson(indicator_table, path, media_type):
+    request = odapi.Request({'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'headers': []})
+    response = odapi.response_decision('indicator', request, make_parquet(indicator_table))
+    assert isinstance(response, odapi.StreamingResponse)
+    assert response.media_type == media_type
@@ -0,0 +1,62 @@
+import asyncio
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import shapely
+from fastapi import HTTPException
+from fastapi import Request
+
+import odapi
+from tests.conftest import make_parquet
+
+
+@pytest.fixture
+def time_series():
+    """Two municipalities with detailed borders and 50 periods each."""
+    borders = {
+        230: shapely.to_wkb(shapely.Point(8.7, 47.5).buffer(0.1, quad_segs=256)),
+        261: shapely.to_wkb(shapely.Point(8.5, 47.4).buffer(0.1, quad_segs=256)),
+    }
+    geo_values = [geo_value for geo_value in borders for _ in range(50)]
+    return pa.table({
+        'geo_value': geo_values,
+        'indicator_value_numeric': [float(i) for i in range(len(geo_values))],
+        'geometry': pa.array([borders[geo_value] for geo_value in geo_values], pa.binary()),
+    })
+
+
+@pytest.mark.unit
+def test_parquet_deduplicated_geometry(time_series):
+    # Full borders of all municipalities exceed the default dictionary page
+    # limit, the writer then falls back to plain encoding.
+    inline = io.BytesIO()
+    pq.write_table(time_series, inline, use_dictionary=False)
+    inline.seek(0)
+    deduplicated = odapi.deduplicate_parquet_geometry(inline)
+    assert len(deduplicated.getvalue()) * 10 < len(inline.getvalue())
+    table = pq.read_table(deduplicated)
+    assert pa.types.is_dictionary(table.schema.field('geometry').type)
+    assert len(table.column('geometry').combine_chunks().dictionary) == 2
+    assert table.column('geometry').to_pylist() == time_series.column('geometry').to_pylist()
+
+
+@pytest.mark.unit
+def test_json_deduplicated_geometry(time_series):
+    body = b''.join(odapi.iter_json_deduplicated(make_parquet(time_series), batch_rows=30))
+    content = json.loads(body)
+    assert len(content['data']) == 100
+    assert 'geometry' not in content['data'][0]
+    assert content['data'][0]['geo_value'] == 230
+    assert set(content['geometries']) == {'230', '261'}
+    assert content['geometries']['230']['type'] == 'Polygon'
+
+
+@pytest.mark.unit
+def test_deduplicated_layout_rejects_csv():
+    request = Request({'type': 'http', 'method': 'GET', 'path': '/indicator/polg/1/csv', 'query_string': b'', 'headers': []})
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(odapi.query_response('indicator', request, None, 'SELECT 1', geometry_layout=odapi.GeometryLayout.deduplicated))
+    assert excinfo.value.status_code == 400
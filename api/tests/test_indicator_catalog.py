@@ -0,0 +1,88 @@
+import pandas as pd
+import pytest
+
+import odapi
+
+
+@pytest.fixture
+def indicators():
+    return pd.DataFrame([
+        {
+            'indicator_id': 1, 'indicator_name': 'Bevölkerung', 'topic_1': 'Bevölkerung', 'topic_2': 'Bestand',
+            'topic_3': None, 'topic_4': None, 'indicator_unit': 'Personen',
+            'indicator_description': 'Ständige Wohnbevölkerung', 'measure_codes': '[zahl]',
+        },
+        {
+            'indicator_id': 2, 'indicator_name': 'Bevölkerungswachstum', 'topic_1': 'Bevölkerung', 'topic_2': 'Entwicklung',
+            'topic_3': None, 'topic_4': None, 'indicator_unit': 'Prozent',
+            'indicator_description': 'Veränderung zum Vorjahr', 'measure_codes': '[zahl]',
+        },
+        {
+            'indicator_id': 3, 'indicator_name': 'Wohnungsbestand', 'topic_1': 'Bau und Wohnen', 'topic_2': None,
+            'topic_3': None, 'topic_4': None, 'indicator_unit': 'Wohnungen',
+            'indicator_description': 'Grundlage der Leerwohnungsziffer', 'measure_codes': '[zahl]',
+        },
+        {
+            'indicator_id': 30, 'indicator_name': 'Leerwohnungsziffer', 'topic_1': 'Bau und Wohnen', 'topic_2': None,
+            'topic_3': None, 'topic_4': None, 'indicator_unit': 'Prozent',
+            'indicator_description': 'Anteil leerer Wohnungen, Bevölkerung nicht berücksichtigt', 'measure_codes': '[zahl]',
+        },
+    ])
+
+
+class StaticIndicatorCatalogCache(odapi.IndicatorCatalogCache):
+
+    def __init__(self, df: pd.DataFrame):
+        super().__init__(engine=None, tables=None)
+        self.df = df
+        self.loads = []
+
+    def load(self, geo_code):
+        self.loads.append(geo_code)
+        return self.df
+
+
+def ids(records):
+    return [record['indicator_id'] for record in records]
+
+
+@pytest.mark.unit
+def test_catalog_is_loaded_once_per_geo_code(indicators):
+    catalogs = StaticIndicatorCatalogCache(indicators)
+    first = catalogs.get(odapi.GeoCode.polg)
+    assert catalogs.get(odapi.GeoCode.polg) is first
+    catalogs.get(odapi.GeoCode.kant)
+    assert catalogs.loads == [odapi.GeoCode.polg, odapi.GeoCode.kant]
+    catalogs.clear()
+    catalogs.get(odapi.GeoCode.polg)
+    assert len(catalogs.loads) == 3
+
+
+@pytest.mark.unit
+def test_catalog_keeps_records_and_tree(indicators):
+    catalog = odapi.IndicatorCatalog.from_frame(indicators)
+    assert catalog.records == indicators.to_dict(orient='records')
+    assert catalog.tree == odapi.generate_indicator_tree(indicators)
+    assert '[#0030] Leerwohnungsziffer (Prozent)' in catalog.tree
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('q, expected', [
+    ('bevölkerung', [1, 2, 30]),
+    ('BEV entw', [2]),
+    ('prozent', [2, 30]),
+    ('wohn', [3, 1, 30]),
+    ('leer', [30, 3]),
+    ('30', [30]),
+    ('unbekannt', []),
+    ('  ', []),
+])
+def test_search(indicators, q, expected):
+    catalog = odapi.IndicatorCatalog.from_frame(indicators)
+    assert ids(catalog.search(q)) == expected
+
+
+@pytest.mark.unit
+def test_search_limit(indicators):
+    catalog = odapi.IndicatorCatalog.from_frame(indicators)
+    assert ids(catalog.search('bev', limit=2)) == [1, 2]
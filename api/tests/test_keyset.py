@@ -0,0 +1,89 @@
+import datetime as dt
+
+import pyarrow as pa
+import pytest
+from fastapi import HTTPException
+
+import odapi
+from tests.conftest import make_parquet
+
+
+@pytest.mark.unit
+def test_cursor_roundtrip():
+    values = [1, 230, '2023-12-31', 'zahl', 0, 0, 0, 0]
+    cursor = odapi.encode_cursor(values)
+    assert '=' not in cursor
+    assert odapi.decode_cursor(cursor, odapi.INDICATOR_KEYSET) == values
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('cursor', [
+    'not-a-cursor',
+    odapi.encode_cursor([1, 2, 3]),
+    odapi.encode_cursor({'a': 1}),
+    odapi.encode_cursor([{'a': 1}, 2]),
+    odapi.encode_cursor([1, '230']),
+    odapi.encode_cursor([True, 230]),
+])
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        odapi.decode_cursor(cursor, odapi.VALUES_KEYSET)
+    assert excinfo.value.status_code == 400
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('values', [
+    [1, 230, '2023-13-31', 'zahl', 0, 0, 0, 0],
+    [1, 230, 20231231, 'zahl', 0, 0, 0, 0],
+    [1, 230, '2023-12-31', None, 0, 0, 0, 0],
+    [1, 230, '2023-12-31', 'zahl', 0, 0, 0, 0.5],
+])
+def test_invalid_indicator_cursor(values):
+    with pytest.raises(HTTPException) as excinfo:
+        odapi.decode_cursor(odapi.encode_cursor(values), odapi.INDICATOR_KEYSET)
+    assert excinfo.value.status_code == 400
+
+
+@pytest.mark.unit
+def test_use_keyset():
+    assert odapi.use_keyset('', None, 100)
+    assert odapi.use_keyset('abc', None, 100)
+    # Plain limit keeps the unsorted rows of the query.
+    assert not odapi.use_keyset(None, None, 100)
+    assert not odapi.use_keyset(None, 100, 100)
+    assert not odapi.use_keyset(None, None, None)
+    with pytest.raises(HTTPException):
+        odapi.use_keyset('abc', 100, 100)
+    with pytest.raises(HTTPException):
+        odapi.use_keyset('abc', None, None)
+    with pytest.raises(HTTPException):
+        odapi.use_keyset('', None, None)
+
+
+@pytest.mark.unit
+def test_next_cursor_points_after_last_row():
+    table = pa.table({
+        'indicator_id': [1, 1],
+        'geo_value': [230, 261],
+        'period_ref': [dt.date(2023, 12, 30), dt.date(2023, 12, 31)],
+        'measure_code': ['zahl', None],
+        'group_value_1_id': pa.array([1, None], pa.int16()),
+        'group_value_2_id': pa.array([None, None], pa.int16()),
+        'group_value_3_id': pa.array([None, None], pa.int16()),
+        'group_value_4_id': pa.array([None, None], pa.int16()),
+    })
+    cursor = odapi.next_cursor(make_parquet(table), odapi.INDICATOR_KEYSET, limit=2)
+    assert odapi.decode_cursor(cursor, odapi.INDICATOR_KEYSET) == [1, 261, '2023-12-31', '', 0, 0, 0, 0]
+    assert odapi.next_cursor(make_parquet(table), odapi.INDICATOR_KEYSET, limit=3) is None
+
+
+@pytest.mark.unit
+def test_seek_template(offline_tables):
+    shape = odapi.IndicatorQueryShape(geo_code=odapi.GeoCode.polg, filter_indicator_id=True, limit=True, keyset=True, seek=True)
+    template = odapi.QueryTemplateCache().get(shape, lambda: odapi.build_indicator_query(offline_tables, shape))
+    assert 'ORDER BY dbt_marts.mart_ogd_api_current.indicator_id' in template
+    params = odapi.indicator_query_params(odapi.GeoCode.polg, indicator_id=1, limit=100)
+    params.update(odapi.cursor_params(odapi.encode_cursor([1, 230, '2023-12-31', 'zahl', 0, 0, 0, 0]), odapi.INDICATOR_KEYSET))
+    sql = odapi.bind_template(template, params)
+    assert "> (1, 230, '2023-12-31', 'zahl', 0, 0, 0, 0)" in sql
+    assert "coalesce(dbt_marts.mart_ogd_api_current.group_value_1_id, 0)" in sql
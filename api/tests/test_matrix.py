@@ -0,0 +1,96 @@
+import asyncio
+import datetime as dt
+import decimal
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from starlette.requests import Request
+
+import odapi
+from tests.conftest import FakePool
+
+
+@pytest.fixture
+def long_format():
+    table = pa.table({
+        'indicator_id': pa.array([10, 10, 2, 2, 2], pa.int16()),
+        'measure_code': ['zahl', 'zahl', 'zahl', 'pro100', 'zahl'],
+        'geo_value': pa.array([261, 230, 230, 230, 261], pa.int16()),
+        'period_ref': [dt.date(2023, 12, 31)] * 2 + [dt.date(2022, 12, 31)] * 3,
+        'indicator_value_numeric': pa.array(
+            [decimal.Decimal('1.5'), None, decimal.Decimal('3'), decimal.Decimal('0.25'), decimal.Decimal('4')],
+            pa.decimal128(32, 9),
+        ),
+    })
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.mark.unit
+def test_pivot_matrix(long_format):
+    table = odapi.pivot_matrix(long_format)
+    assert table.column_names == ['geo_value', '2_pro100', '2_zahl', '10_zahl']
+    assert table.column('geo_value').to_pylist() == [230, 261]
+    assert table.column('2_zahl').to_pylist() == [3.0, 4.0]
+    assert table.column('2_pro100').to_pylist() == [0.25, None]
+    assert table.column('10_zahl').to_pylist() == [None, 1.5]
+
+
+@pytest.mark.unit
+def test_matrix_json_contains_periods(long_format):
+    content = json.loads(odapi.matrix_to_json(odapi.pivot_matrix(long_format)))
+    assert content['columns']['geo_value'] == [230, 261]
+    assert content['period_ref'] == {'2_pro100': '2022-12-31', '2_zahl': '2022-12-31', '10_zahl': '2023-12-31'}
+
+
+@pytest.mark.unit
+def test_pivot_empty_result():
+    table = pa.table({
+        'indicator_id': pa.array([], pa.int16()),
+        'measure_code': pa.array([], pa.string()),
+        'geo_value': pa.array([], pa.int16()),
+        'period_ref': pa.array([], pa.date32()),
+        'indicator_value_numeric': pa.array([], pa.decimal128(32, 9)),
+    })
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    assert odapi.pivot_matrix(buffer).column_names == ['geo_value']
+
+
+class RecordingPool(FakePool):
+
+    def __init__(self, content: bytes):
+        super().__init__(connection=self)
+        self.content = content
+        self.queries = []
+
+    async def copy_from_query(self, query, output, format):
+        self.queries.append(query)
+        await output(self.content)
+
+
+@pytest.mark.unit
+def test_matrix_latest_period_per_measure(offline_tables, long_format):
+    pool = RecordingPool(long_format.getvalue())
+    request = Request({'type': 'http', 'method': 'GET', 'path': '/matrix/polg', 'query_string': b'', 'headers': []})
+    asyncio.run(odapi.get_matrix(
+        request=request,
+        geo_code=odapi.GeoCode.polg,
+        indicator_id=[2, 10],
+        geo_value=None,
+        period_ref=None,
+        measure=None,
+        knowledge_date=None,
+        join_geo=None,
+        db_async=pool,
+        tables=offline_tables,
+        geo_dims=None,
+    ))
+    sql = pool.queries[0]
+    assert 'GROUP BY dbt_marts.mart_ogd_api_current.indicator_id, dbt_marts.mart_ogd_api_current.measure_code' in sql
+    assert 'measure_code IS NOT DISTINCT FROM latest.measure_code' in sql
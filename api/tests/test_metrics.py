@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi import Response
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+import odapi
+from tests.conftest import FakePool
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.middleware('http')(odapi.timing_middleware)
+
+    @app.get('/indicator/{geo_code}/{indicator_id}/csv')
+    def endpoint(geo_code: str, indicator_id: int):
+        with odapi.timed('copy'):
+            odapi.record_rows(3)
+        return Response(content=b'a\n1\n2\n3\n', headers={'X-Cache': 'MISS'})
+
+    app.get('/metrics')(odapi.get_metrics)
+    return TestClient(app)
+
+
+def sample(name: str, labels: dict) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.mark.unit
+def test_request_metrics(client):
+    route = '/indicator/{geo_code}/{indicator_id}/csv'
+    labels = {'route': route, 'format': 'csv'}
+    before = {
+        'requests': sample('odapi_request_duration_seconds_count', {**labels, 'geo_code': 'polg'}),
+        'bytes': sample('odapi_response_bytes_sum', labels),
+        'rows': sample('odapi_response_rows_sum', labels),
+        'copy': sample('odapi_copy_duration_seconds_count', {'route': route}),
+        'miss': sample('odapi_response_cache_requests_total', {'route': route, 'result': 'miss'}),
+    }
+    assert client.get('/indicator/polg/1/csv').status_code == 200
+    assert sample('odapi_request_duration_seconds_count', {**labels, 'geo_code': 'polg'}) == before['requests'] + 1
+    assert sample('odapi_response_bytes_sum', labels) == before['bytes'] + 8
+    assert sample('odapi_response_rows_sum', labels) == before['rows'] + 3
+    assert sample('odapi_copy_duration_seconds_count', {'route': route}) == before['copy'] + 1
+    assert sample('odapi_response_cache_requests_total', {'route': route, 'result': 'miss'}) == before['miss'] + 1
+
+
+@pytest.mark.unit
+def test_unknown_paths_share_one_label(client):
+    before = sample('odapi_request_duration_seconds_count', {'route': 'unmatched', 'format': '', 'geo_code': ''})
+    client.get('/does/not/exist')
+    client.get('/neither/this')
+    assert sample('odapi_request_duration_seconds_count', {'route': 'unmatched', 'format': '', 'geo_code': ''}) == before + 2
+
+
+@pytest.mark.unit
+def test_metrics_endpoint(client):
+    client.get('/indicator/kant/1/csv')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert 'odapi_request_duration_seconds_bucket{' in response.text
+
+
+class GaugeConnection:
+
+    def __init__(self):
+        self.in_use = None
+
+    async def copy_from_query(self, query, output, format):
+        self.in_use = sample('odapi_db_pool_connections', {'state': 'in_use'})
+        await output(b'PAR1')
+
+
+@pytest.mark.unit
+def test_pool_gauge_follows_acquire_and_release():
+    connection = GaugeConnection()
+    asyncio.run(odapi.copy_to_parquet(FakePool(connection), 'SELECT 1'))
+    assert connection.in_use == 1
+    assert sample('odapi_db_pool_connections', {'state': 'in_use'}) == 0
+    assert sample('odapi_db_pool_connections', {'state': 'idle'}) == 1
+
+
+@pytest.mark.unit
+def test_metrics_endpoint_samples_pool(client):
+    pool = FakePool(connection=None)
+    pool.in_use = 1
+    client.app.state.db_async = pool
+    assert 'odapi_db_pool_connections{state="in_use"} 1.0' in client.get('/metrics').text
@@ -0,0 +1,137 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import odapi
+
+
+@pytest.mark.unit
+def test_template_is_compiled_once(offline_engine, offline_tables):
+    templates = odapi.QueryTemplateCache()
+    shape = odapi.IndicatorQueryShape(geo_code=odapi.GeoCode.polg, filter_indicator_id=True)
+    calls = []
+
+    def build():
+        calls.append(shape)
+        return odapi.build_indicator_query(offline_tables, shape)
+
+    first = templates.get(shape, build)
+    second = templates.get(odapi.IndicatorQueryShape(geo_code=odapi.GeoCode.polg, filter_indicator_id=True), build)
+    assert first is second
+    assert len(calls) == 1
+
+
+@pytest.mark.unit
+def test_template_contains_placeholders_only(offline_engine, offline_tables):
+    templates = odapi.QueryTemplateCache()
+    shape = odapi.IndicatorQueryShape(
+        geo_code=odapi.GeoCode.kant,
+        filter_indicator_id=True,
+        filter_knowledge_date=True,
+        limit=True,
+    )
+    template = templates.get(shape, lambda: odapi.build_indicator_query(offline_tables, shape))
+    assert '%(indicator_id)s' in template
+    assert '%(knowledge_date)s' in template
+    assert '%(limit)s' in template
+    assert 'dim_gemeinde_latest' not in template
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('geometry_mode', list(odapi.GeometryMode))
+def test_template_per_geometry_mode(offline_engine, offline_tables, geometry_mode):
+    templates = odapi.QueryTemplateCache()
+    shape = odapi.IndicatorQueryShape(geo_code=odapi.GeoCode.bezk, geometry_mode=geometry_mode)
+    template = templates.get(shape, lambda: odapi.build_indicator_query(offline_tables, shape))
+    assert f'dim_bezirk_latest.{odapi.GEOMETRY_MODE_COLUMN[geometry_mode]}) AS geometry' in template
+
+
+@pytest.mark.unit
+def test_template_cache_is_bounded(offline_engine, offline_tables):
+    templates = odapi.QueryTemplateCache(maxsize=2)
+    for geo_code in odapi.GeoCode:
+        shape = odapi.IndicatorQueryShape(geo_code=geo_code)
+        templates.get(shape, lambda: odapi.build_indicator_query(offline_tables, shape))
+    assert len(templates) == 2
+
+
+@pytest.mark.unit
+def test_indicator_query_params():
+    params = odapi.indicator_query_params(
+        odapi.GeoCode.polg,
+        indicator_id=1,
+        knowledge_date='2024-01-01',
+        period_ref='2023-12-31',
+        measure=odapi.Measure.pro1000,
+    )
+    assert params['geo_code'] == 'polg'
+    assert params['knowledge_date'] == '2024-01-01'
+    assert params['period_ref'] == '2023-12-31'
+    assert params['measure'] == 'pro1000'
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    'value, literal',
+    [
+        (None, 'NULL'),
+        (230, '230'),
+        (True, 'TRUE'),
+        ('polg', "'polg'"),
+        ("O'Brien", "'O''Brien'"),
+        ("'; DROP TABLE x; --", "'''; DROP TABLE x; --'"),
+        ('C:\\temp\\', "'C:\\temp\\'"),
+        (odapi.Measure.zahl, "'zahl'"),
+    ],
+)
+def test_sql_literal(value, literal):
+    assert odapi.sql_literal(value) == literal
+
+
+class SettingsConnection:
+
+    def __init__(self, standard_conforming_strings):
+        self.settings = SimpleNamespace(standard_conforming_strings=standard_conforming_strings)
+
+    def get_settings(self):
+        return self.settings
+
+
+@pytest.mark.unit
+def test_pool_requires_standard_conforming_strings():
+    asyncio.run(odapi.check_standard_conforming_strings(SettingsConnection('on')))
+    with pytest.raises(RuntimeError):
+        asyncio.run(odapi.check_standard_conforming_strings(SettingsConnection('off')))
+
+
+@pytest.mark.unit
+def test_bind_template_fills_all_placeholders(offline_tables):
+    templates = odapi.QueryTemplateCache()
+    shape = odapi.IndicatorQueryShape(geo_code=odapi.GeoCode.polg, filter_indicator_id=True, filter_geo_value=True)
+    template = templates.get(shape, lambda: odapi.build_indicator_query(offline_tables, shape))
+    sql = odapi.bind_template(template, odapi.indicator_query_params(odapi.GeoCode.polg, indicator_id=1, geo_value=230))
+    assert '%(' not in sql
+    assert "mart_ogd_api_current.geo_code = 'polg'" in sql
+    assert 'mart_ogd_api_current.geo_value = 230' in sql
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('filter_knowledge_date, table_name', [
+    (False, 'dbt_marts.mart_ogd_api_current'),
+    (True, 'dbt_marts.full_mart_ogd_api'),
+])
+def test_current_rows_table(offline_tables, filter_knowledge_date, table_name):
+    shape = odapi.IndicatorQueryShape(geo_code=odapi.GeoCode.polg, filter_knowledge_date=filter_knowledge_date)
+    template = str(odapi.build_indicator_query(offline_tables, shape).compile(dialect=odapi.SQL_DIALECT))
+    assert f'FROM {table_name}' in template
+    assert ('knowledge_date_to' in template) == filter_knowledge_date
+
+
+@pytest.mark.unit
+def test_portrait_reads_current_rows_by_geo_value(offline_tables):
+    shape = odapi.IndicatorQueryShape(geo_code=odapi.GeoCode.polg, filter_geo_value=True, keyset=True, limit=True)
+    template = str(odapi.build_indicator_query(offline_tables, shape).compile(dialect=odapi.SQL_DIALECT))
+    assert 'FROM dbt_marts.mart_ogd_api_current' in template
+    assert 'mart_ogd_api_current.geo_value = %(geo_value)s' in template
+    assert 'full_mart_ogd_api' not in template
@@ -0,0 +1,209 @@
+import datetime as dt
+
+import pytest
+from fastapi import FastAPI
+from fastapi import Response
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import SQLAlchemyError
+
+import odapi
+
+
+class StaticDataVersion(odapi.DataVersion):
+
+    def __init__(self, versions, ttl=0):
+        super().__init__(engine=None, tables=None, ttl=ttl)
+        self.versions = list(versions)
+
+    def fetch(self):
+        return self.versions.pop(0) if len(self.versions) > 1 else self.versions[0]
+
+
+class Tomorrow(dt.date):
+
+    @classmethod
+    def today(cls):
+        return dt.date.fromordinal(TODAY.toordinal() + 1)
+
+
+TODAY = dt.date.today()
+
+
+@pytest.fixture
+def cached_app():
+    app = FastAPI()
+    app.middleware('http')(odapi.response_cache_middleware)
+    app.state.response_cache = odapi.ResponseCache(max_bytes=1024, max_entry_bytes=512)
+    app.state.data_version = StaticDataVersion(['1'])
+    app.state.calls = 0
+
+    @app.get('/values/{geo_code}')
+    def values(geo_code: str, size: int = 10):
+        app.state.calls += 1
+        return Response(content=b'x' * size, media_type='text/plain')
+
+    return app
+
+
+@pytest.mark.unit
+def test_response_cache_evicts_least_recently_used():
+    cache = odapi.ResponseCache(max_bytes=10, max_entry_bytes=10)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, odapi.CachedResponse(b'1234', 200, 'text/plain', {}))
+    assert len(cache) == 2
+    assert cache.size == 8
+    assert cache.get('a') is None
+    assert cache.get('c') is not None
+
+
+@pytest.mark.unit
+def test_response_cache_skips_big_entries():
+    cache = odapi.ResponseCache(max_bytes=100, max_entry_bytes=5)
+    cache.put('a', odapi.CachedResponse(b'123456', 200, 'text/plain', {}))
+    assert len(cache) == 0
+
+
+@pytest.mark.unit
+def test_response_cache_key_changes_with_today(monkeypatch):
+    request = odapi.Request({'type': 'http', 'method': 'GET', 'path': '/indicator/polg/1', 'query_string': b'', 'headers': []})
+    history = odapi.Request({'type': 'http', 'method': 'GET', 'path': '/indicator/polg/1', 'query_string': b'knowledge_date=2024-01-01', 'headers': []})
+    key = odapi.ResponseCache.key('1', request)
+    history_key = odapi.ResponseCache.key('1', history)
+    monkeypatch.setattr(odapi.dt, 'date', Tomorrow)
+    assert odapi.ResponseCache.key('1', request) != key
+    assert odapi.ResponseCache.key('1', history) == history_key
+
+
+@pytest.mark.unit
+def test_data_version_change_runs_callbacks():
+    data_version = StaticDataVersion(['1', '1', '2'])
+    changes = []
+    data_version.on_change(lambda: changes.append(True))
+    assert data_version.get() == '1'
+    assert data_version.get() == '1'
+    assert changes == []
+    assert data_version.get() == '2'
+    assert changes == [True]
+
+
+class FailingDataVersion(odapi.DataVersion):
+
+    def __init__(self, versions):
+        super().__init__(engine=None, tables=None, ttl=0)
+        self.versions = list(versions)
+
+    def fetch(self):
+        version = self.versions.pop(0)
+        if isinstance(version, Exception):
+            raise version
+        return version
+
+
+@pytest.mark.unit
+def test_data_version_keeps_previous_on_failed_lookup():
+    data_version = FailingDataVersion(['1', SQLAlchemyError('connection lost'), '1'])
+    changes = []
+    data_version.on_change(lambda: changes.append(True))
+    assert [data_version.get() for _ in range(3)] == ['1', '1', '1']
+    assert changes == []
+
+
+@pytest.mark.unit
+def test_data_version_runs_all_callbacks_when_one_fails():
+    data_version = StaticDataVersion(['1', '2'])
+    changes = []
+
+    def refresh():
+        raise SQLAlchemyError('connection lost')
+
+    data_version.on_change(refresh)
+    data_version.on_change(lambda: changes.append(True))
+    data_version.get()
+    assert data_version.get() == '2'
+    assert changes == [True]
+
+
+@pytest.mark.unit
+def test_data_version_is_polled_after_ttl_only():
+    data_version = StaticDataVersion(['1', '2'], ttl=3600)
+    assert data_version.get() == '1'
+    assert data_version.get() == '1'
+
+
+@pytest.mark.unit
+def test_middleware_serves_repeated_request_from_cache(cached_app):
+    with TestClient(cached_app) as client:
+        first = client.get('/values/polg?size=10')
+        second = client.get('/values/polg?size=10')
+        other = client.get('/values/polg?size=11')
+    assert first.headers['x-cache'] == 'MISS'
+    assert second.headers['x-cache'] == 'HIT'
+    assert other.headers['x-cache'] == 'MISS'
+    assert second.content == first.content
+    assert second.headers['content-type'] == first.headers['content-type']
+    assert cached_app.state.calls == 2
+
+
+@pytest.mark.unit
+def test_middleware_invalidates_on_new_data_version(cached_app):
+    cached_app.state.data_version = StaticDataVersion(['1', '2'])
+    cached_app.state.data_version.on_change(cached_app.state.response_cache.clear)
+    with TestClient(cached_app) as client:
+        client.get('/values/polg')
+        response = client.get('/values/polg')
+    assert response.headers['x-cache'] == 'MISS'
+    assert cached_app.state.calls == 2
+
+
+@pytest.mark.unit
+def test_middleware_bypasses_cache_without_data_version(cached_app):
+    cached_app.state.data_version = StaticDataVersion([None])
+    with TestClient(cached_app) as client:
+        client.get('/values/polg')
+        response = client.get('/values/polg')
+    assert 'x-cache' not in response.headers
+    assert cached_app.state.calls == 2
+
+
+@pytest.mark.unit
+def test_middleware_answers_matching_etag_with_not_modified(cached_app):
+    with TestClient(cached_app) as client:
+        first = client.get('/values/polg?size=10&a=1')
+        etag = first.headers['etag']
+        calls = cached_app.state.calls
+        second = client.get('/values/polg?a=1&size=10', headers={'If-None-Match': f'"other", W/{etag}'})
+    assert second.status_code == 304
+    assert second.headers['etag'] == etag
+    assert second.content == b''
+    assert cached_app.state.calls == calls
+
+
+@pytest.mark.unit
+def test_etag_changes_with_data_version_and_request(cached_app):
+    with TestClient(cached_app) as client:
+        etag = client.get('/values/polg?size=10').headers['etag']
+        assert client.get('/values/polg?size=11').headers['etag'] != etag
+        cached_app.state.data_version = StaticDataVersion(['2'])
+        response = client.get('/values/polg?size=10', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+
+
+@pytest.mark.unit
+def test_etag_changes_with_today(cached_app, monkeypatch):
+    with TestClient(cached_app) as client:
+        etag = client.get('/values/polg').headers['etag']
+        monkeypatch.setattr(odapi.dt, 'date', Tomorrow)
+        response = client.get('/values/polg', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+
+
+@pytest.mark.unit
+def test_etag_without_response_cache(cached_app):
+    cached_app.state.response_cache = odapi.ResponseCache(max_bytes=0)
+    with TestClient(cached_app) as client:
+        etag = client.get('/values/polg').headers['etag']
+        response = client.get('/values/polg', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert cached_app.state.calls == 1
@@ -0,0 +1,92 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from starlette.requests import Request
+
+import odapi
+from tests.conftest import FakePool
+
+
+class ExplainConnection:
+
+    def __init__(self):
+        self.explained = []
+
+    async def copy_from_query(self, query, output, format):
+        await output(b'PAR1')
+
+    async def fetchval(self, query, timeout=None):
+        self.explained.append(query)
+        return json.dumps([{'Plan': {'Node Type': 'Index Scan'}, 'Execution Time': 1.5}])
+
+
+def run_copy(slow_queries: odapi.SlowQueryLog, connection: ExplainConnection, output=None) -> odapi.Timings:
+    app = SimpleNamespace(state=SimpleNamespace(slow_queries=slow_queries))
+    request = Request({
+        'type': 'http', 'method': 'GET', 'path': '/indicator/polg/1', 'query_string': b'limit=10', 'headers': [], 'app': app,
+    })
+    timings = odapi.Timings()
+
+    async def run():
+        token = odapi._current_request.set(request)
+        timings_token = odapi._request_timings.set(timings)
+        try:
+            if output is None:
+                await odapi.copy_to_parquet(FakePool(connection), 'SELECT 1')
+            else:
+                await odapi.copy_to_output(FakePool(connection), 'SELECT 1', output)
+        finally:
+            odapi._request_timings.reset(timings_token)
+            odapi._current_request.reset(token)
+        if slow_queries._task is not None:
+            await slow_queries._task
+
+    asyncio.run(run())
+    return timings
+
+
+@pytest.mark.unit
+def test_slow_query_is_explained():
+    slow_queries = odapi.SlowQueryLog(threshold=0.0, sample_rate=1.0, maxlen=2)
+    connection = ExplainConnection()
+    run_copy(slow_queries, connection)
+    assert connection.explained == ['EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT 1']
+    [entry] = slow_queries.entries()
+    assert entry['path'] == '/indicator/polg/1'
+    assert entry['query_params'] == {'limit': '10'}
+    assert entry['sql'] == 'SELECT 1'
+    assert entry['plan'][0]['Plan']['Node Type'] == 'Index Scan'
+
+
+@pytest.mark.unit
+def test_ring_buffer_keeps_newest():
+    slow_queries = odapi.SlowQueryLog(threshold=0.0, sample_rate=1.0, maxlen=2)
+    for _ in range(3):
+        run_copy(slow_queries, ExplainConnection())
+    assert len(slow_queries) == 2
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('threshold, sample_rate', [(None, 1.0), (60.0, 1.0), (0.0, 0.0)])
+def test_fast_or_unsampled_queries_are_not_explained(threshold, sample_rate):
+    slow_queries = odapi.SlowQueryLog(threshold=threshold, sample_rate=sample_rate)
+    connection = ExplainConnection()
+    run_copy(slow_queries, connection)
+    assert connection.explained == []
+    assert len(slow_queries) == 0
+
+
+@pytest.mark.unit
+def test_slow_client_is_not_a_slow_query():
+    slow_queries = odapi.SlowQueryLog(threshold=0.05, sample_rate=1.0)
+    connection = ExplainConnection()
+
+    async def slow_client(data):
+        await asyncio.sleep(0.1)
+
+    timings = run_copy(slow_queries, connection, output=slow_client)
+    assert connection.explained == []
+    assert timings.phases['copy'] < 0.05
+    assert timings.phases['copy_wait'] >= 0.1
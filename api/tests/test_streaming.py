@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+import odapi
+from tests.conftest import FakePool
+
+
+class FakeConnection:
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+        self.written = 0
+        self.cancelled = False
+
+    async def copy_from_query(self, query, output, format):
+        assert format == 'parquet'
+        if self.error is not None:
+            raise self.error
+        try:
+            for chunk in self.chunks:
+                await output(chunk)
+                self.written += 1
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+async def collect(pool):
+    stream = await odapi.stream_copy_to_parquet(pool, 'SELECT 1')
+    return [chunk async for chunk in stream]
+
+
+@pytest.mark.unit
+def test_stream_returns_all_bytes_in_order():
+    chunks = [bytes([i]) * 1000 for i in range(200)]
+    result = asyncio.run(collect(FakePool(FakeConnection(chunks))))
+    assert b''.join(result) == b''.join(chunks)
+
+
+@pytest.mark.unit
+def test_stream_merges_small_chunks():
+    result = asyncio.run(collect(FakePool(FakeConnection([b'x'] * 10))))
+    assert result == [b'x' * 10]
+
+
+@pytest.mark.unit
+def test_stream_raises_error_before_first_chunk():
+    connection = FakeConnection([], error=RuntimeError('relation does not exist'))
+    with pytest.raises(RuntimeError):
+        asyncio.run(collect(FakePool(connection)))
+
+
+@pytest.mark.unit
+def test_stream_stops_copy_when_client_disconnects():
+    chunk_size = odapi.COPY_STREAM_CHUNK_BYTES
+    connection = FakeConnection([b'x' * chunk_size] * (odapi.COPY_STREAM_QUEUE_SIZE * 10))
+
+    async def read_first_chunk_only():
+        stream = await odapi.stream_copy_to_parquet(FakePool(connection), 'SELECT 1')
+        await anext(stream)
+        await stream.aclose()
+        await asyncio.sleep(0)
+
+    asyncio.run(read_first_chunk_only())
+    assert connection.cancelled
+    assert connection.written < len(connection.chunks)
+
+
+@pytest.mark.unit
+def test_stream_stops_copy_when_never_iterated():
+    chunk_size = odapi.COPY_STREAM_CHUNK_BYTES
+    connection = FakeConnection([b'x' * chunk_size] * (odapi.COPY_STREAM_QUEUE_SIZE * 10))
+
+    async def drop_unstarted():
+        stream = await odapi.stream_copy_to_parquet(FakePool(connection), 'SELECT 1')
+        await stream.aclose()
+        await asyncio.sleep(0)
+        # Checked before asyncio.run cancels the remaining tasks.
+        assert connection.cancelled
+
+    asyncio.run(drop_unstarted())
+
+
+class BlockingConnection:
+
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.cancelled = False
+
+    async def copy_from_query(self, query, output, format):
+        self.started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+@pytest.mark.unit
+def test_stream_stops_copy_when_cancelled_before_first_chunk():
+    connection = BlockingConnection()
+
+    async def cancel_request():
+        request = asyncio.create_task(odapi.stream_copy_to_parquet(FakePool(connection), 'SELECT 1'))
+        await connection.started.wait()
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        await asyncio.sleep(0)
+        # Checked before asyncio.run cancels the remaining tasks.
+        assert connection.cancelled
+
+    asyncio.run(cancel_request())
+
+
+@pytest.mark.unit
+def test_response_stops_copy_when_client_is_gone_before_start():
+    chunk_size = odapi.COPY_STREAM_CHUNK_BYTES
+    connection = FakeConnection([b'x' * chunk_size] * (odapi.COPY_STREAM_QUEUE_SIZE * 10))
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        raise OSError('client disconnected')
+
+    async def respond():
+        stream = await odapi.stream_copy_to_parquet(FakePool(connection), 'SELECT 1')
+        response = odapi.CopyStreamingResponse(content=stream)
+        with pytest.raises(Exception):
+            await response({'type': 'http', 'asgi': {'spec_version': '2.4'}}, receive, send)
+        await asyncio.sleep(0)
+        assert connection.cancelled
+
+    asyncio.run(respond())
+
+
+@pytest.mark.unit
+def test_copy_to_parquet_collects_all_chunks():
+    buffer = asyncio.run(odapi.copy_to_parquet(FakePool(FakeConnection([b'a', b'b'])), 'SELECT 1'))
+    assert buffer.getvalue() == b'ab'
@@ -0,0 +1,43 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy import text
+from sqlalchemy.pool import StaticPool
+
+import odapi
+
+
+class TableDummy(odapi.TableDefinition):
+    SCHEMA = 'main'
+    TABLE_NAME = 'dummy'
+
+
+@pytest.fixture
+def registry():
+    engine = create_engine('sqlite://', poolclass=StaticPool)
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE dummy (id INTEGER PRIMARY KEY, name TEXT)'))
+    yield odapi.TableRegistry(engine)
+    engine.dispose()
+
+
+@pytest.mark.unit
+def test_table_is_reflected_once(registry):
+    table = registry.get_table(TableDummy)
+    assert set(table.c.keys()) == {'id', 'name'}
+    assert registry.get_table(TableDummy) is table
+
+
+@pytest.mark.unit
+def test_alias_is_reused(registry):
+    alias = registry.get_table(TableDummy, alias='tbl_dummy_1')
+    assert registry.get_table(TableDummy, alias='tbl_dummy_1') is alias
+    assert registry.get_table(TableDummy, alias='tbl_dummy_2') is not alias
+
+
+@pytest.mark.unit
+def test_refresh_reflects_again(registry):
+    table = registry.get_table(TableDummy)
+    assert registry.reflected_tables == ['main.dummy']
+    registry.refresh()
+    assert registry.reflected_tables == []
+    assert registry.get_table(TableDummy) is not table
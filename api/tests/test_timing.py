@@ -0,0 +1,57 @@
+import json
+import logging
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import odapi
+
+
+@pytest.mark.unit
+def test_server_timing_header_value():
+    timings = odapi.Timings()
+    timings.add('compile', 0.0012)
+    timings.add('copy', 0.02)
+    timings.add('compile', 0.0008)
+    assert timings.server_timing(total=0.05) == 'compile;dur=2.0, copy;dur=20.0, total;dur=50.0'
+
+
+@pytest.mark.unit
+def test_phases_are_only_recorded_within_a_request():
+    with odapi.timed('compile'):
+        pass
+    timings = odapi.Timings()
+    token = odapi._request_timings.set(timings)
+    try:
+        assert list(odapi.timed_iter('decode', [1, 2, 3])) == [1, 2, 3]
+        odapi.record_rows(3)
+    finally:
+        odapi._request_timings.reset(token)
+    assert list(timings.phases) == ['decode']
+    assert timings.rows == 3
+
+
+@pytest.mark.unit
+def test_timing_middleware_sets_header_and_logs(caplog):
+    app = FastAPI()
+    app.middleware('http')(odapi.timing_middleware)
+
+    @app.get('/indicator')
+    def endpoint():
+        with odapi.timed('copy'):
+            odapi.record_rows(2)
+        return [1, 2]
+
+    # The level of the logger is not forced here, odapi configures it on import.
+    assert odapi.logger.getEffectiveLevel() == logging.INFO
+    response = TestClient(app).get('/indicator?limit=2')
+    assert response.status_code == 200
+    assert response.headers['server-timing'].startswith('copy;dur=')
+    assert ', total;dur=' in response.headers['server-timing']
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record['path'] == '/indicator'
+    assert record['query'] == 'limit=2'
+    assert record['bytes'] == len(response.content)
+    assert record['rows'] == 2
+    assert set(record['phases_ms']) == {'copy'}
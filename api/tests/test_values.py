@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+import odapi
+from tests.conftest import FakePool
+
+
+class RecordingConnection:
+
+    def __init__(self):
+        self.queries = []
+
+    async def copy_from_query(self, query, output, format):
+        self.queries.append(query)
+        await output(b'PAR1')
+
+
+def values_sql(offline_tables, knowledge_date=None, measure=None) -> str:
+    connection = RecordingConnection()
+    request = Request({'type': 'http', 'method': 'GET', 'path': '/values/polg/parquet', 'query_string': b'', 'headers': []})
+
+    async def run():
+        response = await odapi.get_numbers(
+            request=request,
+            geo_code=odapi.GeoCode.polg,
+            measure=measure,
+            knowledge_date=knowledge_date,
+            skip=None,
+            limit=None,
+            cursor=None,
+            fields=None,
+            db_async=FakePool(connection),
+            tables=offline_tables,
+        )
+        [chunk async for chunk in response.body_iterator]
+
+    asyncio.run(run())
+    return connection.queries[0]
+
+
+@pytest.mark.unit
+def test_values_read_latest_table(offline_tables):
+    sql = values_sql(offline_tables, measure=odapi.Measure.zahl)
+    assert 'FROM dbt_marts.mart_ogd_api_latest' in sql
+    assert 'SELECT DISTINCT ON (dbt_marts.mart_ogd_api_latest.indicator_id, dbt_marts.mart_ogd_api_latest.geo_value)' in sql
+    assert '_is_total' not in sql
+    assert 'knowledge_date' not in sql
+    assert "mart_ogd_api_latest.measure_code = 'zahl'" in sql
+
+
+@pytest.mark.unit
+def test_values_with_knowledge_date_read_history(offline_tables):
+    sql = values_sql(offline_tables, knowledge_date='2024-01-01')
+    assert 'FROM dbt_marts.full_mart_ogd_api' in sql
+    assert 'full_mart_ogd_api._group_value_1_is_total = true' in sql
+    assert "full_mart_ogd_api.knowledge_date_from <= '2024-01-01'" in sql
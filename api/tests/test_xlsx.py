@@ -0,0 +1,39 @@
+import datetime as dt
+import io
+
+import openpyxl
+import pyarrow as pa
+import pytest
+import shapely
+from fastapi import HTTPException
+
+import odapi
+from tests.conftest import make_parquet
+
+
+@pytest.mark.unit
+def test_xlsx_writes_all_rows_with_wkt():
+    point = shapely.Point(8.5, 47.3)
+    table = pa.table({
+        'geo_value': [230, 261, 261],
+        'period_ref': [dt.date(2023, 12, 31)] * 3,
+        'indicator_name': ['=SUM(A1)', 'b', None],
+        'geometry': pa.array([shapely.to_wkb(point), None, shapely.to_wkb(point)], pa.binary()),
+    })
+    content = b''.join(odapi.iter_file(odapi.parquet_to_xlsx(make_parquet(table), batch_rows=2)))
+    rows = list(openpyxl.load_workbook(io.BytesIO(content))['odapi_data'].values)
+    assert rows[0] == ('geo_value', 'period_ref', 'indicator_name', 'geometry')
+    assert rows[1] == (230, dt.datetime(2023, 12, 31), '=SUM(A1)', point.wkt)
+    assert rows[2] == (261, dt.datetime(2023, 12, 31), 'b', None)
+    assert rows[3][3] == point.wkt
+    assert len(rows) == 4
+
+
+@pytest.mark.unit
+def test_xlsx_rejects_too_many_rows(monkeypatch):
+    monkeypatch.setattr(odapi, 'EXCEL_MAX_ROWS', 2)
+    table = pa.table({'geo_value': [1, 2, 3]})
+    with pytest.raises(HTTPException) as excinfo:
+        odapi.parquet_to_xlsx(make_parquet(table))
+    assert excinfo.value.status_code == 413
+    assert '3 rows' in excinfo.value.detail
@@ -12,7 +12,7 @@ from odapi.utils.dbt_handling import load_data_models
     compute_kind='python',
     group_name='marts',
     key=['marts', 'mart_ogd_api'],
-    description=f"Partitioned parent table for OGD API data.",
+    description=f"Partitioned parent table for OGD API data, tables with its current rows and latest values.",
     deps=[
         AssetKey(['marts', model.model_name])
         for model in load_data_models(
@@ -26,6 +26,21 @@ def _asset(
 ) -> None:
     PARENT_SCHEMA = 'dbt_marts'
     PARENT_TABLE = 'mart_ogd_api'
+    VERSION_TABLE = 'mart_ogd_api_version'
+    CURRENT_TABLE = 'mart_ogd_api_current'
+    STAGING_TABLE = 'mart_ogd_api_current_new'
+    LATEST_TABLE = 'mart_ogd_api_latest'
+    # Columns of the parent table, which are copied to the current table.
+    CURRENT_COLUMNS = (
+        'indicator_id', 'geo_code', 'geo_value', 'knowledge_date_from', 'knowledge_date_to',
+        'period_type', 'period_code', 'period_ref_from', 'period_ref',
+        *(
+            name
+            for i in range(1, 5)
+            for name in (f'group_{i}_id', f'group_value_{i}_id', f'_group_value_{i}_is_total')
+        ),
+        'indicator_value_numeric', 'indicator_value_text', 'measure_code', 'source_id',
+    )
 
     def indicators_per_model() -> dict[str, list[int]]:
         indicators_dict = {}
@@ -116,13 +131,169 @@ def _asset(
                 """
         return partitions_sql
 
+    def sql_current_table() -> str:
+        # Most API requests only query the current rows (without knowledge_date).
+        # They are stored in a separate table, which does not grow with the history.
+        # Time travel queries still use the parent table with all versions.
+        # The rows are copied to a new table, while the API still reads the previous one.
+        # sql_swap_current_table() replaces it afterwards in a short transaction.
+        # Index has the sort key of the keyset pagination, like macro mart_partition.
+        # indicator_value_text is fetched from the table: a long text would exceed the
+        # maximum size of an index entry (about 1/3 of a page) and fail CREATE INDEX.
+        not_covered = ('geo_code', 'geo_value', 'indicator_id', 'period_ref', 'indicator_value_text')
+        portrait_columns = [
+            name for name in CURRENT_COLUMNS
+            if name not in not_covered and not name.startswith('knowledge_date')
+        ]
+        return f"""
+            DROP TABLE IF EXISTS {PARENT_SCHEMA}.{STAGING_TABLE};
+            -- /indicator is the most requested endpoint. The rows are written in the order
+            -- of the select, therefore an indicator is stored in contiguous pages.
+            CREATE TABLE {PARENT_SCHEMA}.{STAGING_TABLE} AS
+                SELECT {', '.join(CURRENT_COLUMNS)}
+                FROM {PARENT_SCHEMA}.{PARENT_TABLE}
+                WHERE knowledge_date_to IS NULL
+                ORDER BY geo_code, indicator_id, geo_value, period_ref;
+            CREATE INDEX {STAGING_TABLE}_keyset_idx ON {PARENT_SCHEMA}.{STAGING_TABLE} (
+                geo_code
+                , indicator_id
+                , geo_value
+                , period_ref
+                , coalesce(measure_code, '')
+                , coalesce(group_value_1_id, 0)
+                , coalesce(group_value_2_id, 0)
+                , coalesce(group_value_3_id, 0)
+                , coalesce(group_value_4_id, 0)
+            );
+            -- Portraits filter by geo_value, their rows are spread over all indicators.
+            -- The index includes the columns of the API except indicator_value_text, so a
+            -- portrait reads contiguous index pages and only fetches the text from the table.
+            CREATE INDEX {STAGING_TABLE}_geo_idx ON {PARENT_SCHEMA}.{STAGING_TABLE} (
+                geo_code
+                , geo_value
+                , indicator_id
+                , period_ref
+                , coalesce(measure_code, '')
+                , coalesce(group_value_1_id, 0)
+                , coalesce(group_value_2_id, 0)
+                , coalesce(group_value_3_id, 0)
+                , coalesce(group_value_4_id, 0)
+            ) INCLUDE ({', '.join(portrait_columns)});
+            ALTER TABLE {PARENT_SCHEMA}.{STAGING_TABLE} CLUSTER ON {STAGING_TABLE}_keyset_idx;
+            ANALYZE {PARENT_SCHEMA}.{STAGING_TABLE};
+            GRANT SELECT ON {PARENT_SCHEMA}.{STAGING_TABLE} TO odapi_public;
+        """
+
+    def sql_swap_current_table() -> str:
+        # Dropping and renaming lock the current table, the API waits only for these
+        # statements and not for the copy of the rows above.
+        return f"""
+            DROP TABLE IF EXISTS {PARENT_SCHEMA}.{CURRENT_TABLE};
+            ALTER TABLE {PARENT_SCHEMA}.{STAGING_TABLE} RENAME TO {CURRENT_TABLE};
+            ALTER INDEX {PARENT_SCHEMA}.{STAGING_TABLE}_keyset_idx RENAME TO {CURRENT_TABLE}_keyset_idx;
+            ALTER INDEX {PARENT_SCHEMA}.{STAGING_TABLE}_geo_idx RENAME TO {CURRENT_TABLE}_geo_idx;
+        """
+
+    def sql_latest_table() -> str:
+        # Latest value per indicator, geo_value and measure for the API endpoint /values.
+        # Maintained incrementally from the new current rows: only new or changed values
+        # are written and values, which do not exist anymore, are deleted.
+        # Part of the publish transaction, readers never see new latest values
+        # together with the previous current table or data version.
+        latest_key = "geo_code, indicator_id, geo_value, coalesce(measure_code, '')"
+        is_total = ' AND '.join(f'_group_value_{i}_is_total' for i in range(1, 5))
+        return f"""
+            CREATE TABLE IF NOT EXISTS {PARENT_SCHEMA}.{LATEST_TABLE} (
+                indicator_id            SMALLINT                        NOT NULL
+                , geo_code              CHAR(4)                         NOT NULL
+                , geo_value             SMALLINT                        NOT NULL
+                , measure_code          TEXT                            NULL
+                , period_ref_from       DATE                            NULL
+                , period_ref            DATE                            NULL
+                , indicator_value_numeric NUMERIC(32,9)                 NULL
+                , source_id             SMALLINT                        NULL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS {LATEST_TABLE}_key_idx ON {PARENT_SCHEMA}.{LATEST_TABLE} (
+                {latest_key}
+            );
+            -- Sort order of the DISTINCT ON in the API.
+            CREATE INDEX IF NOT EXISTS {LATEST_TABLE}_values_idx ON {PARENT_SCHEMA}.{LATEST_TABLE} (
+                geo_code
+                , indicator_id
+                , geo_value
+                , period_ref_from DESC
+            );
+            INSERT INTO {PARENT_SCHEMA}.{LATEST_TABLE} AS latest (
+                indicator_id, geo_code, geo_value, measure_code,
+                period_ref_from, period_ref, indicator_value_numeric, source_id
+            )
+                SELECT DISTINCT ON ({latest_key})
+                    indicator_id, geo_code, geo_value, measure_code,
+                    period_ref_from, period_ref, indicator_value_numeric, source_id
+                FROM {PARENT_SCHEMA}.{STAGING_TABLE}
+                WHERE {is_total}
+                ORDER BY {latest_key}, period_ref_from DESC
+            ON CONFLICT ({latest_key}) DO UPDATE SET
+                period_ref_from = EXCLUDED.period_ref_from
+                , period_ref = EXCLUDED.period_ref
+                , indicator_value_numeric = EXCLUDED.indicator_value_numeric
+                , source_id = EXCLUDED.source_id
+            WHERE (latest.period_ref_from, latest.period_ref, latest.indicator_value_numeric, latest.source_id)
+                IS DISTINCT FROM
+                (EXCLUDED.period_ref_from, EXCLUDED.period_ref, EXCLUDED.indicator_value_numeric, EXCLUDED.source_id);
+            DELETE FROM {PARENT_SCHEMA}.{LATEST_TABLE} AS latest
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM {PARENT_SCHEMA}.{STAGING_TABLE} AS cur
+                WHERE cur.geo_code = latest.geo_code
+                    AND cur.indicator_id = latest.indicator_id
+                    AND cur.geo_value = latest.geo_value
+                    AND coalesce(cur.measure_code, '') = coalesce(latest.measure_code, '')
+                    AND {' AND '.join(f'cur._group_value_{i}_is_total' for i in range(1, 5))}
+            );
+            GRANT SELECT ON {PARENT_SCHEMA}.{LATEST_TABLE} TO odapi_public;
+        """
+
+    def sql_data_version() -> str:
+        # The API caches responses per data version. A new row invalidates
+        # these caches, therefore it must be written after the partitions are attached.
+        return f"""
+            CREATE TABLE IF NOT EXISTS {PARENT_SCHEMA}.{VERSION_TABLE} (
+                data_version            BIGSERIAL                       PRIMARY KEY
+                , published_at          TIMESTAMP WITH TIME ZONE        NOT NULL DEFAULT now()
+            );
+            GRANT SELECT ON {PARENT_SCHEMA}.{VERSION_TABLE} TO odapi_public;
+            INSERT INTO {PARENT_SCHEMA}.{VERSION_TABLE} DEFAULT VALUES;
+        """
+
     def build_query() -> str:
         full_query = ''
         full_query += sql_parent_table()
         full_query += sql_func_attach_partition()
         full_query += sql_attach_partition()
+        full_query += sql_current_table()
         context.log.info(f'Full SQL for parent table and partitions:\n{full_query}')
         return full_query
 
-    with db.get_sqlalchemy_engine().begin() as connection:
+    def build_publish_query() -> str:
+        # The latest table is written before the swap, the current table is
+        # only locked for the statements of the swap.
+        full_query = ''
+        full_query += sql_latest_table()
+        full_query += sql_swap_current_table()
+        full_query += sql_data_version()
+        context.log.info(f'Full SQL to publish the current and latest table:\n{full_query}')
+        return full_query
+
+    engine = db.get_sqlalchemy_engine()
+    with engine.begin() as connection:
         connection.execute(text(build_query()))
+    # VACUUM can not run in a transaction. It sets the visibility map of the new
+    # table, which the index only scans of the portraits rely on.
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text(f'VACUUM {PARENT_SCHEMA}.{STAGING_TABLE}'))
+    with engine.begin() as connection:
+        connection.execute(text(build_publish_query()))
+    # Removes the rows replaced by the upsert and updates the statistics.
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text(f'VACUUM ANALYZE {PARENT_SCHEMA}.{LATEST_TABLE}'))
@@ -1,5 +1,25 @@
 {% macro mart_partition() %}
 
+    {#- Sort key of the keyset pagination in the API (INDICATOR_KEYSET in odapi.py).
+        NULLs are replaced, because a row comparison with NULL is never true. #}
+    {{ config(
+        indexes=[
+            {
+                'columns': [
+                    'geo_code',
+                    'indicator_id',
+                    'geo_value',
+                    'period_ref',
+                    "coalesce(measure_code, '')",
+                    'coalesce(group_value_1_id, 0)',
+                    'coalesce(group_value_2_id, 0)',
+                    'coalesce(group_value_3_id, 0)',
+                    'coalesce(group_value_4_id, 0)',
+                ],
+            },
+        ]
+    ) }}
+
     {%- set base_name = modules.re.sub('__.*$', '', model.name) -%}
     {%- set upstream_model_name = modules.re.sub('^mart_', 'intm_', base_name) ~ '__typecast' -%}
 